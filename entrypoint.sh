@@ -5,9 +5,10 @@ cd freelancer/
 
 case "$1" in
   web)
-    echo "Starting Gunicorn (Django web)..."
+    echo "Starting Uvicorn (Django web, ASGI)..."
     python manage.py migrate --noinput
-    exec gunicorn freelancer.wsgi:application --bind 0.0.0.0:8000 --workers 3
+    # ASGI so notification streams hold a coroutine rather than a worker each
+    exec uvicorn freelancer.asgi:application --host 0.0.0.0 --port 8000 --workers 3
     ;;
   celery)
     echo "Starting Celery worker..."
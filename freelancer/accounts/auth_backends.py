@@ -1,5 +1,6 @@
 from django.contrib.auth.backends import ModelBackend
-from .models import User
+from django.db.models import Q, Prefetch
+from .models import User, UserRole
 
 
 class EmailOrPhoneBackend(ModelBackend):
@@ -7,18 +8,25 @@ class EmailOrPhoneBackend(ModelBackend):
     Custom authentication backend that allows users to log in with either email or phone.
     """
 
+    def get_login_queryset(self):
+        # Everything the login response needs (address, roles) comes with the user
+        return User.objects.select_related('address').prefetch_related(
+            Prefetch('user_roles', queryset=UserRole.objects.select_related('role'))
+        )
+
     def authenticate(self, request, username=None, password=None, **kwargs):
-        user = None
-        if username:
-            try:
-                user = User.objects.get(email=username)
-            except User.DoesNotExist:
-                try:
-                    user = User.objects.get(phone=username)
-                except User.DoesNotExist:
-                    return None
-        
-        if user and user.check_password(password) and self.user_can_authenticate(user):
+        if not username or password is None:
+            return None
+
+        # email and phone are both unique, so this is one indexed lookup; an email match wins
+        users = list(self.get_login_queryset().filter(Q(email=username) | Q(phone=username))[:2])
+        user = next((user for user in users if user.email == username), users[0] if users else None)
+
+        if user is None:
+            # Hash anyway so unknown usernames take as long as wrong passwords
+            User().set_password(password)
+            return None
+
+        if user.check_password(password) and self.user_can_authenticate(user):
             return user
         return None
-        
\ No newline at end of file
@@ -0,0 +1,71 @@
+from io import BytesIO
+import os
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+
+DERIVATIVE_WIDTHS = (320, 640, 1024)
+WEBP_QUALITY = 80
+
+
+def derivative_name(name, width, extension):
+    root, _ = os.path.splitext(name)
+    return f"{root}_w{width}.{extension}"
+
+
+def generate_image_derivatives(field_file, widths=DERIVATIVE_WIDTHS):
+    """
+    Write downscaled copies of an image next to the original, each in the original
+    format and as WebP. Existing copies are left in place. Returns the variants map stored on the model:
+    {"320": {"default": "<name>", "webp": "<name>"}, ...}
+    Widths larger than the original are skipped, images are never upscaled.
+    """
+    storage = field_file.storage
+    with field_file.open('rb') as source:
+        data = source.read()
+
+    variants = {}
+    with Image.open(BytesIO(data)) as image:
+        image_format = image.format or 'JPEG'
+        image = ImageOps.exif_transpose(image)
+        extension = 'jpg' if image_format == 'JPEG' else image_format.lower()
+
+        for width in widths:
+            if width >= image.width:
+                continue
+            height = round(image.height * width / image.width)
+            resized = image.resize((width, height), Image.LANCZOS)
+
+            variant = {}
+            for key, save_format, save_extension, options in (
+                ('default', image_format, extension, {'optimize': True}),
+                ('webp', 'WEBP', 'webp', {'quality': WEBP_QUALITY}),
+            ):
+                frame = resized.convert('RGB') if save_format == 'JPEG' and resized.mode not in ('RGB', 'L') else resized
+                output = BytesIO()
+                frame.save(output, format=save_format, **options)
+                # Never deleted first: if the name is taken, the storage either picks a free one or
+                # replaces the object in one write. Callers drop the copies that were replaced.
+                name = derivative_name(field_file.name, width, save_extension)
+                variant[key] = storage.save(name, ContentFile(output.getvalue()))
+            variants[str(width)] = variant
+
+    return variants
+
+
+def delete_image_derivatives(storage, variants):
+    for variant in (variants or {}).values():
+        for name in variant.values():
+            if storage.exists(name):
+                storage.delete(name)
+
+
+def derivative_srcset(storage, variants):
+    """
+    Map stored variants to URLs, grouped by format: {"default": {"320w": url}, "webp": {"320w": url}}.
+    """
+    srcset = {}
+    for width, variant in sorted((variants or {}).items(), key=lambda item: int(item[0])):
+        for key, name in variant.items():
+            srcset.setdefault(key, {})[f"{width}w"] = storage.url(name)
+    return srcset
@@ -0,0 +1,59 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import strip_tags
+from accounts.models import User
+from accounts.rendering import CampaignEmail
+
+
+class Command(BaseCommand):
+    help = "Compare rendering a campaign email per recipient with the pre-rendered CampaignEmail path."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=1000)
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--template', default='notification.html')
+
+    def handle(self, *args, **options):
+        context = {
+            'subject': 'Benchmark campaign',
+            'body': '<p>Nova ponuda je dostupna u vašem gradu.</p>',
+        }
+        # Unsaved users: the benchmark measures rendering only, no database access
+        users = [User(id=index, first_name=f"Korisnik {index} & co" if index % 10 else '') for index in range(options['recipients'])]
+
+        def per_recipient():
+            for user in users:
+                html = render_to_string(options['template'], context={**context, 'user': user, 'year': timezone.now().year})
+                strip_tags(html)
+
+        def pre_rendered():
+            campaign = CampaignEmail(options['template'], context, {'first_name': 'tamo'})
+            for user in users:
+                campaign.render(user)
+
+        # Both paths have to produce the same bodies
+        campaign = CampaignEmail(options['template'], context, {'first_name': 'tamo'})
+        for user in users[:20]:
+            html = render_to_string(options['template'], context={**context, 'user': user, 'year': timezone.now().year})
+            if campaign.render(user) != (html, strip_tags(html)):
+                self.stderr.write(self.style.ERROR(f"Output differs for user {user.id}"))
+                return
+
+        results = {}
+        for label, run in (('per recipient', per_recipient), ('pre-rendered', pre_rendered)):
+            run()  # warm the template cache
+            timings = []
+            for _ in range(options['rounds']):
+                started = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[label] = statistics.median(timings)
+            self.stdout.write(
+                f"{label:>13}: median {results[label]:.1f} ms for {len(users)} messages "
+                f"({results[label] * 1000 / len(users):.1f} µs/message)"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"speedup: {results['per recipient'] / results['pre-rendered']:.1f}x"))
@@ -0,0 +1,60 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from accounts.models import User, Role, UserRole, Address
+from accounts.views import LoginView
+
+
+class Command(BaseCommand):
+    help = "Time LoginView and count its queries, for a known user and for an unknown username."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # Everything runs in a transaction that is rolled back, so no benchmark data is left behind
+        with transaction.atomic():
+            user = User.objects.create_user(
+                email='login-benchmark@example.com',
+                first_name='Login',
+                last_name='Benchmark',
+                phone='+000000000000',
+                password='benchmark-password',
+                address=Address.objects.create(country='HR', city='Zagreb'),
+                is_verified=True,
+            )
+            role, _ = Role.objects.get_or_create(id='CUSTOMER', defaults={'label': 'Customer', 'description': 'Customer'})
+            UserRole.objects.create(user=user, role=role)
+
+            for label, username, password in (
+                ('email', user.email, 'benchmark-password'),
+                ('phone', user.phone, 'benchmark-password'),
+                ('unknown user', 'nobody@example.com', 'benchmark-password'),
+            ):
+                self.report(label, self.run(username, password, options['iterations']))
+
+            transaction.set_rollback(True)
+
+    def run(self, username, password, iterations):
+        factory = APIRequestFactory()
+        view = LoginView.as_view(throttle_classes=[])
+        timings, queries = [], []
+        for _ in range(iterations):
+            request = factory.post('/api/v1/login/', {'username': username, 'password': password}, format='json')
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                view(request)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured))
+        return timings, queries
+
+    def report(self, label, results):
+        timings, queries = results
+        self.stdout.write(
+            f"{label:>13}: {statistics.mean(queries):.1f} queries/call, "
+            f"mean {statistics.mean(timings):.1f} ms, median {statistics.median(timings):.1f} ms, "
+            f"max {max(timings):.1f} ms over {len(timings)} calls"
+        )
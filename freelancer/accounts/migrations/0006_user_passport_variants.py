@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_user_certificate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='passport_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
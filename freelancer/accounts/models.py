@@ -5,6 +5,10 @@ from django.core.validators import validate_email
 from django.utils.translation import gettext_lazy as _
 import pyotp
 from django_countries.fields import CountryField
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .roles import get_user_roles, invalidate_user_roles, bump_role_version
 
 
 class UserManager(BaseUserManager):
@@ -57,6 +61,9 @@ class User(AbstractBaseUser, PermissionsMixin):
         ('pending', 'Pending'),
     ]
     
+    # File fields a user submits for verification
+    DOCUMENT_FIELDS = ['document_front', 'document_back', 'certificate', 'selfie', 'business_reg', 'auth_letter']
+    
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
     email = models.EmailField(unique=True)
@@ -65,6 +72,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     website = models.CharField(max_length=100, null=True, blank=True)
     status = models.CharField(max_length=30, choices=STATUS_CHOICES, default='active')
     passport = models.ImageField(upload_to='passport/', null=True, blank=True)
+    # Responsive copies written by accounts.tasks.generate_passport_derivatives (see accounts.images)
+    passport_variants = models.JSONField(default=dict, blank=True)
     is_active = models.BooleanField(default=True)
     is_verified = models.BooleanField(default=False)
     otp_secret = models.CharField(max_length=32, blank=True, null=True)
@@ -81,6 +90,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     updated_at = models.DateTimeField(auto_now=True)
     selfie = models.ImageField(upload_to='selfie/', null=True, blank=True) 
     deactivation_requested_at = models.DateTimeField(null=True, blank=True)
+    # Bumped on every role change; tokens signed with an older version lose their role claims
+    role_version = models.PositiveIntegerField(default=0)
     
     objects = UserManager()
     
@@ -90,6 +101,16 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
     
+    def save(self, *args, update_fields=None, **kwargs):
+        # role_version only moves through bump_role_version's atomic increment: a full save of an
+        # instance loaded before a bump must not write the old version back
+        if update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'role_version'
+            ]
+        super().save(*args, update_fields=update_fields, **kwargs)
+    
     @property
     def get_full_name(self):
         return f"{self.first_name} {self.last_name}"
@@ -111,11 +132,47 @@ class User(AbstractBaseUser, PermissionsMixin):
         Check if the user has any of the given role IDs.
         Example: user.has_role("SUPER", "FINANCE")
         """
-        return self.user_roles.filter(role__id__in=role_ids).exists()
+        return any(role_id in get_user_roles(self) for role_id in role_ids)
     @property
     def is_admin(self) -> bool:
         """Check if user has any role marked as admin"""
-        return self.user_roles.filter(role__is_admin=True).exists()
+        return any(get_user_roles(self).values())
+
+@receiver(pre_save, sender=User)
+def remember_previous_passport(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._passport_changed = False
+    if raw or (update_fields is not None and 'passport' not in update_fields):
+        return
+    stored_name = User.objects.filter(pk=instance.pk).values_list('passport', flat=True).first() if instance.pk else None
+    instance._passport_changed = (stored_name or '') != (instance.passport.name or '')
+
+
+@receiver(post_save, sender=User)
+def queue_passport_derivatives(sender, instance, raw=False, **kwargs):
+    if raw or not getattr(instance, '_passport_changed', False):
+        return
+    from .tasks import generate_passport_derivatives
+    transaction.on_commit(lambda: generate_passport_derivatives.delay(instance.id))
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_role_version(sender, instance, raw=False, **kwargs):
+    # The cached version doubles as the "still active" check of token-claim authentication
+    if not raw:
+        invalidate_user_roles(instance.id)
+
+
+class ConfirmedUpload(models.Model):
+    """
+    Storage key of a direct upload whose token was already redeemed (see accounts.uploads).
+    """
+    key = models.CharField(max_length=255, primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    confirmed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.key
+
 
 class Address(models.Model):
     country = CountryField()
@@ -149,4 +206,23 @@ class UserRole(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
-        return f"{self.user.get_full_name} - {self.role.label}"
\ No newline at end of file
+        return f"{self.user.get_full_name} - {self.role.label}"
+
+
+@receiver(post_save, sender=UserRole)
+@receiver(post_delete, sender=UserRole)
+def invalidate_roles_on_user_role_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_role_version(instance.user_id)
+    # A user object already holding its roles (e.g. request.user) sees the change too
+    if UserRole.user.is_cached(instance):
+        instance.user.__dict__.pop('_roles_cache', None)
+
+
+@receiver(post_save, sender=Role)
+def invalidate_roles_on_role_change(sender, instance, created=False, raw=False, **kwargs):
+    # The cached roles carry each role's is_admin flag
+    if raw or created:
+        return
+    bump_role_version(*instance.role_users.values_list('user_id', flat=True))
@@ -2,10 +2,35 @@ from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.exceptions import ParseError
 from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from django.db.models import Q
+import base64
+import hashlib
+import json
+import secrets
 
 
 class CustomOffsetPagination(LimitOffsetPagination):
+    """
+    Page-number pagination returning `count` and `results`.
+
+    Views that declare a `cursor_ordering` (e.g. `('-created_at', '-id')`) also support
+    keyset pagination: clients opt in by sending `?cursor=` (empty for the first page) and
+    follow `next_cursor` from then on. Cursor pages skip the COUNT query (`count` is null)
+    and seek through the ordering index instead of scanning past an OFFSET. Views with
+    `cursor_pagination_only = True` stay unpaginated unless a cursor is requested.
+    A cursor is refused (400) when the queryset is sorted by something else first, e.g.
+    `?ordering=` or search rank, rather than silently replacing that order.
+    """
     default_limit = 20
+    cursor_query_param = 'cursor'
+    cursor_mode = False
+    
+    def get_page_limit(self, request: Request):
+        try:
+            return int(request.query_params.get("limit", self.default_limit))
+        except ValueError:
+            return self.default_limit
     
     def get_offset(self, request: Request, limit:int):
         try:
@@ -22,11 +47,15 @@ class CustomOffsetPagination(LimitOffsetPagination):
     
     def paginate_queryset(self, queryset, request, view=None):
         self.request = request
-        try:
-            limit = int(request.query_params.get("limit", self.default_limit))
-        except ValueError:
-            limit = self.default_limit
+        cursor_ordering = getattr(view, 'cursor_ordering', None)
         
+        if cursor_ordering and self.cursor_query_param in request.query_params and not isinstance(queryset, list):
+            return self.paginate_queryset_by_cursor(queryset, request, cursor_ordering)
+        
+        if getattr(view, 'cursor_pagination_only', False):
+            return None
+        
+        limit = self.get_page_limit(request)
         offset = self.get_offset(request, limit)
         self.count = len(queryset) if isinstance(queryset, list) else queryset.count()
         self.offset = offset
@@ -37,6 +66,63 @@ class CustomOffsetPagination(LimitOffsetPagination):
 
         return list(queryset[offset:offset + limit])
     
+    def paginate_queryset_by_cursor(self, queryset, request, ordering):
+        limit = self.get_page_limit(request)
+        if limit < 1:
+            raise ParseError("Limit must be greater than 0.")
+        
+        current_ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+        if current_ordering and current_ordering[0] != ordering[0]:
+            raise ParseError("Cursor pagination is not available with this ordering.")
+        
+        self.cursor_mode = True
+        self.count = None
+        self.limit = limit
+        fields = [field.lstrip('-') for field in ordering]
+        descending = ordering[0].startswith('-')
+        
+        queryset = queryset.order_by(*ordering)
+        position = self.decode_cursor(request.query_params.get(self.cursor_query_param), queryset.model, fields)
+        if position:
+            queryset = queryset.filter(self.get_keyset_filter(fields, position, descending))
+        
+        # Fetch one extra row to know whether there is a next page
+        rows = list(queryset[:limit + 1])
+        self.next_cursor = self.encode_cursor(rows[limit - 1], fields) if len(rows) > limit else None
+        return rows[:limit]
+    
+    def get_keyset_filter(self, fields, position, descending):
+        """
+        Rows strictly after `position` in the ordering, e.g. for (created_at, id) descending:
+        created_at < X OR (created_at = X AND id < Y).
+        """
+        lookup = 'lt' if descending else 'gt'
+        keyset_filter = Q()
+        for index, field in enumerate(fields):
+            step = Q(**{f'{field}__{lookup}': position[index]})
+            for previous_field, previous_value in zip(fields[:index], position[:index]):
+                step &= Q(**{previous_field: previous_value})
+            keyset_filter |= step
+        return keyset_filter
+    
+    def encode_cursor(self, instance, fields):
+        values = []
+        for field in fields:
+            value = getattr(instance, field)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+    
+    def decode_cursor(self, cursor, model, fields):
+        if not cursor:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(fields):
+                raise ValueError
+            return [model._meta.get_field(field).to_python(value) for field, value in zip(fields, values)]
+        except Exception:
+            raise ParseError("Invalid cursor.")
+    
     def get_paginated_response(self, data, extra_data = None):
         """
         Modify the response to include extra metadata (e.g., pending/rejected counts).
@@ -46,8 +132,109 @@ class CustomOffsetPagination(LimitOffsetPagination):
             'results': data
         }
         
+        if self.cursor_mode:
+            response_data['next_cursor'] = self.next_cursor
+        
         # Merge extra data (like pending and rejected counts)
         if extra_data:
             response_data.update(extra_data)
 
-        return Response(response_data)
\ No newline at end of file
+        return Response(response_data)
+
+
+class SeededShufflePagination(CustomOffsetPagination):
+    """
+    Pages through a queryset in a stable pseudo-random order without `order_by('?')`.
+
+    Every row carries several independently drawn, indexed random integers
+    (`shuffle_fields`), each fixing its own shuffled order of the table. A client seed
+    picks one of those orders, a direction to walk it in and a pivot in its key space;
+    the feed walks the keys from the pivot to the end, then wraps around to the start.
+    Different seeds therefore see different sequences, not one cycle entered at another
+    point. Pages are keyset reads over (shuffle field, id) after the position in `cursor`:
+    they never overlap or skip rows and cost the same however deep the client scrolls.
+    The cursor carries the seed; clients follow `next` (or send `next_cursor` back).
+    There is no total count.
+    """
+    shuffle_fields = ('shuffle_key', 'shuffle_key_1', 'shuffle_key_2', 'shuffle_key_3')
+    shuffle_key_space = 2 ** 31
+    
+    def get_seed(self, request):
+        seed = request.query_params.get('seed')
+        return seed[:64] if seed else secrets.token_hex(4)
+    
+    def get_shuffle(self, seed):
+        """
+        (field, descending, pivot) the seed walks the feed by.
+        """
+        digest = int(hashlib.sha256(seed.encode()).hexdigest()[:16], 16)
+        digest, choice = divmod(digest, len(self.shuffle_fields) * 2)
+        field, descending = self.shuffle_fields[choice // 2], bool(choice % 2)
+        return field, descending, digest % self.shuffle_key_space
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        limit = self.get_page_limit(request)
+        if limit < 1:
+            raise ParseError("Limit must be greater than 0.")
+        
+        self.cursor_mode = True
+        self.count = None
+        self.limit = limit
+        self.seed, wrapped, position = self.decode_shuffle_cursor(request)
+        shuffle_field, descending, pivot = self.get_shuffle(self.seed)
+        
+        fields = (shuffle_field, 'id')
+        ordering = [f'-{field}' for field in fields] if descending else fields
+        queryset = queryset.order_by()
+        # From the pivot to the end of the key space in the walking direction, then from
+        # the other end back up to the pivot
+        above = queryset.filter(**{f'{shuffle_field}__gte': pivot})
+        below = queryset.filter(**{f'{shuffle_field}__lt': pivot})
+        segments = [(False, below), (True, above)] if descending else [(False, above), (True, below)]
+        
+        # Resolve the page keys first, so the rows (and their prefetches) load in one pass.
+        # One extra key tells whether there is a next page.
+        keys = []
+        for segment_wrapped, segment in segments:
+            if wrapped and not segment_wrapped:
+                continue
+            if position and segment_wrapped == wrapped:
+                segment = segment.filter(self.get_keyset_filter(fields, position, descending))
+            keys += [
+                (segment_wrapped, *key)
+                for key in segment.order_by(*ordering).values_list(*fields)[:limit + 1 - len(keys)]
+            ]
+            if len(keys) > limit:
+                break
+        
+        self.next_cursor = self.encode_shuffle_cursor(*keys[limit - 1]) if len(keys) > limit else None
+        page_ids = [pk for _, _, pk in keys[:limit]]
+        rows = queryset.in_bulk(page_ids)
+        return [rows[pk] for pk in page_ids if pk in rows]
+    
+    def encode_shuffle_cursor(self, wrapped, shuffle_key, pk):
+        payload = {'seed': self.seed, 'wrapped': wrapped, 'position': [shuffle_key, pk]}
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+    
+    def decode_shuffle_cursor(self, request):
+        """
+        (seed, wrapped, position) of the requested page; a new or `?seed=` seed from the start without a cursor.
+        """
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return self.get_seed(request), False, None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            shuffle_key, pk = (int(value) for value in payload['position'])
+            return str(payload['seed'])[:64], bool(payload['wrapped']), [shuffle_key, pk]
+        except Exception:
+            raise ParseError("Invalid cursor.")
+    
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+    
+    def get_paginated_response(self, data, extra_data = None):
+        return super().get_paginated_response(data, {'seed': self.seed, 'next': self.get_next_link(), **(extra_data or {})})
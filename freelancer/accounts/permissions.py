@@ -37,4 +37,4 @@ class IsAdminOrOwner(permissions.BasePermission):
             return True
 
         # Allow if the user is the owner and their document is verified
-        return obj.created_by == request.user and request.user.document_status == 'verified' and request.user.user_roles.filter(role__id='SERVICE_PROVIDER').exists()
\ No newline at end of file
+        return obj.created_by == request.user and request.user.document_status == 'verified' and request.user.has_role('SERVICE_PROVIDER')
\ No newline at end of file
@@ -0,0 +1,43 @@
+"""
+Pre-rendered email bodies for campaigns.
+
+A campaign sends the same template to many users with only a few user fields
+changing. CampaignEmail renders the template (and strips the plain-text part)
+once with a unique placeholder in place of each of those fields, then fills the
+placeholders per recipient with plain string replacement. Compiled templates are
+already reused between renders: Django wraps the configured loaders in the
+cached loader.
+
+Only fields the template prints as-is (optionally through `default`) can be
+substituted this way; pass the template's `default` value as the fallback.
+"""
+from uuid import uuid4
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import escape, strip_tags
+
+
+class CampaignEmail:
+    def __init__(self, file, context, recipient_fields=None):
+        """
+        `recipient_fields` maps each per-recipient `user.<field>` the template prints to
+        the value used when the user's is empty, e.g. {"first_name": "tamo"}.
+        """
+        self.recipient_fields = recipient_fields or {}
+        self.placeholders = {field: f"[[recipient-{field}-{uuid4().hex}]]" for field in self.recipient_fields}
+
+        shared_context = {**context, 'user': self.placeholders, 'year': timezone.now().year}
+        self.html = render_to_string(file, context=shared_context)
+        self.text = strip_tags(self.html)
+
+    def render(self, user):
+        """
+        (html, text) bodies for one recipient.
+        """
+        html, text = self.html, self.text
+        for field, placeholder in self.placeholders.items():
+            # The template would have auto-escaped the value, and strip_tags keeps entities as they are
+            value = escape(getattr(user, field, None) or self.recipient_fields[field])
+            html = html.replace(placeholder, value)
+            text = text.replace(placeholder, value)
+        return html, text
@@ -0,0 +1,81 @@
+"""
+Role resolution for permission checks.
+
+A user's roles are loaded once per user object (so once per request, since the
+authentication backend builds a fresh user for every request) and shared across
+requests through the cache. The receivers in accounts.models drop the cache entry
+and bump `User.role_version` whenever a UserRole row or a Role's admin flag changes.
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+
+ROLE_CACHE_TIMEOUT = 60 * 60
+
+
+def role_cache_key(user_id):
+    return f"accounts:user-roles:{user_id}"
+
+
+def role_version_cache_key(user_id):
+    return f"accounts:role-version:{user_id}"
+
+
+def get_user_roles(user):
+    """
+    {role_id: is_admin} for every role of `user`, memoized on the instance.
+    """
+    roles = getattr(user, '_roles_cache', None)
+    if roles is not None:
+        return roles
+
+    prefetched = getattr(user, '_prefetched_objects_cache', {}).get('user_roles')
+    if prefetched is not None and all(user_role.__class__.role.is_cached(user_role) for user_role in prefetched):
+        user._roles_cache = {user_role.role_id: user_role.role.is_admin for user_role in prefetched}
+        return user._roles_cache
+
+    key = role_cache_key(user.pk)
+    roles = cache.get(key)
+    if roles is None:
+        roles = dict(user.user_roles.values_list('role_id', 'role__is_admin'))
+        cache.set(key, roles, ROLE_CACHE_TIMEOUT)
+
+    user._roles_cache = roles
+    return roles
+
+
+def invalidate_user_roles(*user_ids):
+    """
+    Drop the cached roles and role versions of the given users, now and again once the current
+    transaction commits, so a concurrent request cannot re-cache the old roles.
+    """
+    keys = [key(user_id) for user_id in user_ids for key in (role_cache_key, role_version_cache_key)]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_role_version(user_id):
+    """
+    Current `role_version` of an active user, None for inactive or unknown users.
+    """
+    key = role_version_cache_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = get_user_model().objects.filter(pk=user_id, is_active=True).values_list('role_version', flat=True).first()
+        if version is not None:
+            cache.set(key, version, ROLE_CACHE_TIMEOUT)
+    return version
+
+
+def bump_role_version(*user_ids):
+    """
+    Invalidate the role claims already signed into the users' tokens.
+    """
+    if not user_ids:
+        return
+    get_user_model().objects.filter(pk__in=user_ids).update(role_version=F('role_version') + 1)
+    invalidate_user_roles(*user_ids)
@@ -2,9 +2,11 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from .models import Role, UserRole, Address
 from django.db import transaction
-from rest_framework_simplejwt.tokens import RefreshToken
 from .tasks import send_email
 from .utils import create_default_availability
+from .images import derivative_srcset
+from .uploads import confirm_upload, redeem_upload
+from .tokens import RoleClaimsRefreshToken
 
 User = get_user_model()
 
@@ -13,8 +15,9 @@ class UserSerializer(serializers.ModelSerializer):
     
     def to_representation(self, instance):
         user = super().to_representation(instance)
-        user['roles'] = [role.role.label for role in instance.user_roles.all()] if instance.user_roles.exists() else []
+        user['roles'] = [role.role.label for role in instance.user_roles.all()]
         user['address'] = AddressSerializer(instance.address).data if instance.address else None
+        user['passport_srcset'] = derivative_srcset(instance.passport.storage, instance.passport_variants)
         return user
 
     class Meta:
@@ -82,9 +85,9 @@ class AddressSerializer(serializers.ModelSerializer):
         
 def get_tokens_for_user(user):
     """
-    Generate JWT tokens for a user.
+    Generate JWT tokens for a user, with role claims (see accounts.tokens).
     """
-    refresh = RefreshToken.for_user(user)
+    refresh = RoleClaimsRefreshToken.for_user(user)
     return {
         'refresh': str(refresh),
         'access': str(refresh.access_token),
@@ -119,42 +122,70 @@ class ChangePasswordSerializer(serializers.Serializer):
         
         return data
     
+class UploadSlotSerializer(serializers.Serializer):
+    filename = serializers.CharField(max_length=255)
+    content_type = serializers.CharField(max_length=100)
+
+
+class DocumentUploadSlotSerializer(UploadSlotSerializer):
+    field = serializers.ChoiceField(choices=User.DOCUMENT_FIELDS)
+
+
 class DocumentSerializer(serializers.ModelSerializer):
     role = serializers.PrimaryKeyRelatedField(queryset=Role.objects.all(), write_only =True)
+    # {"document_front": "<upload token>", ...} for files uploaded directly to storage
+    uploads = serializers.DictField(child=serializers.CharField(), write_only=True, required=False)
+    
     class Meta:
         model = User
-        fields = ['oib', 'vat', 'document_type', 'document_front', 'document_back', 'certificate', 'selfie', 'business_reg', 'auth_letter', 'auth_letter', 'role']
+        fields = ['oib', 'vat', 'document_type', 'document_front', 'document_back', 'certificate', 'selfie', 'business_reg', 'auth_letter', 'auth_letter', 'role', 'uploads']
+        
+    def validate_uploads(self, value):
+        unknown = set(value) - set(User.DOCUMENT_FIELDS)
+        if unknown:
+            raise serializers.ValidationError(f"Unknown document fields: {', '.join(sorted(unknown))}.")
+        return value
         
     def update(self, instance, validated_data):
         user = instance
+        request = self.context['request']
         role = validated_data.pop('role')
         
+        uploads = {
+            field: confirm_upload(request, token, field=field)
+            for field, token in validated_data.pop('uploads', {}).items()
+        }
+        
         if not role:
             raise serializers.ValidationError({"error": "Role is required."})
         
-        if role.id == 'SERVICE_PROVIDER' and user.document_status == 'submitted' and user.user_roles.filter(role__id='SERVICE_PROVIDER').exists():
+        if role.id == 'SERVICE_PROVIDER' and user.document_status == 'submitted' and user.has_role('SERVICE_PROVIDER'):
             raise serializers.ValidationError({"error": "Document has already been submitted."})
         
-        for attr, value in validated_data.items():
-            setattr(user, attr, value)
-        
-        user.document_status = 'submitted'  
-        user.save()
-        
-        # Create default availability for SERVICE_PROVIDER role
-        if role.id == 'SERVICE_PROVIDER':
-            create_default_availability(user)
+        # Upload tokens are only spent if the documents are saved
+        with transaction.atomic():
+            for field, key in uploads.items():
+                redeem_upload(request, key)
+                validated_data[field] = key
             
-        
-        
-        UserRole.objects.get_or_create(user=user, role=role)
-        
-        # Assign CUSTOMER role by default
-        try:
-            customer_role = Role.objects.get(id='CUSTOMER')
-            UserRole.objects.get_or_create(user=user, role=customer_role)
-        except Role.DoesNotExist:
-            raise serializers.ValidationError({"error": "Default CUSTOMER role not found."})
+            for attr, value in validated_data.items():
+                setattr(user, attr, value)
+            
+            user.document_status = 'submitted'  
+            user.save()
+            
+            # Create default availability for SERVICE_PROVIDER role
+            if role.id == 'SERVICE_PROVIDER':
+                create_default_availability(user)
+            
+            UserRole.objects.get_or_create(user=user, role=role)
+            
+            # Assign CUSTOMER role by default
+            try:
+                customer_role = Role.objects.get(id='CUSTOMER')
+                UserRole.objects.get_or_create(user=user, role=customer_role)
+            except Role.DoesNotExist:
+                raise serializers.ValidationError({"error": "Default CUSTOMER role not found."})
         
         context = {
             "subject": "Document updated",
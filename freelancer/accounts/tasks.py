@@ -1,4 +1,5 @@
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
+from smtplib import SMTPException, SMTPServerDisconnected
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.conf import settings
@@ -10,62 +11,228 @@ from django.contrib.auth import get_user_model
 from accounts.models import User
 from django.utils.timezone import now
 from adsApp.models import Ad
+from listing.visibility import refresh_listing_visibility
+from .images import generate_image_derivatives, delete_image_derivatives
+from PIL import UnidentifiedImageError
+from .rendering import CampaignEmail
 
 User = get_user_model()
 
 logger = logging.getLogger(__name__)
 
-@shared_task
-def send_email(context, file=None):
-    user_id = context.get('user')
-    email = context.get('email')
-    context['user'] = User.objects.filter(id=user_id).first() if user_id else None
-    
-    if context.get('booking'):
-        from bookingApp.models import Booking
-        context['booking'] = Booking.objects.filter(id=context['booking']).first()
-    
-    if context.get('listing'):
-        from listing.models import Listing
-        context['listing'] = Listing.objects.filter(id=context['listing']).first()
-    
-    if context.get('payment'):
-        from paymentApp.models import Payment
-        context['payment'] = Payment.objects.filter(id=context['payment']).first()
-    
-    if context.get('ad'):
-        from adsApp.models import Ad
-        context['ad'] = Ad.objects.filter(id=context['ad']).first()
-    
-    
-    recipient_email = email or (
+EMAIL_BATCH_SIZE = 50
+
+
+def _email_context_querysets():
+    from bookingApp.models import Booking
+    from listing.models import Listing
+    from paymentApp.models import Payment
+
+    # Context ids are swapped for these objects, with what the templates render already joined
+    return {
+        'user': User.objects.all(),
+        'booking': Booking.objects.select_related(
+            'listing__service', 'listing__location', 'listing__category', 'requester', 'canceled_by'
+        ),
+        'listing': Listing.objects.select_related('service', 'location', 'category'),
+        'payment': Payment.objects.select_related('listing__service'),
+        'ad': Ad.objects.select_related('listing__service'),
+    }
+
+
+def load_email_contexts(contexts):
+    """
+    Replace the object ids in the given contexts by the objects, with one query per kind of object.
+    """
+    for kind, queryset in _email_context_querysets().items():
+        ids = {context[kind] for context in contexts if context.get(kind)}
+        objects = queryset.in_bulk(ids) if ids else {}
+        for context in contexts:
+            if context.get(kind):
+                context[kind] = objects.get(context[kind])
+            elif kind == 'user':
+                context['user'] = None
+
+
+def build_email(context, file):
+    recipient_email = context.get('email') or (
         context['user'].email if context.get('user') else None
     )
-
     if not recipient_email:
-        logger.error("Email not sent: recipient email missing")
-        return
+        return None
 
     context['year'] = timezone.now().year
-    
+    html_message = render_to_string(file, context=context)
+
+    email = EmailMultiAlternatives(
+        subject=context['subject'],
+        body=strip_tags(html_message),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[recipient_email],
+    )
+    email.attach_alternative(html_message, 'text/html')
+    return email
+
+
+def deliver_emails(messages):
+    """
+    Render and send [{"context": {...}, "file": "<template>"}, ...] over a single mail connection.
+    Returns {"sent": <count>, "failed": [{"index", "recipient", "error"}, ...]}; a message that
+    fails is reported and the rest of the batch still goes out. Errors opening the connection raise.
+    """
+    contexts = [dict(message['context']) for message in messages]
+    load_email_contexts(contexts)
+
+    report = {'sent': 0, 'failed': []}
+
+    def fail(index, recipient, error):
+        logger.error(f"Error sending email {index} to {recipient}: {error}")
+        report['failed'].append({'index': index, 'recipient': recipient, 'error': str(error)})
+
+    emails = []
+    for index, (message, context) in enumerate(zip(messages, contexts)):
+        try:
+            email = build_email(context, message.get('file'))
+        except Exception as e:
+            fail(index, context.get('email'), e)
+            continue
+        if email is None:
+            fail(index, None, "recipient email missing")
+            continue
+        emails.append((index, email))
+
+    send_over_connection(emails, report, fail)
+    return report
+
+
+def send_over_connection(emails, report, fail):
+    """
+    Send [(index, email), ...] over one mail connection, counting successes in `report`
+    and passing each failed message to `fail(index, recipient, error)`.
+    """
+    if not emails:
+        return
+
+    connection = get_connection(fail_silently=False)
+    # The only error allowed to escape: nothing has been sent yet, so callers may retry the batch
+    connection.open()
     try:
-        html_message = render_to_string(file, context=context)
-        plain_message = strip_tags(html_message)
+        for position, (index, email) in enumerate(emails):
+            email.connection = connection
+            try:
+                email.send(fail_silently=False)
+            except SMTPServerDisconnected:
+                # The server dropped the session mid-batch: reconnect once and retry this message
+                try:
+                    connection.close()
+                    connection.open()
+                except Exception as e:
+                    # Earlier messages are out, so report the rest as failed instead of raising
+                    for index, email in emails[position:]:
+                        fail(index, email.to[0], e)
+                    return
+                try:
+                    email.send(fail_silently=False)
+                except Exception as e:
+                    fail(index, email.to[0], e)
+                    continue
+            except Exception as e:
+                fail(index, email.to[0], e)
+                continue
+            report['sent'] += 1
+    finally:
+        connection.close()
+
+
+def queue_emails(messages, batch_size=EMAIL_BATCH_SIZE):
+    """
+    Queue messages for send_email_batch, `batch_size` per task.
+    """
+    for start in range(0, len(messages), batch_size):
+        send_email_batch.delay(messages[start:start + batch_size])
+
+
+@shared_task(bind=True, max_retries=3)
+def send_email_batch(self, messages):
+    try:
+        return deliver_emails(messages)
+    except (SMTPException, OSError) as e:
+        # Only raised when the connection cannot be opened, before anything was sent
+        raise self.retry(exc=e, countdown=60 * 2 ** self.request.retries)
+
+
+def deliver_campaign_emails(context, file, user_ids, recipient_fields=None):
+    """
+    Send one template to many users: the body is rendered once (see accounts.rendering)
+    and only the recipient fields are filled in per user. Failures are reported by user id.
+    """
+    campaign = CampaignEmail(file, context, recipient_fields)
+    users = User.objects.filter(id__in=user_ids).only('id', 'email', *campaign.recipient_fields)
+
+    report = {'sent': 0, 'failed': []}
+
+    def fail(user_id, recipient, error):
+        logger.error(f"Error sending campaign email to user {user_id} ({recipient}): {error}")
+        report['failed'].append({'user': user_id, 'recipient': recipient, 'error': str(error)})
 
-        d_email = EmailMultiAlternatives(
+    emails = []
+    for user in users:
+        html, text = campaign.render(user)
+        email = EmailMultiAlternatives(
             subject=context['subject'],
-            body=plain_message,
+            body=text,
             from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[recipient_email],
+            to=[user.email],
         )
+        email.attach_alternative(html, 'text/html')
+        emails.append((user.id, email))
+
+    # Deleted since they were picked, or never existed: reported rather than silently dropped
+    for user_id in set(user_ids) - {user_id for user_id, _ in emails}:
+        fail(user_id, None, "User not found.")
 
-        d_email.attach_alternative(html_message, 'text/html')
-        d_email.send(fail_silently=False)
+    send_over_connection(emails, report, fail)
+    return report
 
+
+@shared_task
+def send_email(context, file=None):
+    try:
+        return deliver_emails([{'context': context, 'file': file}])
     except Exception as e:
         logger.error(f"Error sending email: {e}")
         
 
+@shared_task(bind=True, max_retries=3)
+def generate_passport_derivatives(self, user_id):
+    """
+    Write the responsive widths and WebP copies of a user's passport photo, dropping the old ones.
+    """
+    user = User.objects.filter(id=user_id).first()
+    if not user:
+        return
+
+    storage = user.passport.storage
+    variants = {}
+    if user.passport:
+        try:
+            variants = generate_image_derivatives(user.passport)
+        except UnidentifiedImageError as e:
+            logger.error(f"Passport of user {user_id} is not a readable image: {e}")
+            return
+        except OSError as e:
+            # Storage hiccups are worth another go
+            if self.request.retries < self.max_retries:
+                raise self.retry(exc=e, countdown=30 * 2 ** self.request.retries)
+            logger.exception(f"Passport derivatives failed for user {user_id}: {e}")
+            return
+
+    # Point the row at the new copies before dropping the ones they replace
+    User.objects.filter(id=user_id).update(passport_variants=variants)
+    stale = {width: names for width, names in user.passport_variants.items() if names not in variants.values()}
+    delete_image_derivatives(storage, stale)
+
+
 @shared_task
 def delete_inactive_users():
     cutoff = timezone.now() - timedelta(days=23)
@@ -82,7 +249,12 @@ def delete_inactive_users():
 
 @shared_task
 def expire_ads_if_needed():
-    Ad.objects.filter(
+    expired_ads = Ad.objects.filter(
         end_date__lt=now(),
         status='active'
-    ).update(status='expired')
+    )
+    listing_ids = list(expired_ads.values_list('listing_id', flat=True).distinct())
+    expired_ads.update(status='expired')
+    
+    # Queryset updates skip the Ad signals, so refresh the visibility of the affected listings here
+    refresh_listing_visibility(listing_ids=listing_ids)
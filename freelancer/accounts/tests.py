@@ -1,3 +1,369 @@
-from django.test import TestCase
+from smtplib import SMTPServerDisconnected
+from unittest.mock import patch
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from adminHandlers.serializers import AdminSerializer
+from .models import User, Role, UserRole, Address
+from .auth_backends import EmailOrPhoneBackend
+from .serializers import get_tokens_for_user
+from .tokens import RoleClaimsJWTAuthentication, RoleClaimsUser
+from .tasks import send_email_batch, deliver_emails, deliver_campaign_emails
+from .rendering import CampaignEmail
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import strip_tags
 
-# Create your tests here.
+
+@override_settings(
+    DIRECT_UPLOAD_BACKEND='accounts.uploads.LocalUploadBackend',
+    STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+)
+class DocumentDirectUploadTest(TestCase):
+    def setUp(self):
+        Role.objects.create(id='CUSTOMER', label='Customer', description='Customer')
+        Role.objects.create(id='SERVICE_PROVIDER', label='Service Provider', description='Provider')
+        self.user = User.objects.create_user(
+            email='provider@example.com', first_name='Test', last_name='User', phone='0911111111', password='password123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, field):
+        slot = self.client.post('/api/v1/document/upload-slot/', {
+            'field': field, 'filename': 'id.pdf', 'content_type': 'application/pdf',
+        }, format='json').json()
+        file = SimpleUploadedFile('id.pdf', b'%PDF-1.4', content_type='application/pdf')
+        response = APIClient().post(slot['url'], {**slot['fields'], 'file': file}, format='multipart')
+        self.assertEqual(response.status_code, 204)
+        return slot
+
+    def test_documents_are_recorded_from_upload_tokens(self):
+        slot = self.upload('document_front')
+        response = self.client.patch(f'/api/v1/document/{self.user.id}/', {
+            'role': 'SERVICE_PROVIDER', 'document_type': 'id_card', 'uploads': {'document_front': slot['token']},
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.document_front.name, slot['key'])
+        self.assertEqual(self.user.document_status, 'submitted')
+
+    def test_token_cannot_be_used_for_another_field(self):
+        slot = self.upload('document_front')
+        response = self.client.patch(f'/api/v1/document/{self.user.id}/', {
+            'role': 'SERVICE_PROVIDER', 'uploads': {'document_back': slot['token']},
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_token_is_redeemed_once(self):
+        slot = self.upload('document_front')
+        response = self.client.patch(f'/api/v1/document/{self.user.id}/', {
+            'role': 'CUSTOMER', 'uploads': {'document_front': slot['token']},
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+        response = self.client.patch(f'/api/v1/document/{self.user.id}/', {
+            'role': 'CUSTOMER', 'uploads': {'document_front': slot['token']},
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Upload token has already been used.')
+
+    def test_failed_update_does_not_spend_the_token(self):
+        slot = self.upload('document_front')
+        Role.objects.filter(id='CUSTOMER').delete()
+        response = self.client.patch(f'/api/v1/document/{self.user.id}/', {
+            'role': 'SERVICE_PROVIDER', 'uploads': {'document_front': slot['token']},
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.document_status, 'pending')
+
+        Role.objects.create(id='CUSTOMER', label='Customer', description='Customer')
+        response = self.client.patch(f'/api/v1/document/{self.user.id}/', {
+            'role': 'SERVICE_PROVIDER', 'uploads': {'document_front': slot['token']},
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.document_front.name, slot['key'])
+
+    def test_slot_takes_a_single_file(self):
+        slot = self.upload('document_front')
+        file = SimpleUploadedFile('other.pdf', b'%PDF-1.7', content_type='application/pdf')
+        response = APIClient().post(slot['url'], {**slot['fields'], 'file': file}, format='multipart')
+        self.assertEqual(response.status_code, 409)
+        with default_storage.open(slot['key']) as stored:
+            self.assertEqual(stored.read(), b'%PDF-1.4')
+
+
+class RoleCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Role.objects.create(id='CUSTOMER', label='Customer', description='Customer')
+        Role.objects.create(id='SUPER', label='Super Admin', description='Admin', is_admin=True)
+        self.user = User.objects.create_user(
+            email='customer@example.com', first_name='Test', last_name='User', phone='0911111111', password='password123',
+        )
+        UserRole.objects.create(user=self.user, role_id='CUSTOMER')
+
+    def test_roles_are_memoized_and_shared_across_requests(self):
+        with self.assertNumQueries(1):
+            self.assertFalse(self.user.is_admin)
+            self.assertTrue(self.user.has_role('CUSTOMER'))
+            self.assertFalse(self.user.has_role('SUPER'))
+
+        # A fresh user object (the next request) reads the shared cache
+        user = User.objects.get(id=self.user.id)
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_role('CUSTOMER'))
+
+    def test_role_changes_invalidate_the_cache(self):
+        self.assertFalse(self.user.is_admin)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user_role = UserRole.objects.create(user=self.user, role_id='SUPER')
+        self.assertTrue(User.objects.get(id=self.user.id).is_admin)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            role = Role.objects.get(id='SUPER')
+            role.is_admin = False
+            role.save()
+        self.assertFalse(User.objects.get(id=self.user.id).is_admin)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user_role.delete()
+        self.assertFalse(User.objects.get(id=self.user.id).has_role('SUPER'))
+
+
+class RoleClaimsTokenTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Role.objects.create(id='CUSTOMER', label='Customer', description='Customer')
+        Role.objects.create(id='SUPER', label='Super Admin', description='Admin', is_admin=True)
+        self.user = User.objects.create_user(
+            email='customer@example.com', first_name='Test', last_name='User', phone='0911111111', password='password123',
+        )
+        UserRole.objects.create(user=self.user, role_id='CUSTOMER')
+        self.user.refresh_from_db()
+
+    def test_read_only_endpoint_skips_user_and_role_queries(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(self.user)['access']}")
+        self.assertEqual(client.get('/api/v1/summary/').status_code, 200)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/v1/summary/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query['sql'] for query in queries if 'accounts_user' in query['sql']])
+
+    def test_role_change_revokes_claims(self):
+        token = AccessToken(get_tokens_for_user(self.user)['access'])
+        self.assertEqual(token['roles'], ['CUSTOMER'])
+        self.assertIsInstance(RoleClaimsJWTAuthentication().get_user(token), RoleClaimsUser)
+
+        serializer = AdminSerializer(self.user, data={
+            'first_name': 'Test', 'last_name': 'User', 'email': self.user.email, 'phone': self.user.phone, 'roles': ['SUPER'],
+        })
+        serializer.is_valid(raise_exception=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer.save()
+
+        # The stale token still authenticates, but through the database
+        user = RoleClaimsJWTAuthentication().get_user(token)
+        self.assertIsInstance(user, User)
+        self.assertTrue(user.is_admin)
+
+    def test_saving_a_stale_user_keeps_the_bumped_version(self):
+        token = AccessToken(get_tokens_for_user(self.user)['access'])
+        # e.g. a profile update in flight while an admin changes the roles
+        stale = User.objects.get(id=self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            UserRole.objects.create(user=self.user, role_id='SUPER')
+        stale.first_name = 'Renamed'
+        stale.save()
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Renamed')
+        self.assertEqual(self.user.role_version, token['role_version'] + 1)
+        self.assertIsInstance(RoleClaimsJWTAuthentication().get_user(token), User)
+
+    def test_refresh_issues_current_role_claims(self):
+        refresh = get_tokens_for_user(self.user)['refresh']
+        UserRole.objects.create(user=self.user, role_id='SUPER')
+
+        response = APIClient().post('/api/v1/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 200)
+        token = AccessToken(response.json()['access'])
+        self.assertEqual(token['roles'], ['CUSTOMER', 'SUPER'])
+        self.assertTrue(token['is_admin'])
+        self.assertIsInstance(RoleClaimsJWTAuthentication().get_user(token), RoleClaimsUser)
+
+
+class LoginQueryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Role.objects.create(id='CUSTOMER', label='Customer', description='Customer')
+        self.user = User.objects.create_user(
+            email='customer@example.com', first_name='Test', last_name='User', phone='0911111111', password='password123',
+            address=Address.objects.create(country='HR', city='Zagreb'), is_verified=True,
+        )
+        UserRole.objects.create(user=self.user, role_id='CUSTOMER')
+
+    def test_login_by_phone_uses_a_single_user_lookup(self):
+        # user with address, roles, issued token, covers-all check
+        with self.assertNumQueries(4):
+            response = APIClient().post('/api/v1/login/', {'username': '0911111111', 'password': 'password123'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['roles'], ['Customer'])
+
+    def test_unknown_and_wrong_credentials(self):
+        backend = EmailOrPhoneBackend()
+        self.assertIsNone(backend.authenticate(None, username='nobody@example.com', password='password123'))
+        self.assertIsNone(backend.authenticate(None, username='customer@example.com', password='wrong'))
+        self.assertEqual(backend.authenticate(None, username='customer@example.com', password='password123'), self.user)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AccountThrottleTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        for index in range(3):
+            User.objects.create_user(
+                email=f'user{index}@example.com', first_name='Test', last_name='User', phone=f'091111111{index}', password='password123',
+            )
+
+    @patch('accounts.views.send_email')
+    def test_otp_is_throttled_per_identity_and_per_ip(self, send_email):
+        client = APIClient()
+        statuses = [client.post('/api/v1/get-otp/', {'email': 'user0@example.com'}).status_code for _ in range(6)]
+        self.assertEqual(statuses, [200] * 5 + [429])
+        self.assertEqual(send_email.delay.call_count, 5)
+
+        # Same client, another account: its own identity bucket, but the IP bucket keeps counting
+        self.assertEqual(client.post('/api/v1/get-otp/', {'email': 'user1@example.com'}).status_code, 200)
+
+        # The identity bucket follows the account to other IPs
+        response = APIClient(REMOTE_ADDR='10.0.0.2').post('/api/v1/get-otp/', {'email': 'user0@example.com'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_login_ip_bucket(self):
+        client = APIClient(REMOTE_ADDR='10.0.0.3')
+        for index in range(60):
+            client.post('/api/v1/login/', {'username': f'nobody{index}@example.com', 'password': 'x'}, format='json')
+        response = client.post('/api/v1/login/', {'username': 'user2@example.com', 'password': 'password123'}, format='json')
+        self.assertEqual(response.status_code, 429)
+        # Other clients are unaffected
+        response = APIClient().post('/api/v1/login/', {'username': 'user2@example.com', 'password': 'password123'}, format='json')
+        self.assertNotEqual(response.status_code, 429)
+
+    def test_failed_logins_do_not_lock_the_account_out_elsewhere(self):
+        attacker = APIClient(REMOTE_ADDR='10.0.0.4')
+        for _ in range(20):
+            attacker.post('/api/v1/login/', {'username': 'user1@example.com', 'password': 'wrong'}, format='json')
+        response = attacker.post('/api/v1/login/', {'username': 'user1@example.com', 'password': 'wrong'}, format='json')
+        self.assertEqual(response.status_code, 429)
+
+        response = APIClient(REMOTE_ADDR='10.0.0.5').post(
+            '/api/v1/login/', {'username': 'user1@example.com', 'password': 'password123'}, format='json'
+        )
+        self.assertNotEqual(response.status_code, 429)
+
+    def test_forwarded_for_entries_added_by_the_client_are_ignored(self):
+        for index in range(20):
+            client = APIClient(REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR=f'192.168.0.{index}, 10.0.0.6')
+            client.post('/api/v1/login/', {'username': 'user0@example.com', 'password': 'wrong'}, format='json')
+        client = APIClient(REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='192.168.0.99, 10.0.0.6')
+        response = client.post('/api/v1/login/', {'username': 'user0@example.com', 'password': 'wrong'}, format='json')
+        self.assertEqual(response.status_code, 429)
+
+
+class EmailBatchTest(TestCase):
+    def test_batch_shares_one_connection_and_reports_failures(self):
+        users = [
+            User.objects.create_user(
+                email=f'user{index}@example.com', first_name='Test', last_name='User', phone=f'091111111{index}', password='password123',
+            )
+            for index in range(5)
+        ]
+        messages = [{'context': {'subject': 'OTP Verification', 'otp': '1234', 'user': user.id}, 'file': 'otp.html'} for user in users]
+        messages.insert(2, {'context': {'subject': 'OTP Verification', 'otp': '1234', 'user': 999999}, 'file': 'otp.html'})
+
+        with patch('accounts.tasks.get_connection', wraps=get_connection) as connection, self.assertNumQueries(1):
+            report = send_email_batch.apply(args=[messages]).get()
+
+        self.assertEqual(connection.call_count, 1)
+        self.assertEqual(report['sent'], 5)
+        self.assertEqual([failure['index'] for failure in report['failed']], [2])
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), sorted(user.email for user in users))
+
+    def test_failed_reconnect_reports_the_rest_instead_of_raising(self):
+        class DroppingConnection:
+            opened = 0
+            sent = []
+
+            def open(self):
+                self.opened += 1
+                if self.opened > 1:
+                    raise OSError("Connection refused")
+
+            def close(self):
+                pass
+
+            def send_messages(self, messages):
+                if self.sent:
+                    raise SMTPServerDisconnected("Connection unexpectedly closed")
+                self.sent.extend(messages)
+                return len(messages)
+
+        messages = [{'context': {'subject': 'OTP Verification', 'otp': '1234', 'email': f'user{index}@example.com'}, 'file': 'otp.html'} for index in range(3)]
+        with patch('accounts.tasks.get_connection', return_value=DroppingConnection()):
+            report = deliver_emails(messages)
+
+        # Retrying the batch would send the first message twice
+        self.assertEqual(report['sent'], 1)
+        self.assertEqual([failure['index'] for failure in report['failed']], [1, 2])
+
+
+class CampaignEmailTest(TestCase):
+    context = {'subject': 'Nova ponuda', 'body': '<b>Popust</b>'}
+
+    def test_pre_rendered_body_matches_full_render(self):
+        campaign = CampaignEmail('notification.html', self.context, {'first_name': 'tamo'})
+        for first_name in ('Ana', '<Ivo & "Ivana">', ''):
+            user = User(first_name=first_name)
+            html = render_to_string('notification.html', {**self.context, 'user': user, 'year': timezone.now().year})
+            self.assertEqual(campaign.render(user), (html, strip_tags(html)))
+
+    def test_campaign_sends_personalized_emails(self):
+        users = [
+            User.objects.create_user(
+                email=f'user{index}@example.com', first_name=f'Name{index}', last_name='User', phone=f'091111111{index}', password='password123',
+            )
+            for index in range(3)
+        ]
+        report = deliver_campaign_emails(self.context, 'notification.html', [user.id for user in users], {'first_name': 'tamo'})
+
+        self.assertEqual(report, {'sent': 3, 'failed': []})
+        for email in mail.outbox:
+            index = email.to[0][len('user')]
+            self.assertIn(f'Name{index}', email.alternatives[0][0])
+
+    def test_missing_users_are_reported_as_failed(self):
+        user = User.objects.create_user(
+            email='user0@example.com', first_name='Name0', last_name='User', phone='0911111110', password='password123',
+        )
+        report = deliver_campaign_emails(self.context, 'notification.html', [user.id, user.id + 1])
+
+        self.assertEqual(report['sent'], 1)
+        self.assertEqual(report['failed'], [{'user': user.id + 1, 'recipient': None, 'error': 'User not found.'}])
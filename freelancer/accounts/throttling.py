@@ -0,0 +1,71 @@
+"""
+Rate limits for the unauthenticated account endpoints (OTP, login, registration).
+
+Each view sets `throttle_scope` and gets two buckets: one per client IP and one per
+identity (the email/phone/username in the request body), rated by the
+`<scope>_ip` and `<scope>_identity` entries of DEFAULT_THROTTLE_RATES. Login uses
+ScopedIdentityIPRateThrottle (`<scope>_identity_ip`) instead, so nobody can lock an
+account out by failing its logins from their own address. Client IPs come from
+X-Forwarded-For as trusted through NUM_PROXIES. Counters live in the default cache,
+which is Redis in production so every worker shares them.
+"""
+import hashlib
+from rest_framework.throttling import ScopedRateThrottle
+
+
+IDENTITY_FIELDS = ('email', 'username', 'phone')
+
+
+class ScopedIPRateThrottle(ScopedRateThrottle):
+    scope_suffix = 'ip'
+
+    def allow_request(self, request, view):
+        scope = getattr(view, self.scope_attr, None)
+        if not scope:
+            return True
+
+        self.scope = f"{scope}_{self.scope_suffix}"
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        # Skip ScopedRateThrottle.allow_request, it would reset the scope
+        return super(ScopedRateThrottle, self).allow_request(request, view)
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class ScopedIdentityRateThrottle(ScopedIPRateThrottle):
+    """
+    Throttles by the account a request targets, however many IPs it comes from.
+    """
+    scope_suffix = 'identity'
+
+    def get_identity(self, request):
+        for field in IDENTITY_FIELDS:
+            value = request.data.get(field) if hasattr(request.data, 'get') else None
+            if isinstance(value, str) and value.strip():
+                return value.strip().lower()
+        return None
+
+    def get_cache_key(self, request, view):
+        identity = self.get_identity(request)
+        if identity is None:
+            return None
+        # Hashed so cache keys carry no email addresses or phone numbers
+        ident = hashlib.sha256(identity.encode()).hexdigest()
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+
+class ScopedIdentityIPRateThrottle(ScopedIdentityRateThrottle):
+    """
+    Throttles by the account a request targets, separately for each client IP.
+    """
+    scope_suffix = 'identity_ip'
+
+    def get_cache_key(self, request, view):
+        identity = self.get_identity(request)
+        if identity is None:
+            return None
+        ident = hashlib.sha256(f"{identity}:{self.get_ident(request)}".encode()).hexdigest()
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
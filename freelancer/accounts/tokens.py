@@ -0,0 +1,91 @@
+"""
+JWT role claims.
+
+Access tokens carry the user's role ids, `is_admin` and `role_version`, read
+from the user whenever one is issued: at login (get_tokens_for_user) and on every
+refresh (`token/refresh/`), so a refresh never copies stale claims. Endpoints that
+opt into RoleClaimsJWTAuthentication get a RoleClaimsUser built from those claims
+instead of a database user, as long as the token's `role_version` still matches
+the user's. Any role change bumps the version (see accounts.roles), so stale
+claims fall back to the regular database lookup.
+"""
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from .roles import get_user_roles, get_role_version
+
+
+def add_role_claims(token, user):
+    roles = get_user_roles(user)
+    token['roles'] = sorted(roles)
+    token['is_admin'] = any(roles.values())
+    token['role_version'] = user.role_version
+    return token
+
+
+class RoleClaimsRefreshToken(RefreshToken):
+    """
+    Refresh token whose access tokens carry the user's current role claims.
+    """
+    user = None
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token.user = user
+        return token
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        user = self.user or get_user_model().objects.filter(
+            pk=self[api_settings.USER_ID_CLAIM], is_active=True
+        ).first()
+        if user is not None:
+            add_role_claims(access, user)
+        return access
+
+
+class RoleClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = RoleClaimsRefreshToken
+
+
+class RoleClaimsUser(TokenUser):
+    """
+    Stateless user backed by token claims. Only use it where `id` and the role checks
+    are all the endpoint needs; filter with `user_id=request.user.id`, not `user=request.user`.
+    """
+    @cached_property
+    def id(self):
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def pk(self):
+        return self.id
+
+    @cached_property
+    def is_admin(self):
+        return bool(self.token.get('is_admin', False))
+
+    def has_role(self, *role_ids):
+        return any(role_id in self.token.get('roles', []) for role_id in role_ids)
+
+
+class RoleClaimsJWTAuthentication(JWTAuthentication):
+    """
+    Authenticate from the token claims, skipping the user and role queries, for read-only endpoints.
+    """
+    def get_user(self, validated_token):
+        version = validated_token.get('role_version')
+        if version is None:
+            return super().get_user(validated_token)
+
+        user_id = int(validated_token[api_settings.USER_ID_CLAIM])
+        if get_role_version(user_id) != version:
+            # Roles changed (or the user is gone) since the token was issued
+            return super().get_user(validated_token)
+        return RoleClaimsUser(validated_token)
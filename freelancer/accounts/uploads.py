@@ -0,0 +1,130 @@
+"""
+Direct-to-storage uploads.
+
+Instead of streaming files through the API workers, the client asks for an upload
+slot, POSTs the file straight to the bucket with the returned form fields, then
+sends the slot token back. The server only checks the object landed and records
+its key on the model. Each token is redeemed once: its key goes into
+ConfirmedUpload, so the same object cannot be attached to several records.
+Callers check tokens with `confirm_upload` while validating and `redeem_upload` the
+keys in the transaction that saves them, so a request that fails on anything else
+leaves its tokens usable.
+"""
+import os
+import posixpath
+from uuid import uuid4
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.urls import reverse
+from django.utils.module_loading import import_string
+from django.utils.text import get_valid_filename
+from rest_framework import serializers
+
+
+UPLOAD_TOKEN_SALT = 'accounts.uploads'
+
+
+def build_upload_key(field, filename):
+    """
+    Unique storage key under the field's `upload_to` that still fits the column.
+    """
+    prefix = f"{field.upload_to}{uuid4().hex}/"
+    root, extension = os.path.splitext(get_valid_filename(os.path.basename(filename)) or 'file')
+    room = field.max_length - len(prefix) - len(extension)
+    return f"{prefix}{root[:max(room, 1)]}{extension}"
+
+
+class BaseUploadBackend:
+    """
+    Hands out the URL and form fields a client POSTs a single file to.
+    """
+    def __init__(self):
+        self.expires_in = settings.DIRECT_UPLOAD_EXPIRES
+        self.max_size = settings.DIRECT_UPLOAD_MAX_SIZE
+
+    def presign(self, key, content_type, request):
+        raise NotImplementedError("Subclasses must implement presign()")
+
+    def exists(self, key):
+        return default_storage.exists(key)
+
+
+class S3UploadBackend(BaseUploadBackend):
+    def presign(self, key, content_type, request):
+        storage = default_storage
+        client = storage.connection.meta.client
+        return client.generate_presigned_post(
+            Bucket=storage.bucket_name,
+            # The key as stored in the bucket, below the storage's `location` prefix
+            Key=posixpath.join(storage.location, key),
+            Fields={'Content-Type': content_type},
+            Conditions=[
+                {'Content-Type': content_type},
+                ['content-length-range', 1, self.max_size],
+            ],
+            ExpiresIn=self.expires_in,
+        )
+
+
+class LocalUploadBackend(BaseUploadBackend):
+    """
+    Stand-in for S3 in tests and local development: the form is posted to
+    `accounts.views.LocalUploadView`, which writes to the default storage.
+    """
+    def presign(self, key, content_type, request):
+        policy = signing.dumps({'key': key, 'max_size': self.max_size}, salt=f'{UPLOAD_TOKEN_SALT}.policy')
+        return {
+            'url': request.build_absolute_uri(reverse('local-upload')),
+            'fields': {'key': key, 'Content-Type': content_type, 'policy': policy},
+        }
+
+    def check_policy(self, policy):
+        return signing.loads(policy, salt=f'{UPLOAD_TOKEN_SALT}.policy', max_age=self.expires_in)
+
+
+def get_upload_backend():
+    return import_string(settings.DIRECT_UPLOAD_BACKEND)()
+
+
+def create_upload_slot(request, model_field, filename, content_type, **claims):
+    """
+    Presign an upload for `model_field` and sign a token binding the key to the requesting
+    user and `claims`, so it can only be confirmed by them and for what it was issued for.
+    """
+    key = build_upload_key(model_field, filename)
+    slot = get_upload_backend().presign(key, content_type, request)
+    token = signing.dumps({'key': key, 'user': request.user.id, **claims}, salt=UPLOAD_TOKEN_SALT)
+    return {'key': key, 'url': slot['url'], 'fields': slot['fields'], 'token': token}
+
+
+def confirm_upload(request, token, **claims):
+    """
+    Return the storage key of a finished upload, or raise ValidationError. Does not redeem the token.
+    """
+    backend = get_upload_backend()
+    try:
+        payload = signing.loads(token, salt=UPLOAD_TOKEN_SALT, max_age=backend.expires_in)
+    except signing.BadSignature:
+        raise serializers.ValidationError({"error": "Invalid or expired upload token."})
+
+    if payload.pop('user') != request.user.id or any(payload.get(name) != value for name, value in claims.items()):
+        raise serializers.ValidationError({"error": "Upload token was not issued for this request."})
+
+    if not backend.exists(payload['key']):
+        raise serializers.ValidationError({"error": "File has not been uploaded yet."})
+    return payload['key']
+
+
+def redeem_upload(request, key):
+    """
+    Mark a confirmed key as used, or raise ValidationError if it already was. Call it inside
+    the transaction that stores the key, so a rollback hands the token back.
+    """
+    from .models import ConfirmedUpload
+    try:
+        with transaction.atomic():
+            ConfirmedUpload.objects.create(key=key, user_id=request.user.id)
+    except IntegrityError:
+        raise serializers.ValidationError({"error": "Upload token has already been used."})
@@ -1,6 +1,7 @@
 from django.urls import path, include
 from . import views as vw
 from rest_framework.routers import DefaultRouter
+from rest_framework_simplejwt.views import TokenRefreshView
 
 router = DefaultRouter()
 
@@ -16,6 +17,7 @@ urlpatterns = [
     path('get-otp/', vw.GetOTP.as_view(), name='get-otp'),
     path('login/', vw.LoginView.as_view(), name='login'),
     path('logout/', vw.LogoutView.as_view(), name='logout'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
     path('password-reset/', vw.PasswordResetRequestView.as_view(), name='password-reset'),
     path('password-reset-confirm/', vw.PasswordResetConfirmView.as_view(),name='password-reset-confirm'),
     path('change-password/', vw.ChangePassword.as_view(), name='change-password'),
@@ -24,4 +26,5 @@ urlpatterns = [
     path('update-address/', vw.UpdateAddress.as_view(), name='update-address'),
     path('admin/login/', vw.AdminLoginView.as_view(), name='admin-login'),
     path('all-user/<str:type>/', vw.GetAllUser.as_view(), name='all-user'),
+    path('uploads/local/', vw.LocalUploadView.as_view(), name='local-upload'),
 ]
\ No newline at end of file
@@ -7,7 +7,7 @@ from .tasks import send_email
 from .models import User, Role
 from .auth_backends import EmailOrPhoneBackend
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework import viewsets
 from rest_framework_simplejwt.tokens import RefreshToken 
 from .permissions import IsAdminUser
@@ -17,11 +17,18 @@ from rest_framework.decorators import action
 from django.utils import timezone
 from paymentApp.models import CoversAllSubscription
 from notificationApp.models import Notification
+from django.core import signing
+from django.core.files.storage import default_storage
+from .uploads import create_upload_slot, get_upload_backend, LocalUploadBackend
+from .throttling import ScopedIPRateThrottle, ScopedIdentityRateThrottle, ScopedIdentityIPRateThrottle
 
 
 # Create your views here.
 
 class RegistrationView(APIView):      
+    throttle_classes = [ScopedIPRateThrottle, ScopedIdentityRateThrottle]
+    throttle_scope = 'register'
+    
     def post(self, request):
         data = request.data
         serializer = sz.RegisterSerializer(data=data)
@@ -52,6 +59,9 @@ class RegistrationView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
 class GetOTP(APIView):
+    throttle_classes = [ScopedIPRateThrottle, ScopedIdentityRateThrottle]
+    throttle_scope = 'otp'
+    
     def post(self, request):
         email = request.data['email']
         user = get_object_or_404(User, email=email)
@@ -66,6 +76,8 @@ class GetOTP(APIView):
         return Response({'Message':'OTP sent'}, status=status.HTTP_200_OK)
      
 class VerifyOtp(APIView):
+    throttle_classes = [ScopedIPRateThrottle, ScopedIdentityRateThrottle]
+    throttle_scope = 'otp_verify'
     
     def post(self, request):
         email = request.data.get('email')
@@ -101,6 +113,9 @@ class LoginView(APIView):
     """
     Log in users using email or phone.
     """
+    throttle_classes = [ScopedIPRateThrottle, ScopedIdentityIPRateThrottle]
+    throttle_scope = 'login'
+    
     def post(self, request):
         serializer = sz.LoginSerializer(data=request.data)
         if serializer.is_valid():
@@ -151,6 +166,8 @@ class LogoutView(APIView):
 class PasswordResetRequestView(APIView):
     authentication_classes = []
     permission_classes = [AllowAny]
+    throttle_classes = [ScopedIPRateThrottle, ScopedIdentityRateThrottle]
+    throttle_scope = 'otp'
     """
     Sends a password reset link to the user's email.
     """
@@ -177,6 +194,8 @@ class PasswordResetRequestView(APIView):
 class PasswordResetConfirmView(APIView):
     authentication_classes = []
     permission_classes = [AllowAny]
+    throttle_classes = [ScopedIPRateThrottle, ScopedIdentityRateThrottle]
+    throttle_scope = 'otp_verify'
     
     """
     Resets the user's password after verifying the otp.
@@ -252,9 +271,55 @@ class UpdateAddress(APIView):
 class DocumentViewSet(viewsets.ModelViewSet):
     serializer_class = sz.DocumentSerializer
     permission_classes = [IsAuthenticated]
-    parser_classes = [MultiPartParser, FormParser]
+    parser_classes = [MultiPartParser, FormParser, JSONParser]
     queryset = User.objects.all()
     
+    @action(detail=False, methods=['post'], url_path='upload-slot')
+    def upload_slot(self, request):
+        """
+        Presigned slot for uploading one document straight to storage; submit its token under `uploads`.
+        """
+        serializer = sz.DocumentUploadSlotSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        slot = create_upload_slot(
+            request, User._meta.get_field(data['field']), data['filename'], data['content_type'], field=data['field']
+        )
+        return Response(slot, status=status.HTTP_201_CREATED)
+    
+class LocalUploadView(APIView):
+    """
+    Receives presigned form posts when DIRECT_UPLOAD_BACKEND is LocalUploadBackend (tests, local development).
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    parser_classes = [MultiPartParser]
+    
+    def post(self, request):
+        backend = get_upload_backend()
+        if not isinstance(backend, LocalUploadBackend):
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        
+        try:
+            policy = backend.check_policy(request.data.get('policy', ''))
+        except signing.BadSignature:
+            return Response({"error": "Invalid or expired upload policy."}, status=status.HTTP_403_FORBIDDEN)
+        
+        upload = request.FILES.get('file')
+        if request.data.get('key') != policy['key'] or not upload:
+            return Response({"error": "Key and file are required."}, status=status.HTTP_400_BAD_REQUEST)
+        if upload.size > policy['max_size']:
+            return Response({"error": "File is too large."}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Like a one-shot presigned POST, a slot takes one file: never store it under another name
+        if default_storage.exists(policy['key']):
+            return Response({"error": "File has already been uploaded."}, status=status.HTTP_409_CONFLICT)
+        name = default_storage.save(policy['key'], upload)
+        if name != policy['key']:
+            default_storage.delete(name)
+            return Response({"error": "File has already been uploaded."}, status=status.HTTP_409_CONFLICT)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
 class CustomerRoleViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = sz.RoleSerializer
     permission_classes = [AllowAny]
@@ -264,6 +329,8 @@ class CustomerRoleViewSet(viewsets.ReadOnlyModelViewSet):
 class AdminLoginView(APIView):
     authentication_classes = []
     permission_classes = [AllowAny]
+    throttle_classes = [ScopedIPRateThrottle, ScopedIdentityIPRateThrottle]
+    throttle_scope = 'login'
     
     def post(self, request):
         serializer = sz.LoginSerializer(data=request.data)
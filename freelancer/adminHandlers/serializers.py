@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from accounts.models import Role, UserRole
+from accounts.roles import bump_role_version
 from .models import ServiceCategory, CategoryPricing, CategoryFeaturesField, SubCategory, FAQ, Charges
 from decimal import Decimal
 from django.db import transaction
@@ -91,6 +92,10 @@ class AdminSerializer(serializers.ModelSerializer):
                     UserRole(user=instance, role_id=role_id) for role_id in roles_to_create
                 ])
                 
+                # bulk_create skips the UserRole receivers; revoke the role claims of issued tokens
+                if roles_to_delete or roles_to_create:
+                    bump_role_version(instance.id)
+                
                 return instance  
         except Exception as e:
             raise serializers.ValidationError({'error': f'Failed to update user and assign roles: {str(e)}'})
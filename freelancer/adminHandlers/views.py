@@ -9,12 +9,12 @@ from django.db.models.deletion import RestrictedError
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
-from accounts.tasks import send_email
-from listing.models import Listing
+from accounts.tasks import send_email, queue_emails
+from listing.models import Listing, ListingStatusCount
 from rest_framework.generics import RetrieveAPIView
 from bookingApp.models import Booking
 from bookingApp.serializers import BookingSerializer
-from django.db.models import Q
+from django.db.models import Q, Prefetch
 from accounts.pagination import CustomOffsetPagination
 from adsApp.models import Ad
 from datetime import timedelta
@@ -157,33 +157,41 @@ class HandleListStatus(APIView):
             if not rejection_reasons:
                 return Response({"error": "Rejection reasons are required."}, status=status.HTTP_400_BAD_REQUEST)
 
-            listings.update(status="rejected", rejection_reasons=rejection_reasons)
-            for listing in listings:
-                context = {
-                    'subject': 'Listing Rejection Notification',
-                    'listing': listing.id,
-                    'rejection_reasons': rejection_reasons,
-                    'user': listing.created_by.id
+            ListingStatusCount.transition(listings, "rejected", rejection_reasons=rejection_reasons)
+            queue_emails([
+                {
+                    'context': {
+                        'subject': 'Listing Rejection Notification',
+                        'listing': listing.id,
+                        'rejection_reasons': rejection_reasons,
+                        'user': listing.created_by_id
+                    },
+                    'file': 'rejected.html',
                 }
-                send_email.delay(context, file='rejected.html')
-                
+                for listing in listings
+            ])
 
         else:
-            listings.update(status="approved")
-            for listing in listings:
-                context = {
-                    'subject': 'Listing Approval Notification',
-                    'listing': listing.id,
-                    'user': listing.created_by.id
+            ListingStatusCount.transition(listings, "approved")
+            queue_emails([
+                {
+                    'context': {
+                        'subject': 'Listing Approval Notification',
+                        'listing': listing.id,
+                        'user': listing.created_by_id
+                    },
+                    'file': 'approved.html',
                 }
-                send_email.delay(context, file='approved.html')
-                
+                for listing in listings
+            ])
 
         return Response({"message": "Listings updated successfully."}, status=status.HTTP_200_OK)
     
 class UserWithListingsAndBookings(RetrieveAPIView):
     permission_classes = [IsAdminUser]
-    queryset = User.objects.prefetch_related('listings', 'user_roles__role', 'booking_requester__listing').all()
+    queryset = User.objects.prefetch_related(
+        Prefetch('listings', queryset=Listing.objects.with_related()), 'user_roles__role', 'booking_requester__listing'
+    ).all()
     serializer_class = sz.UserWithListingsSerializer
     lookup_field = 'id'
     
@@ -1,6 +1,9 @@
 from django.db import models
 from listing.models import Listing
 from accounts.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from listing.visibility import refresh_listing_visibility
 
 # Create your models here.
 class SuperAdsCategory(models.Model):
@@ -54,6 +57,14 @@ class Ad(models.Model):
     status = models.CharField(max_length=50, choices=STATUS_CHOICES, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+
+@receiver(post_save, sender=Ad)
+@receiver(post_delete, sender=Ad)
+def update_ad_listing_visibility(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_listing_visibility(listing_ids=[instance.listing_id])
+
     
 class Impression(models.Model):
     TYPE_CHOICE = [
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 from datetime import timedelta
 from celery.schedules import crontab
 
@@ -65,6 +66,20 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # Proxies in front of the app that append to X-Forwarded-For (CapRover's nginx); the
+    # throttles take the client IP from there and ignore the entries clients add themselves
+    'NUM_PROXIES': config("NUM_PROXIES", cast=int, default=1),
+    # Per-IP and per-identity buckets of accounts.throttling, counted in the default cache
+    'DEFAULT_THROTTLE_RATES': {
+        'otp_ip': '20/hour',
+        'otp_identity': '5/hour',
+        'otp_verify_ip': '30/hour',
+        'otp_verify_identity': '10/hour',
+        'login_ip': '60/hour',
+        'login_identity_ip': '20/hour',
+        'register_ip': '10/hour',
+        'register_identity': '5/hour',
+    },
 }
 
 SPECTACULAR_SETTINGS = {
@@ -79,6 +94,8 @@ SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(weeks=1),
     "REFRESH_TOKEN_LIFETIME": timedelta(weeks=4),
     "AUTH_HEADER_TYPES": ("Bearer",),
+    # token/refresh/ issues access tokens with fresh role claims (accounts.tokens)
+    "TOKEN_REFRESH_SERIALIZER": "accounts.tokens.RoleClaimsTokenRefreshSerializer",
 }
 
 AUTHENTICATION_BACKENDS = [
@@ -106,6 +123,7 @@ TEMPLATES = [
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": [BASE_DIR, 'templates/'],
         "APP_DIRS": True,
+        # No explicit "loaders": Django then wraps these in the cached loader, so templates compile once per process
         "OPTIONS": {
             "context_processors": [
                 "django.template.context_processors.request",
@@ -193,6 +211,40 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
+# Shared cache (Redis). Role versions, throttles and counters must be seen by every process,
+# so the per-process memory cache needs DEBUG or an explicit ALLOW_LOCAL_CACHE (tests, CI,
+# one-off management commands).
+ALLOW_LOCAL_CACHE = config("ALLOW_LOCAL_CACHE", cast=bool, default=False)
+CACHE_URL = config("CACHE_URL", default="")
+if not CACHE_URL and not (DEBUG or ALLOW_LOCAL_CACHE):
+    raise ImproperlyConfigured(
+        "CACHE_URL must point to a shared cache (e.g. redis://redis:6379/1) when DEBUG is off; "
+        "set ALLOW_LOCAL_CACHE=1 to use a per-process cache anyway (tests, one-off commands)."
+    )
+CACHES = {
+    "default": (
+        {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": CACHE_URL}
+        if CACHE_URL else
+        {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    ),
+}
+# Values that are kept up to date incrementally (e.g. unread counters) are only cached when
+# every process sees the same cache
+CACHE_IS_SHARED = config("CACHE_IS_SHARED", cast=bool, default=bool(CACHE_URL))
+
+# Real-time notifications (notificationApp.realtime): Redis pub/sub, or an in-process broker in development and tests
+NOTIFICATION_PUBSUB_URL = config("NOTIFICATION_PUBSUB_URL", default=CACHE_URL)
+# The in-process broker is per process just like the local cache, so the same opt-in covers it
+if not NOTIFICATION_PUBSUB_URL and not (DEBUG or ALLOW_LOCAL_CACHE):
+    raise ImproperlyConfigured(
+        "NOTIFICATION_PUBSUB_URL (or CACHE_URL) must point to Redis when DEBUG is off; "
+        "set ALLOW_LOCAL_CACHE=1 to use the in-process broker anyway."
+    )
+NOTIFICATION_BROKER = config(
+    "NOTIFICATION_BROKER",
+    default="notificationApp.realtime.RedisBroker" if NOTIFICATION_PUBSUB_URL else "notificationApp.realtime.LocalBroker",
+)
+
 AWS_STORAGE_BUCKET_NAME = config("AWS_STORAGE_BUCKET_NAME")
 AWS_S3_REGION_NAME = config("AWS_S3_REGION_NAME", default="us-east-1")
 
@@ -221,13 +273,41 @@ CELERY_BEAT_SCHEDULE = {
         "task": "accounts.tasks.expire_ads_if_needed",
         "schedule": crontab(minute='*/30'),  # every 30 minutes
     },
-    "dispatch-notifications-every-10-minutes": {
+    "dispatch-notifications-every-minute": {
         "task": "notificationApp.tasks.run_notification_dispatcher",
+        "schedule": crontab(minute="*"),  # cheap: only templates due by next_run_at are read
+    },
+    "requeue-stuck-notifications": {
+        "task": "notificationApp.tasks.requeue_stuck_notifications",
         "schedule": crontab(minute="*/10"),
     },
+    "archive-old-notifications-daily": {
+        "task": "notificationApp.tasks.archive_old_notifications",
+        "schedule": crontab(hour=3, minute=0),
+    },
+    "requeue-stale-stripe-events": {
+        "task": "paymentApp.tasks.requeue_stale_stripe_events",
+        "schedule": crontab(minute="*/5"),
+    },
 }
 
+# Push notifications (notificationApp.push): ExpoPushProvider, or LocalPushProvider pointed at
+# notificationApp.views.LocalPushView to work offline
+PUSH_PROVIDER = config("PUSH_PROVIDER", default="notificationApp.push.ExpoPushProvider")
+PUSH_PROVIDER_URL = config("PUSH_PROVIDER_URL", default="https://exp.host/--/api/v2/push/send")
+PUSH_PROVIDER_ACCESS_TOKEN = config("PUSH_PROVIDER_ACCESS_TOKEN", default="")
+
+# Notifications older than this move to the archive table (notificationApp.tasks.archive_old_notifications)
+NOTIFICATION_RETENTION_DAYS = config("NOTIFICATION_RETENTION_DAYS", cast=int, default=90)
+
 TINIFY_API_KEY = config("TINIFY_API_KEY")
+# Listing image compressor: TinifyCompressor, or LocalCompressor (Pillow) to work offline
+IMAGE_COMPRESSOR = config("IMAGE_COMPRESSOR", default="listing.compression.TinifyCompressor")
+
+# Direct uploads: S3UploadBackend (presigned POST), or LocalUploadBackend to upload through the API
+DIRECT_UPLOAD_BACKEND = config("DIRECT_UPLOAD_BACKEND", default="accounts.uploads.S3UploadBackend")
+DIRECT_UPLOAD_MAX_SIZE = config("DIRECT_UPLOAD_MAX_SIZE", cast=int, default=200 * 1024 * 1024)
+DIRECT_UPLOAD_EXPIRES = config("DIRECT_UPLOAD_EXPIRES", cast=int, default=3600)
 
 STRIPE_SECRET_KEY = config("STRIPE_SECRET_KEY")
 STRIPE_WEBHOOK_SECRET = config("STRIPE_WEBHOOK_SECRET")
\ No newline at end of file
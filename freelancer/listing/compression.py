@@ -0,0 +1,45 @@
+from io import BytesIO
+from django.conf import settings
+from django.utils.module_loading import import_string
+from PIL import Image
+import tinify
+
+
+class BaseCompressor:
+    """
+    Turns the bytes of an image into smaller bytes of the same format.
+    `retryable_errors` are transient failures worth another attempt.
+    """
+    retryable_errors = ()
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError("Subclasses must implement compress()")
+
+
+class TinifyCompressor(BaseCompressor):
+    retryable_errors = (tinify.ConnectionError, tinify.ServerError)
+
+    def compress(self, data):
+        tinify.key = settings.TINIFY_API_KEY
+        return tinify.from_buffer(data).to_buffer()
+
+
+class LocalCompressor(BaseCompressor):
+    """
+    Pillow re-encode with optimization, used when Tinify is not reachable (tests, local development).
+    """
+    quality = 85
+
+    def compress(self, data):
+        with Image.open(BytesIO(data)) as image:
+            image_format = image.format
+            output = BytesIO()
+            if image_format == 'JPEG':
+                image.save(output, format=image_format, optimize=True, quality=self.quality)
+            else:
+                image.save(output, format=image_format, optimize=True)
+        return output.getvalue()
+
+
+def get_compressor():
+    return import_string(settings.IMAGE_COMPRESSOR)()
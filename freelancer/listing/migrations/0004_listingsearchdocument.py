@@ -0,0 +1,54 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            "CREATE FULLTEXT INDEX listing_searchdoc_document_ft ON listing_listingsearchdocument (document)"
+        )
+
+
+def drop_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            "DROP INDEX listing_searchdoc_document_ft ON listing_listingsearchdocument"
+        )
+
+
+def backfill_search_documents(apps, schema_editor):
+    Listing = apps.get_model('listing', 'Listing')
+    ListingSearchDocument = apps.get_model('listing', 'ListingSearchDocument')
+
+    documents = []
+    for listing in Listing.objects.select_related('category', 'subcategory', 'service').iterator(chunk_size=500):
+        parts = [listing.service.header, listing.service.description_en, listing.service.description_hr]
+        for category in (listing.category, listing.subcategory):
+            if category:
+                parts += [category.name_en, category.name_hr]
+        documents.append(ListingSearchDocument(listing=listing, document="\n".join(part for part in parts if part).lower()))
+
+    ListingSearchDocument.objects.bulk_create(documents, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0003_alter_listing_category_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingSearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('listing', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='search_document', to='listing.listing')),
+            ],
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+        migrations.RunPython(backfill_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:34
+
+import listing.models
+from django.conf import settings
+from django.db import migrations, models
+import random
+
+
+def randomize_shuffle_keys(apps, schema_editor):
+    # AddField evaluates the callable default once, so spread the existing rows out here
+    Listing = apps.get_model('listing', 'Listing')
+    batch = []
+    for row in Listing.objects.only('id').iterator(chunk_size=500):
+        row.shuffle_key = random.randrange(2 ** 31)
+        batch.append(row)
+        if len(batch) == 500:
+            Listing.objects.bulk_update(batch, ['shuffle_key'])
+            batch = []
+    Listing.objects.bulk_update(batch, ['shuffle_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminHandlers', '0006_charges_base_amount'),
+        ('listing', '0004_listingsearchdocument'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='shuffle_key',
+            field=models.PositiveIntegerField(default=listing.models.generate_shuffle_key, editable=False),
+        ),
+        migrations.RunPython(randomize_shuffle_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['status', 'available', 'shuffle_key'], name='listing_feed_shuffle_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminHandlers', '0006_charges_base_amount'),
+        ('listing', '0005_listing_shuffle_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['created_at', 'id'], name='listing_created_idx'),
+        ),
+    ]
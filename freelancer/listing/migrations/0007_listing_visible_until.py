@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:37
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+
+def backfill_visible_until(apps, schema_editor):
+    Listing = apps.get_model('listing', 'Listing')
+    Ad = apps.get_model('adsApp', 'Ad')
+    CoversAllSubscription = apps.get_model('paymentApp', 'CoversAllSubscription')
+
+    latest_ad_end = Subquery(
+        Ad.objects.filter(listing=OuterRef('pk'), status='active').order_by('-end_date').values('end_date')[:1]
+    )
+    latest_covers_all_end = Subquery(
+        CoversAllSubscription.objects.filter(user=OuterRef('created_by')).order_by('-end_date').values('end_date')[:1]
+    )
+    Listing.objects.update(
+        visible_until=Greatest(
+            Coalesce(latest_ad_end, latest_covers_all_end),
+            Coalesce(latest_covers_all_end, latest_ad_end),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminHandlers', '0006_charges_base_amount'),
+        ('adsApp', '0001_initial'),
+        ('paymentApp', '0004_coversallsubscription'),
+        ('listing', '0006_listing_listing_created_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='visible_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_visible_until, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['status', 'visible_until'], name='listing_visibility_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:38
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_status_counts(apps, schema_editor):
+    Listing = apps.get_model('listing', 'Listing')
+    ListingStatusCount = apps.get_model('listing', 'ListingStatusCount')
+
+    counts = dict(Listing.objects.values_list('status').annotate(total=Count('id')))
+    ListingStatusCount.objects.bulk_create([
+        ListingStatusCount(status=status, count=counts.get(status, 0))
+        for status in ('pending', 'approved', 'rejected', 'expired')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0007_listing_visible_until'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingStatusCount',
+            fields=[
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('approved', 'Approved'), ('rejected', 'Rejected'), ('expired', 'Expired')], max_length=50, primary_key=True, serialize=False)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_status_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0009_resource_processing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resource',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.5 on 2026-10-18 13:42
+
+import listing.models
+from django.conf import settings
+from django.db import migrations, models
+import random
+
+
+SHUFFLE_FIELDS = ['shuffle_key_1', 'shuffle_key_2', 'shuffle_key_3']
+
+
+def randomize_shuffle_keys(apps, schema_editor):
+    # AddField evaluates the callable default once, so spread the existing rows out here
+    Listing = apps.get_model('listing', 'Listing')
+    batch = []
+    for row in Listing.objects.only('id').iterator(chunk_size=500):
+        for field in SHUFFLE_FIELDS:
+            setattr(row, field, random.randrange(2 ** 31))
+        batch.append(row)
+        if len(batch) == 500:
+            Listing.objects.bulk_update(batch, SHUFFLE_FIELDS)
+            batch = []
+    Listing.objects.bulk_update(batch, SHUFFLE_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminHandlers', '0006_charges_base_amount'),
+        ('listing', '0010_resource_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='shuffle_key_1',
+            field=models.PositiveIntegerField(default=listing.models.generate_shuffle_key, editable=False),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='shuffle_key_2',
+            field=models.PositiveIntegerField(default=listing.models.generate_shuffle_key, editable=False),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='shuffle_key_3',
+            field=models.PositiveIntegerField(default=listing.models.generate_shuffle_key, editable=False),
+        ),
+        migrations.RunPython(randomize_shuffle_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['status', 'available', 'shuffle_key_1'], name='listing_feed_shuffle_1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['status', 'available', 'shuffle_key_2'], name='listing_feed_shuffle_2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['status', 'available', 'shuffle_key_3'], name='listing_feed_shuffle_3_idx'),
+        ),
+    ]
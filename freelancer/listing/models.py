@@ -1,14 +1,14 @@
 from django.db import models
 from accounts.models import User
 from adminHandlers.models import ServiceCategory, SubCategory, CategoryFeaturesField
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save, pre_delete, post_delete
+from celery import chain
+from accounts.images import delete_image_derivatives
 from django.dispatch import receiver
-import tinify
-from django.conf import settings
-
-
-
-tinify.key = settings.TINIFY_API_KEY
+import random
+from .search import update_search_documents
+from .visibility import refresh_listing_visibility
 
 
 # Create your models here.
@@ -42,6 +42,25 @@ class Service(models.Model):
         return self.header
     
 
+def generate_shuffle_key():
+    return random.randrange(2 ** 31)
+
+
+class ListingQuerySet(models.QuerySet):
+    def with_related(self):
+        """
+        Eager-load everything ListingSerializer reads, so a page of listings
+        costs a fixed number of queries regardless of its size.
+        """
+        return self.select_related(
+            'location', 'service', 'contact', 'created_by', 'created_by__address'
+        ).prefetch_related(
+            'created_by__user_roles__role',
+            'resources',
+            models.Prefetch('features', queryset=ListingFeatures.objects.select_related('feature_field')),
+        )
+
+
 class Listing(models.Model):    
     USER_TYPE_CHOICES = (
         ('private', 'Private'),
@@ -70,10 +89,101 @@ class Listing(models.Model):
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='listings')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Maintained by listing.visibility.refresh_listing_visibility from ads and covers-all subscriptions
+    visible_until = models.DateTimeField(null=True, blank=True, editable=False)
+    # Random positions in the shuffled feed's orders, one picked per seed (see accounts.pagination.SeededShufflePagination)
+    shuffle_key = models.PositiveIntegerField(default=generate_shuffle_key, editable=False)
+    shuffle_key_1 = models.PositiveIntegerField(default=generate_shuffle_key, editable=False)
+    shuffle_key_2 = models.PositiveIntegerField(default=generate_shuffle_key, editable=False)
+    shuffle_key_3 = models.PositiveIntegerField(default=generate_shuffle_key, editable=False)
+    
+    objects = ListingQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available', 'shuffle_key'], name='listing_feed_shuffle_idx'),
+            models.Index(fields=['status', 'available', 'shuffle_key_1'], name='listing_feed_shuffle_1_idx'),
+            models.Index(fields=['status', 'available', 'shuffle_key_2'], name='listing_feed_shuffle_2_idx'),
+            models.Index(fields=['status', 'available', 'shuffle_key_3'], name='listing_feed_shuffle_3_idx'),
+            models.Index(fields=['created_at', 'id'], name='listing_created_idx'),
+            models.Index(fields=['status', 'visible_until'], name='listing_visibility_idx'),
+        ]
 
     def __str__(self):
         return f"{self.service.header if self.service else 'No Title'} - {self.price}"
     
+class ListingStatusCount(models.Model):
+    """
+    Counter cache of listings per status, so the admin dashboard does not scan the listings table.
+    Kept current by the receivers below and by `transition()` for bulk status changes.
+    """
+    status = models.CharField(max_length=50, choices=Listing.LISTING_STATUS, primary_key=True)
+    count = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.status}: {self.count}"
+    
+    @classmethod
+    def adjust(cls, status, delta):
+        if not status or not delta:
+            return
+        if not cls.objects.filter(status=status).update(count=models.F('count') + delta):
+            # Every status is seeded by migration 0008 (and rebuild()); a missing row is created
+            # at zero first, so concurrent first writes both land as increments
+            cls.objects.get_or_create(status=status)
+            cls.objects.filter(status=status).update(count=models.F('count') + delta)
+    
+    @classmethod
+    def transition(cls, listings, status, **fields):
+        """
+        Bulk-update the status of a listing queryset and move the counters along with it.
+        """
+        with transaction.atomic():
+            previous = listings.exclude(status=status).values('status').annotate(total=models.Count('id'))
+            for row in previous:
+                cls.adjust(row['status'], -row['total'])
+                cls.adjust(status, row['total'])
+            return listings.update(status=status, **fields)
+    
+    @classmethod
+    def totals(cls):
+        counts = dict(cls.objects.values_list('status', 'count'))
+        return {status: counts.get(status, 0) for status, _ in Listing.LISTING_STATUS}
+    
+    @classmethod
+    def rebuild(cls):
+        with transaction.atomic():
+            counts = dict(Listing.objects.values_list('status').annotate(total=models.Count('id')))
+            cls.objects.all().delete()
+            cls.objects.bulk_create([
+                cls(status=status, count=counts.get(status, 0)) for status, _ in Listing.LISTING_STATUS
+            ])
+
+
+@receiver(pre_save, sender=Listing)
+def remember_previous_listing_status(sender, instance, raw=False, **kwargs):
+    instance._previous_status = None
+    if instance.pk and not raw:
+        instance._previous_status = Listing.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+
+@receiver(post_save, sender=Listing)
+def count_listing_status(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else getattr(instance, '_previous_status', None)
+    if previous != instance.status:
+        ListingStatusCount.adjust(previous, -1)
+        ListingStatusCount.adjust(instance.status, 1)
+
+
+@receiver(pre_delete, sender=Listing)
+def uncount_listing_status(sender, instance, **kwargs):
+    # Read the stored status, the instance may predate a bulk transition()
+    status = Listing.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+    ListingStatusCount.adjust(status, -1)
+
+    
 class ListingFeatures(models.Model):
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='features')
     feature_field = models.ForeignKey(CategoryFeaturesField, on_delete=models.CASCADE, null=True, blank=True)
@@ -88,6 +198,12 @@ class Resource(models.Model):
         ('video', 'Video'),
     ]
     
+    class ProcessingStatus(models.TextChoices):
+        PENDING = "pending", "Pending"
+        PROCESSING = "processing", "Processing"
+        DONE = "done", "Done"
+        FAILED = "failed", "Failed"
+        SKIPPED = "skipped", "Skipped"
     
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='resources')
     resource = models.FileField(upload_to='listingResources/', max_length=100)
@@ -95,22 +211,97 @@ class Resource(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
     is_cover = models.BooleanField(default=False)
+    processing_status = models.CharField(max_length=20, choices=ProcessingStatus.choices, default=ProcessingStatus.PENDING)
+    processing_error = models.TextField(blank=True, null=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    # Responsive copies written by listing.tasks.generate_resource_derivatives (see accounts.images)
+    variants = models.JSONField(default=dict, blank=True)
     
     def __str__(self):
         return self.name
-    
+
+
+@receiver(pre_save, sender=Resource)
+def reset_resource_processing(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if instance.type != 'image' or not instance.resource:
+        instance.processing_status = Resource.ProcessingStatus.SKIPPED
+    elif instance.pk:
+        stored_name = Resource.objects.filter(pk=instance.pk).values_list('resource', flat=True).first()
+        if stored_name != instance.resource.name:
+            instance.processing_status = Resource.ProcessingStatus.PENDING
+    else:
+        instance.processing_status = Resource.ProcessingStatus.PENDING
+
+
 @receiver(post_save, sender=Resource)
-def compress_resource_image(sender, instance, **kwargs):
-    if instance.type == 'image' and instance.resource:
-        try:
-            file_path = instance.resource.path
-            source = tinify.from_file(file_path)
-            source.to_file(file_path)
-            print(f"Compressed: {file_path}")
-        except Exception as e:
-            print(f"Compression error: {e}")
-            
-            
+def queue_resource_compression(sender, instance, raw=False, **kwargs):
+    # Compression runs on a Celery worker, off the upload request
+    if not raw and instance.processing_status == Resource.ProcessingStatus.PENDING:
+        from .tasks import compress_resource_image, generate_resource_derivatives
+        transaction.on_commit(lambda: chain(
+            compress_resource_image.si(instance.id),
+            generate_resource_derivatives.si(instance.id),
+        ).delay())
+
+
+@receiver(post_delete, sender=Resource)
+def delete_resource_derivatives(sender, instance, **kwargs):
+    if instance.variants:
+        transaction.on_commit(lambda: delete_image_derivatives(instance.resource.storage, instance.variants))
+
+
+
+class ListingSearchDocument(models.Model):
+    """
+    Denormalized search text of a listing, kept current by the receivers below.
+    On MySQL `document` carries a FULLTEXT index (see migration 0004).
+    """
+    listing = models.OneToOneField(Listing, on_delete=models.CASCADE, related_name='search_document')
+    document = models.TextField(blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Search document for listing {self.listing_id}"
+
+
+@receiver(post_save, sender=Listing)
+def update_listing_search_document(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_search_documents([instance])
+
+
+@receiver(post_save, sender=Listing)
+def set_new_listing_visibility(sender, instance, created=False, raw=False, **kwargs):
+    # A new listing is visible straight away when its owner has a covers-all subscription
+    if created and not raw:
+        refresh_listing_visibility(listing_ids=[instance.id])
+
+
+@receiver(post_save, sender=Service)
+def update_service_search_document(sender, instance, raw=False, **kwargs):
+    listing = Listing.objects.select_related('category', 'subcategory').filter(service=instance).first()
+    if listing and not raw:
+        listing.service = instance
+        update_search_documents([listing])
+
+
+@receiver(post_save, sender=ServiceCategory)
+def update_category_search_documents(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        update_search_documents(
+            Listing.objects.filter(category=instance).select_related('category', 'subcategory', 'service').iterator(chunk_size=500)
+        )
+
+
+@receiver(post_save, sender=SubCategory)
+def update_subcategory_search_documents(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        update_search_documents(
+            Listing.objects.filter(subcategory=instance).select_related('category', 'subcategory', 'service').iterator(chunk_size=500)
+        )
+
 
 class Favorite(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='favorites')
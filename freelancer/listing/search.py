@@ -0,0 +1,120 @@
+"""
+Full-text search over listings.
+
+Every listing has a denormalized ListingSearchDocument holding the category and
+subcategory names (both languages), the service header and both descriptions.
+On MySQL the document column carries a FULLTEXT index and is queried with
+MATCH ... AGAINST; other backends (SQLite in tests), and MySQL searches for
+nothing but words the index leaves out, fall back to icontains.
+"""
+import re
+from django.db import connection
+from django.db.models import Case, When, Value, IntegerField, FloatField, Func, Q
+
+
+SEARCH_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# InnoDB leaves words shorter than innodb_ft_min_token_size (3 by default) and the words of
+# its default stopword list out of the FULLTEXT index, so requiring them matches nothing
+FULLTEXT_MIN_TOKEN_SIZE = 3
+FULLTEXT_STOPWORDS = frozenset({
+    'a', 'about', 'an', 'are', 'as', 'at', 'be', 'by', 'com', 'de', 'en', 'for', 'from', 'how',
+    'i', 'in', 'is', 'it', 'la', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'what',
+    'when', 'where', 'who', 'will', 'with', 'und', 'www',
+})
+
+
+def build_search_document(listing):
+    """
+    Flatten the searchable text of a listing into a single lowercased string,
+    so the fallback backend can match non-ASCII text case-insensitively too.
+    """
+    parts = [listing.service.header, listing.service.description_en, listing.service.description_hr]
+    for category in (listing.category, listing.subcategory):
+        if category:
+            parts += [category.name_en, category.name_hr]
+    return "\n".join(part for part in parts if part).lower()
+
+
+def update_search_documents(listings):
+    """
+    Create or refresh the search documents of the given listings.
+    """
+    from .models import ListingSearchDocument
+
+    documents = [
+        ListingSearchDocument(listing=listing, document=build_search_document(listing))
+        for listing in listings
+    ]
+    if not documents:
+        return
+
+    # MySQL upserts on any unique key and does not accept an explicit conflict target
+    unique_fields = ['listing'] if connection.features.supports_update_conflicts_with_target else None
+    ListingSearchDocument.objects.bulk_create(
+        documents,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=['document', 'updated_at'],
+    )
+
+
+class MatchAgainst(Func):
+    """
+    MySQL `MATCH (column) AGAINST (query IN BOOLEAN MODE)`, evaluating to the relevance score.
+    """
+    output_field = FloatField()
+
+    def __init__(self, expression, query, **extra):
+        super().__init__(expression, Value(query), **extra)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        column, column_params = compiler.compile(self.source_expressions[0])
+        query, query_params = compiler.compile(self.source_expressions[1])
+        return f"MATCH ({column}) AGAINST ({query} IN BOOLEAN MODE)", (*column_params, *query_params)
+
+
+def boolean_search_query(tokens):
+    """
+    MySQL boolean-mode query requiring every indexed word of `tokens` as a prefix, so partially
+    typed words still hit. Short words and stopwords are optional: they can raise the score
+    but never filter anything out. None when no word can be required.
+    """
+    required = [token for token in tokens if len(token) >= FULLTEXT_MIN_TOKEN_SIZE and token not in FULLTEXT_STOPWORDS]
+    if not required:
+        return None
+    optional = [token for token in tokens if token not in required]
+    return ' '.join([f'+{token}*' for token in required] + [f'{token}*' for token in optional])
+
+
+def search_listings(queryset, term):
+    """
+    Filter a listing queryset down to the listings matching every word of `term`,
+    annotated with a `search_rank` relevance score (higher is better).
+    """
+    tokens = SEARCH_TOKEN_RE.findall((term or '').lower())
+    if not tokens:
+        return queryset
+
+    # Terms made only of short words and stopwords take the icontains path below
+    query = boolean_search_query(tokens) if connection.vendor == 'mysql' else None
+    if query:
+        return queryset.annotate(
+            search_rank=MatchAgainst('search_document__document', query)
+        ).filter(search_rank__gt=0)
+
+    filters = Q()
+    for token in tokens:
+        filters &= Q(search_document__document__icontains=token)
+
+    # Fallback ranking: a word found in the service header counts more than one found elsewhere
+    search_rank = sum(
+        Case(
+            When(service__header__icontains=token, then=Value(2)),
+            default=Value(1),
+            output_field=IntegerField(),
+        )
+        for token in tokens
+    )
+    return queryset.filter(filters).annotate(search_rank=search_rank)
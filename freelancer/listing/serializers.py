@@ -1,6 +1,9 @@
 from rest_framework import serializers
+from django.db import models, transaction
 from .models import (Listing, Favorite, Location, Service, Contact, Resource, ListingFeatures, CategoryFeaturesField)
-from accounts.serializers import UserSerializer
+from accounts.serializers import UserSerializer, UploadSlotSerializer
+from accounts.images import derivative_srcset
+from accounts.uploads import confirm_upload, redeem_upload
 from adminHandlers.models import ServiceCategory
 from accounts.tasks import send_email
 
@@ -29,18 +32,58 @@ class ContactSerializer(serializers.ModelSerializer):
         
 class ResourceSerializer(serializers.ModelSerializer):
     listing = serializers.PrimaryKeyRelatedField(queryset=Listing.objects.all())
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Resource
-        fields = '__all__'
+        exclude = ['variants']
+        read_only_fields = ['processing_status', 'processing_error', 'processed_at']
         extra_kwargs = {
             'resource': {'required': False}
         }
 
+    def get_srcset(self, obj):
+        return derivative_srcset(obj.resource.storage, obj.variants)
+
+class ResourceUploadSlotSerializer(UploadSlotSerializer):
+    listing = serializers.PrimaryKeyRelatedField(queryset=Listing.objects.all())
+    type = serializers.ChoiceField(choices=Resource.RESOURCE_TYPE_CHOICES)
+    
+    def validate_listing(self, value):
+        user = self.context['request'].user
+        if value.created_by_id != user.id and not user.is_admin:
+            raise serializers.ValidationError("You can only upload resources to your own listings.")
+        return value
+
+class ResourceUploadConfirmSerializer(serializers.ModelSerializer):
+    token = serializers.CharField(write_only=True)
+    
+    class Meta:
+        model = Resource
+        fields = ['listing', 'type', 'name', 'description', 'is_cover', 'token']
+        
+    def validate(self, attrs):
+        # The token pins the key to the listing and type the slot was issued for
+        attrs['resource'] = confirm_upload(
+            self.context['request'], attrs.pop('token'), listing=attrs['listing'].id, type=attrs['type']
+        )
+        return attrs
+    
+    def create(self, validated_data):
+        with transaction.atomic():
+            redeem_upload(self.context['request'], validated_data['resource'])
+            return super().create(validated_data)
+
 class NestedResourceSerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+    
     class Meta:
         model = Resource
-        exclude = ["listing"]  
+        exclude = ["listing", "variants"]  
+        read_only_fields = ['processing_status', 'processing_error', 'processed_at']
+        
+    def get_srcset(self, obj):
+        return derivative_srcset(obj.resource.storage, obj.variants)
 
 class ListingFeatureSerializer(serializers.ModelSerializer):
     feature_field = serializers.PrimaryKeyRelatedField(queryset=CategoryFeaturesField.objects.all())
@@ -67,7 +110,37 @@ class ListingFeatureSerializer(serializers.ModelSerializer):
         return obj.feature_field.unit if obj.feature_field else None
     
     
+def get_favorited_listing_ids(user, listings):
+    """
+    Return the ids of the given listings that the user has favorited, in a single query.
+    """
+    if not user or not user.is_authenticated:
+        return set()
+    listing_ids = [listing.id for listing in listings]
+    if not listing_ids:
+        return set()
+    return set(
+        Favorite.objects.filter(user_id=user.id, listing_id__in=listing_ids).values_list('listing_id', flat=True)
+    )
+
+
+class ListingListSerializer(serializers.ListSerializer):
+    """
+    Resolves the favorite state for the whole page at once instead of once per listing.
+    """
+    def to_representation(self, data):
+        listings = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        request = self.context.get('request', None)
+        self.child.favorite_ids = get_favorited_listing_ids(request.user if request else None, listings)
+        try:
+            return super().to_representation(listings)
+        finally:
+            self.child.favorite_ids = None
+
+
 class ListingSerializer(serializers.ModelSerializer):
+    favorite_ids = None
+    
     created_by = UserSerializer(read_only=True)
     location = LocationSerializer()
     service = ServiceSerializer()
@@ -79,7 +152,9 @@ class ListingSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Listing
-        fields = '__all__'
+        # Feed and visibility bookkeeping, maintained server-side
+        exclude = ['shuffle_key', 'shuffle_key_1', 'shuffle_key_2', 'shuffle_key_3', 'visible_until']
+        list_serializer_class = ListingListSerializer
         
     def to_representation(self, instance):
         """
@@ -87,13 +162,17 @@ class ListingSerializer(serializers.ModelSerializer):
         """
         representation = super().to_representation(instance)
         
-        request = self.context.get('request', None)
-        if request and request.user.is_authenticated:
-            # Check if this listing is favorited by the user
-            is_favorited = Favorite.objects.filter(user=request.user, listing=instance).exists()
-            representation['favorite'] = is_favorited
+        if self.favorite_ids is not None:
+            # Favorite state already resolved for the whole page by ListingListSerializer
+            representation['favorite'] = instance.id in self.favorite_ids
         else:
-            representation['favorite'] = False
+            request = self.context.get('request', None)
+            if request and request.user.is_authenticated:
+                # Check if this listing is favorited by the user
+                is_favorited = Favorite.objects.filter(user_id=request.user.id, listing=instance).exists()
+                representation['favorite'] = is_favorited
+            else:
+                representation['favorite'] = False
             
         return representation
 
@@ -218,6 +297,7 @@ class ListingMinimalSerializer(serializers.ModelSerializer):
             'first_name': obj.created_by.first_name,
             'last_name': obj.created_by.last_name,
             'passport': passport_url,
+            'passport_srcset': derivative_srcset(obj.created_by.passport.storage, obj.created_by.passport_variants),
             'email': obj.created_by.email,
             'phone': obj.created_by.phone,
         }
\ No newline at end of file
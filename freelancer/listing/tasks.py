@@ -0,0 +1,96 @@
+from celery import shared_task
+from django.core.files.base import ContentFile
+from django.utils import timezone
+import logging
+from PIL import UnidentifiedImageError
+from accounts.images import generate_image_derivatives, delete_image_derivatives
+from .compression import get_compressor
+from .models import Resource
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, max_retries=5)
+def compress_resource_image(self, resource_id):
+    """
+    Stream a listing image from storage, compress it and store the result next to the original.
+    The row is pointed at the compressed copy before the original is deleted, so a failure at
+    any step leaves a readable image behind.
+    """
+    resource = Resource.objects.filter(id=resource_id, type='image').first()
+    if not resource or not resource.resource:
+        return
+
+    Resource.objects.filter(id=resource_id).update(processing_status=Resource.ProcessingStatus.PROCESSING)
+    compressor = get_compressor()
+
+    try:
+        with resource.resource.open('rb') as source:
+            original = source.read()
+        compressed = compressor.compress(original)
+
+        # Only replace the stored object when compression actually saved bytes. Storages that
+        # don't overwrite pick a free name; those that do replace the object in one write.
+        storage = resource.resource.storage
+        original_name = resource.resource.name
+        if len(compressed) < len(original):
+            name = storage.save(original_name, ContentFile(compressed))
+        else:
+            name = original_name
+
+    except compressor.retryable_errors as e:
+        exhausted = self.request.retries >= self.max_retries
+        Resource.objects.filter(id=resource_id).update(
+            processing_status=Resource.ProcessingStatus.FAILED if exhausted else Resource.ProcessingStatus.PENDING,
+            processing_error=str(e),
+        )
+        if exhausted:
+            logger.error(f"Compression gave up for resource {resource_id}: {e}")
+            return
+        raise self.retry(exc=e, countdown=30 * 2 ** self.request.retries)
+
+    except Exception as e:
+        logger.exception(f"Compression failed for resource {resource_id}: {e}")
+        Resource.objects.filter(id=resource_id).update(
+            processing_status=Resource.ProcessingStatus.FAILED,
+            processing_error=str(e),
+        )
+        return
+
+    # Queryset update: keeps post_save (and django-cleanup) from firing on our own write-back
+    updated = Resource.objects.filter(id=resource_id).update(
+        resource=name,
+        processing_status=Resource.ProcessingStatus.DONE,
+        processing_error=None,
+        processed_at=timezone.now(),
+    )
+    if name != original_name:
+        # Deleted meanwhile: nothing points at the compressed copy either
+        storage.delete(original_name if updated else name)
+
+
+@shared_task(bind=True, max_retries=3)
+def generate_resource_derivatives(self, resource_id):
+    """
+    Write the responsive widths and WebP copies of a listing image next to the original.
+    """
+    resource = Resource.objects.filter(id=resource_id, type='image').first()
+    if not resource or not resource.resource:
+        return
+
+    try:
+        variants = generate_image_derivatives(resource.resource)
+    except UnidentifiedImageError as e:
+        logger.error(f"Resource {resource_id} is not a readable image: {e}")
+        return
+    except OSError as e:
+        # Storage hiccups are worth another go
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=30 * 2 ** self.request.retries)
+        logger.exception(f"Derivative generation failed for resource {resource_id}: {e}")
+        return
+
+    # Point the row at the new copies before dropping the ones they replace
+    Resource.objects.filter(id=resource_id).update(variants=variants)
+    stale = {width: names for width, names in resource.variants.items() if names not in variants.values()}
+    delete_image_derivatives(resource.resource.storage, stale)
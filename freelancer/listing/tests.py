@@ -1,3 +1,417 @@
-from django.test import TestCase
+from datetime import timedelta
+from django.db import connection
+from io import BytesIO
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from accounts.models import User, Role, UserRole, Address
+from adminHandlers.models import ServiceCategory, CategoryFeaturesField
+from .models import Listing, Location, Contact, Service, ListingFeatures, Resource, Favorite, ListingStatusCount
+from .search import search_listings, boolean_search_query
+from .tasks import compress_resource_image, generate_resource_derivatives
+from .serializers import NestedResourceSerializer
+from adsApp.models import Ad, AppLocation, SuperAdsCategory, SuperAdsCategoryLocation
+from paymentApp.models import Payment, CoversAllSubscription
+from accounts.tasks import expire_ads_if_needed
 
-# Create your tests here.
+
+class ListingTestMixin:
+    def create_user(self, email, phone, role_id='SERVICE_PROVIDER'):
+        user = User.objects.create_user(
+            email=email,
+            first_name='Test',
+            last_name='User',
+            phone=phone,
+            password='password123',
+            address=Address.objects.create(country='HR', city='Zagreb'),
+        )
+        UserRole.objects.create(user=user, role_id=role_id)
+        return user
+
+    def create_listing(self, user, category, header='Plumbing', **extra):
+        listing = Listing.objects.create(
+            category=category,
+            location=Location.objects.create(country='HR', county='Grad Zagreb', city='Zagreb', street_name='Ilica'),
+            contact=Contact.objects.create(fullname='Test Contact'),
+            service=Service.objects.create(header=header, description_en='Fixing pipes', description_hr='Popravak cijevi'),
+            price=50,
+            created_by=user,
+            **{'status': 'approved', **extra}
+        )
+        ListingFeatures.objects.create(listing=listing, feature_field=self.feature_field, value='2')
+        Resource.objects.create(listing=listing, resource='listingResources/photo.jpg', type='video', name='photo')
+        return listing
+
+
+class ListingQueryCountTest(ListingTestMixin, TestCase):
+    def setUp(self):
+        Role.objects.create(id='SERVICE_PROVIDER', label='Service Provider', description='Provider')
+        self.category = ServiceCategory.objects.create(name_en='Home', name_hr='Dom')
+        self.feature_field = CategoryFeaturesField.objects.create(category=self.category, label_en='Rooms', type='number')
+        self.user = self.create_user('provider@example.com', '0911111111')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        urls = [
+            '/api/v1/user/listings/',
+            '/api/v1/user/user-listings/',
+            '/api/v1/user/favorited-listings/',
+            '/api/v1/user/available-listings/',
+        ]
+        for index in range(2):
+            listing = self.create_listing(self.user, self.category, header=f'Listing {index}')
+            Favorite.objects.create(user=self.user, listing=listing)
+        small_page = {url: self.count_queries(url) for url in urls}
+
+        for index in range(2, 12):
+            listing = self.create_listing(
+                self.create_user(f'provider{index}@example.com', f'09200000{index:02d}'),
+                self.category,
+                header=f'Listing {index}',
+            )
+            Favorite.objects.create(user=self.user, listing=listing)
+
+        for url in urls:
+            self.assertEqual(self.count_queries(url), small_page[url], url)
+
+    def create_super_ads(self, tier, first, last):
+        for index in range(first, last):
+            listing = self.create_listing(
+                self.create_user(f'advertiser{index}@example.com', f'093000{index:04d}'),
+                self.category,
+                header=f'Super {index}',
+            )
+            Ad.objects.create(
+                listing=listing, super_ads_category=tier, type='super_ads', status='active',
+                start_date=timezone.now() - timedelta(days=1), end_date=timezone.now() + timedelta(days=1),
+            )
+
+    def test_super_ad_locations_query_count_is_fixed(self):
+        tier = SuperAdsCategory.objects.create(title='Top', price=10)
+        SuperAdsCategoryLocation.objects.create(
+            super_ads_category=tier, app_location=AppLocation.objects.create(id='home', name='Home')
+        )
+        self.create_super_ads(tier, 0, 2)
+        # ads, listings, roles (+ role lookup), resources, features, tier locations, app locations, favorites
+        with self.assertNumQueries(9):
+            self.assertEqual(len(self.client.get('/api/v1/user/location-listings/').json()['home']), 2)
+
+        self.create_super_ads(tier, 2, 12)
+        with self.assertNumQueries(9):
+            self.assertEqual(len(self.client.get('/api/v1/user/location-listings/').json()['home']), 12)
+
+    def test_favorite_flag_is_resolved_per_listing(self):
+        favorited, other = (self.create_listing(self.user, self.category, header=header) for header in ('Liked', 'Other'))
+        Favorite.objects.create(user=self.user, listing=favorited)
+        tier = SuperAdsCategory.objects.create(title='Top', price=10)
+        SuperAdsCategoryLocation.objects.create(
+            super_ads_category=tier, app_location=AppLocation.objects.create(id='home', name='Home')
+        )
+        for listing in (favorited, other):
+            Ad.objects.create(
+                listing=listing, super_ads_category=tier, type='super_ads', status='active',
+                start_date=timezone.now() - timedelta(days=1), end_date=timezone.now() + timedelta(days=1),
+            )
+
+        expected = {favorited.id: True, other.id: False}
+        for client, flags in ((self.client, expected), (APIClient(), dict.fromkeys(expected, False))):
+            rows = client.get('/api/v1/user/available-listings/').json()['results']
+            self.assertEqual({row['id']: row['favorite'] for row in rows}, flags)
+            rows = client.get('/api/v1/user/location-listings/').json()['home']
+            self.assertEqual({row['id']: row['favorite'] for row in rows}, flags)
+
+    def test_shuffled_feed_cursor_visits_every_listing_once(self):
+        listings = [self.create_listing(self.user, self.category, header=f'Listing {index}') for index in range(7)]
+        # Each order shuffled differently, with keys on both sides of the seeds' pivots so the walks wrap around
+        step = 2 ** 31 // 7
+        for index, listing in enumerate(listings):
+            Listing.objects.filter(id=listing.id).update(
+                shuffle_key=index * step,
+                shuffle_key_1=(index * 3 % 7) * step,
+                shuffle_key_2=(index * 5 % 7) * step,
+                shuffle_key_3=(index * 6 % 7) * step,
+            )
+
+        orders = {}
+        for seed in ('test', 'a'):
+            seen, url = [], f'/api/v1/user/available-listings/?seed={seed}&limit=3'
+            while url:
+                page = self.client.get(url).json()
+                self.assertIsNone(page['count'])
+                self.assertEqual(page['seed'], seed)
+                self.assertNotIn('shuffle_key', page['results'][0])
+                seen += [row['id'] for row in page['results']]
+                url = page['next']
+            self.assertEqual(sorted(seen), sorted(listing.id for listing in listings))
+            orders[seed] = seen
+
+            # The same seed gives the same order
+            first_page = self.client.get(f'/api/v1/user/available-listings/?seed={seed}&limit=3').json()['results']
+            self.assertEqual([row['id'] for row in first_page], seen[:3])
+
+        # Another seed walks another order, not the same cycle from another starting point
+        rotations = [orders['test'][index:] + orders['test'][:index] for index in range(7)]
+        self.assertNotIn(orders['a'], rotations)
+
+
+class ListingSearchTest(ListingTestMixin, TestCase):
+    def setUp(self):
+        Role.objects.create(id='SERVICE_PROVIDER', label='Service Provider', description='Provider')
+        self.category = ServiceCategory.objects.create(name_en='Cleaning', name_hr='Čišćenje')
+        self.feature_field = CategoryFeaturesField.objects.create(category=self.category, label_en='Rooms', type='number')
+        self.user = self.create_user('provider@example.com', '0911111111')
+
+    def test_search_document_follows_related_changes(self):
+        listing = self.create_listing(self.user, self.category, header='Window washing')
+        self.assertEqual(list(search_listings(Listing.objects.all(), 'čišćenje')), [listing])
+
+        listing.service.description_hr = 'Pranje prozora'
+        listing.service.save()
+        self.assertEqual(list(search_listings(Listing.objects.all(), 'prozora')), [listing])
+
+        self.category.name_en = 'Housekeeping'
+        self.category.save()
+        self.assertEqual(list(search_listings(Listing.objects.all(), 'housekeeping')), [listing])
+        self.assertFalse(search_listings(Listing.objects.all(), 'cleaning').exists())
+
+    def test_boolean_query_only_requires_indexed_words(self):
+        self.assertEqual(boolean_search_query(['fix', 'the', 'pipes']), '+fix* +pipes* the*')
+        self.assertEqual(boolean_search_query(['wc', 'popravak']), '+popravak* wc*')
+        # Nothing FULLTEXT could match: the caller falls back to icontains
+        self.assertIsNone(boolean_search_query(['to', 'wc']))
+        listing = self.create_listing(self.user, self.category, header='WC repairs')
+        self.assertEqual(list(search_listings(Listing.objects.all(), 'wc')), [listing])
+
+    def test_search_ranks_header_matches_first(self):
+        description_match = self.create_listing(self.user, self.category, header='Gardening')
+        description_match.service.description_en = 'We also fix pipes'
+        description_match.service.save()
+        header_match = self.create_listing(self.user, self.category, header='Pipes and drains')
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/v1/user/listings/', {'search': 'pipes'})
+        self.assertEqual([row['id'] for row in response.json()['results']], [header_match.id, description_match.id])
+
+
+class ListingCursorPaginationTest(ListingTestMixin, TestCase):
+    def setUp(self):
+        Role.objects.create(id='SERVICE_PROVIDER', label='Service Provider', description='Provider')
+        self.category = ServiceCategory.objects.create(name_en='Home')
+        self.feature_field = CategoryFeaturesField.objects.create(category=self.category, label_en='Rooms', type='number')
+        self.user = self.create_user('provider@example.com', '0911111111')
+        self.listings = [self.create_listing(self.user, self.category, header=f'Listing {index}') for index in range(5)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_cursor_pages_walk_every_row_once_without_count(self):
+        seen = []
+        params = {'cursor': '', 'limit': 2}
+        while True:
+            data = self.client.get('/api/v1/user/user-listings/', params).json()
+            self.assertIsNone(data['count'])
+            seen += [row['id'] for row in data['results']]
+            if not data['next_cursor']:
+                break
+            params['cursor'] = data['next_cursor']
+
+        self.assertEqual(seen, [listing.id for listing in reversed(self.listings)])
+
+    def test_offset_mode_is_unchanged_without_cursor(self):
+        data = self.client.get('/api/v1/user/user-listings/', {'limit': 2, 'page': 2}).json()
+        self.assertEqual(data['count'], 5)
+        self.assertNotIn('next_cursor', data)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/v1/user/user-listings/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_is_rejected_with_another_ordering(self):
+        response = self.client.get('/api/v1/user/user-listings/', {'cursor': '', 'ordering': 'status'})
+        self.assertEqual(response.status_code, 400)
+        # Search results are sorted by rank
+        response = self.client.get('/api/v1/user/listings/', {'cursor': '', 'search': 'listing'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get('/api/v1/user/user-listings/', {'cursor': '', 'ordering': '-created_at'})
+        self.assertEqual(response.status_code, 200)
+
+
+class ListingVisibilityTest(ListingTestMixin, TestCase):
+    def setUp(self):
+        Role.objects.create(id='SERVICE_PROVIDER', label='Service Provider', description='Provider')
+        self.category = ServiceCategory.objects.create(name_en='Home')
+        self.feature_field = CategoryFeaturesField.objects.create(category=self.category, label_en='Rooms', type='number')
+        self.user = self.create_user('provider@example.com', '0911111111')
+        self.listing = self.create_listing(self.user, self.category)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def summary(self):
+        return self.client.get('/api/v1/summary/').json()
+
+    def test_ads_and_covers_all_drive_visibility(self):
+        self.assertEqual(self.summary()['expired'], 1)
+
+        ad = Ad.objects.create(
+            listing=self.listing, type='regular_ads', status='active',
+            start_date=timezone.now(), end_date=timezone.now() + timedelta(days=30),
+        )
+        self.assertEqual(self.summary()['approved'], 1)
+
+        Ad.objects.filter(id=ad.id).update(end_date=timezone.now() - timedelta(minutes=1))
+        expire_ads_if_needed()
+        self.assertEqual(self.summary()['expired'], 1)
+
+        payment = Payment.objects.create(user=self.user, transaction_id='pi_test', covers_all=True, covers_all_month=1)
+        CoversAllSubscription.objects.create(
+            user=self.user, payment=payment,
+            start_date=timezone.now(), end_date=timezone.now() + timedelta(days=30),
+        )
+        self.assertEqual(self.summary()['approved'], 1)
+
+        # Listings created during the subscription are visible straight away
+        self.create_listing(self.user, self.category, header='Second listing')
+        self.assertEqual(self.summary()['approved'], 2)
+
+
+class ListingStatusCountTest(ListingTestMixin, TestCase):
+    def setUp(self):
+        Role.objects.create(id='SERVICE_PROVIDER', label='Service Provider', description='Provider')
+        Role.objects.create(id='SUPER_ADMIN', label='Super Admin', description='Admin', is_admin=True)
+        self.category = ServiceCategory.objects.create(name_en='Home')
+        self.feature_field = CategoryFeaturesField.objects.create(category=self.category, label_en='Rooms', type='number')
+        self.user = self.create_user('provider@example.com', '0911111111')
+        self.admin = self.create_user('admin@example.com', '0922222222', role_id='SUPER_ADMIN')
+
+    def test_counters_follow_status_transitions(self):
+        listings = [self.create_listing(self.user, self.category, status='pending') for _ in range(3)]
+        self.assertEqual(ListingStatusCount.totals()['pending'], 3)
+
+        ListingStatusCount.transition(Listing.objects.filter(id__in=[listings[0].id, listings[1].id]), 'approved')
+        listings[2].status = 'rejected'
+        listings[2].save()
+        listings[0].delete()
+        self.assertEqual(ListingStatusCount.totals(), {'pending': 0, 'approved': 1, 'rejected': 1, 'expired': 0})
+
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            data = client.get('/api/v1/summary/').json()
+        self.assertEqual(data, {'total': 2, 'approved': 0, 'pending': 0, 'rejected': 1, 'expired': 1})
+        self.assertFalse(any('COUNT' in query['sql'] and 'rejected' in query['sql'] for query in queries))
+
+    def test_missing_counter_row_is_recreated(self):
+        ListingStatusCount.objects.filter(status='pending').delete()
+        ListingStatusCount.adjust('pending', 2)
+        ListingStatusCount.adjust('pending', 1)
+        self.assertEqual(ListingStatusCount.totals()['pending'], 3)
+
+
+@override_settings(
+    IMAGE_COMPRESSOR='listing.compression.LocalCompressor',
+    STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+)
+class ResourceCompressionTest(ListingTestMixin, TestCase):
+    def setUp(self):
+        Role.objects.create(id='SERVICE_PROVIDER', label='Service Provider', description='Provider')
+        self.category = ServiceCategory.objects.create(name_en='Home')
+        self.feature_field = CategoryFeaturesField.objects.create(category=self.category, label_en='Rooms', type='number')
+        self.listing = self.create_listing(self.create_user('provider@example.com', '0911111111'), self.category)
+
+    def make_image(self):
+        output = BytesIO()
+        Image.effect_noise((400, 400), 64).convert('RGB').save(output, format='JPEG', quality=100)
+        return SimpleUploadedFile('photo.jpg', output.getvalue(), content_type='image/jpeg')
+
+    def test_upload_queues_compression_and_task_records_state(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            resource = Resource.objects.create(listing=self.listing, resource=self.make_image(), type='image', name='photo')
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(resource.processing_status, Resource.ProcessingStatus.PENDING)
+        original_size, original_name = resource.resource.size, resource.resource.name
+
+        compress_resource_image.apply(args=[resource.id])
+
+        resource.refresh_from_db()
+        self.assertEqual(resource.processing_status, Resource.ProcessingStatus.DONE)
+        self.assertIsNotNone(resource.processed_at)
+        self.assertLess(resource.resource.size, original_size)
+        # The compressed copy was written before the original was dropped
+        self.assertNotEqual(resource.resource.name, original_name)
+        self.assertFalse(resource.resource.storage.exists(original_name))
+
+    def test_videos_are_skipped(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            resource = Resource.objects.create(listing=self.listing, resource='listingResources/clip.mp4', type='video', name='clip')
+        self.assertEqual(callbacks, [])
+        self.assertEqual(resource.processing_status, Resource.ProcessingStatus.SKIPPED)
+
+    def test_derivatives_are_generated_and_exposed_as_srcset(self):
+        with self.captureOnCommitCallbacks():
+            resource = Resource.objects.create(listing=self.listing, resource=self.make_image(), type='image', name='photo')
+
+        generate_resource_derivatives.apply(args=[resource.id])
+
+        resource.refresh_from_db()
+        # 1024 is wider than the 400px original and is never upscaled
+        self.assertEqual(sorted(resource.variants), ['320'])
+        self.assertTrue(resource.variants['320']['webp'].endswith('_w320.webp'))
+        self.assertTrue(resource.resource.storage.exists(resource.variants['320']['default']))
+
+        srcset = NestedResourceSerializer(resource).data['srcset']
+        self.assertEqual(set(srcset), {'default', 'webp'})
+        self.assertIn('320w', srcset['webp'])
+
+        # Regenerating writes new copies and drops the replaced ones once the row points at them
+        previous = resource.variants['320']
+        generate_resource_derivatives.apply(args=[resource.id])
+        resource.refresh_from_db()
+        self.assertTrue(all(resource.resource.storage.exists(name) for name in resource.variants['320'].values()))
+        self.assertFalse(any(resource.resource.storage.exists(name) for name in previous.values()))
+
+        storage, names = resource.resource.storage, resource.variants['320'].values()
+        with self.captureOnCommitCallbacks(execute=True):
+            resource.delete()
+        self.assertFalse(any(storage.exists(name) for name in names))
+
+    @override_settings(DIRECT_UPLOAD_BACKEND='accounts.uploads.LocalUploadBackend')
+    def test_direct_upload_records_key_and_queues_processing(self):
+        client = APIClient()
+        client.force_authenticate(self.listing.created_by)
+        slot = client.post('/api/v1/user/resources/upload-slot/', {
+            'listing': self.listing.id, 'type': 'image', 'filename': 'photo.jpg', 'content_type': 'image/jpeg',
+        }, format='json').json()
+
+        # Confirming before the file landed in storage is refused
+        confirm = {'listing': self.listing.id, 'type': 'image', 'name': 'photo', 'token': slot['token']}
+        self.assertEqual(client.post('/api/v1/user/resources/confirm-upload/', confirm, format='json').status_code, 400)
+
+        upload = APIClient().post(slot['url'], {**slot['fields'], 'file': self.make_image()}, format='multipart')
+        self.assertEqual(upload.status_code, 204)
+
+        # The token is bound to the listing it was issued for
+        other_listing = self.create_listing(self.listing.created_by, self.category)
+        response = client.post('/api/v1/user/resources/confirm-upload/', {**confirm, 'listing': other_listing.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = client.post('/api/v1/user/resources/confirm-upload/', confirm, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(callbacks), 1)
+        resource = Resource.objects.get(id=response.json()['id'])
+        self.assertEqual(resource.resource.name, slot['key'])
+        self.assertEqual(resource.processing_status, Resource.ProcessingStatus.PENDING)
@@ -1,20 +1,23 @@
 from rest_framework import viewsets, status, filters
 from rest_framework.permissions import IsAuthenticated
-from .models import Listing, Resource, Favorite
+from .models import Listing, Resource, Favorite, ListingStatusCount
 from rest_framework.decorators import action
 from . import serializers as sz
 from accounts.permissions import IsAdminOrOwner, IsAdminUser, isAuthenticatedOrReadOnly
-from accounts.pagination import CustomOffsetPagination
-from django.db.models import Q, OuterRef, Exists, Prefetch
+from accounts.pagination import CustomOffsetPagination, SeededShufflePagination
+from django.db.models import Q, Prefetch, Count
 import json
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from adsApp.models import Ad
 from django.utils.timezone import now
-from paymentApp.models import CoversAllSubscription
 from dateutil.relativedelta import relativedelta
 from rest_framework.permissions import AllowAny
+from .search import search_listings
+from .visibility import visible_listings_filter
+from accounts.uploads import create_upload_slot
+from accounts.tokens import RoleClaimsJWTAuthentication
 
 
 
@@ -25,10 +28,11 @@ class ListingViewSet(viewsets.ModelViewSet):
     """
     Handles CRUD operations for Property Listings.
     """ 
-    queryset = Listing.objects.all().order_by('-created_at','-updated_at')
+    queryset = Listing.objects.with_related().order_by('-created_at','-updated_at')
     serializer_class = sz.ListingSerializer
     permission_classes = [IsAuthenticated, IsAdminOrOwner]
     pagination_class = CustomOffsetPagination
+    cursor_ordering = ('-created_at', '-id')
     parser_classes = [MultiPartParser, FormParser, JSONParser]
     
     def get_queryset(self):
@@ -48,12 +52,6 @@ class ListingViewSet(viewsets.ModelViewSet):
         # Initialize filters with an empty Q object
         filters = Q()
 
-        if search:
-            filters &= Q(category__name__icontains=search) | \
-                    Q(property__description_en__icontains=search) | \
-                    Q(property__description_hr__icontains=search) | \
-                    Q(property__header__icontains=search)
-
         if status in ["pending", "approved", "rejected"]:
             filters &= Q(status=status)
 
@@ -71,7 +69,12 @@ class ListingViewSet(viewsets.ModelViewSet):
             filters &= Q(location__country__icontains = country)
 
         # Apply the accumulated filters in one go
-        return queryset.filter(filters)
+        queryset = queryset.filter(filters)
+        
+        if search:
+            queryset = search_listings(queryset, search).order_by('-search_rank', '-created_at', '-updated_at')
+            
+        return queryset
     
     def list(self, request, *args, **kwargs):
         """
@@ -80,13 +83,12 @@ class ListingViewSet(viewsets.ModelViewSet):
         queryset = self.filter_queryset(self.get_queryset())
         page = self.paginate_queryset(queryset)
 
-        # Count pending and rejected listings
-        pending_count = Listing.objects.filter(status="pending").count()
-        rejected_count = Listing.objects.filter(status="rejected").count()
+        # Count pending and rejected listings from the status counter cache
+        status_counts = ListingStatusCount.totals()
 
         extra_data = {
-        "pending_count": pending_count,
-        "rejected_count": rejected_count
+        "pending_count": status_counts["pending"],
+        "rejected_count": status_counts["rejected"]
         }
 
         if page is not None:
@@ -133,10 +135,11 @@ class ListingViewSet(viewsets.ModelViewSet):
 
 # All listings for the user end(mobile app)  
 class UserListings(viewsets.ReadOnlyModelViewSet):
-    queryset = Listing.objects.all()
+    queryset = Listing.objects.with_related()
     serializer_class = sz.ListingSerializer
     permission_classes = [isAuthenticatedOrReadOnly]
     pagination_class = CustomOffsetPagination
+    cursor_ordering = ('-created_at', '-id')
     filter_backends = [filters.OrderingFilter]
     ordering_fields = ['created_at', 'status']
     ordering = ['-created_at', '-updated_at']
@@ -149,26 +152,6 @@ class UserListings(viewsets.ReadOnlyModelViewSet):
         self_param = params.get('self', 'false').lower() == 'true'
         status = params.get('status')
 
-        #  Common annotations 
-        active_ads = Ad.objects.filter(
-            listing=OuterRef('pk'),
-            start_date__lte=now(),
-            end_date__gte=now(),
-            status='active',
-        )
-
-        covers_all = CoversAllSubscription.objects.filter(
-            user=OuterRef('created_by'),
-            start_date__lte=now(),
-            end_date__gte=now(),
-        )
-        
-        queryset = queryset.annotate(
-            has_active_ad=Exists(active_ads),
-            has_covers_all=Exists(covers_all)
-        )
-
-         
         #  Base filters
         if self_param:
             filters = Q(created_by=user)
@@ -177,10 +160,10 @@ class UserListings(viewsets.ReadOnlyModelViewSet):
                 filters &= Q(status=status)
                 
             elif status == "approved":
-                filters &= Q(status='approved') & Q(has_active_ad=True) | Q(status='approved') & Q(has_covers_all=True)
+                filters &= Q(status='approved') & visible_listings_filter()
                 
             elif status == "expired":
-                filters &= Q(status='approved') & Q(has_active_ad=False)
+                filters &= Q(status='approved') & ~visible_listings_filter()
 
         else:
             filters = Q(status='approved', available=True)
@@ -209,9 +192,7 @@ class UserListings(viewsets.ReadOnlyModelViewSet):
 
         #  Public listings visibility (ads OR covers-all)
         # if not self_param:
-        #     queryset = queryset.filter(
-        #         Q(has_active_ad=True) | Q(has_covers_all=True)
-        #     )
+        #     queryset = queryset.filter(visible_listings_filter())
 
         return queryset.distinct()
 
@@ -224,7 +205,7 @@ class ResourceViewSet(viewsets.ModelViewSet):
     queryset = Resource.objects.all()
     serializer_class = sz.ResourceSerializer
     permission_classes = [IsAuthenticated]
-    parser_classes = (MultiPartParser, FormParser) 
+    parser_classes = (MultiPartParser, FormParser, JSONParser) 
 
     def create(self, request, *args, **kwargs):
         listing_id = request.data.get("listing")
@@ -238,6 +219,30 @@ class ResourceViewSet(viewsets.ModelViewSet):
         self.perform_create(serializer)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
+    @action(detail=False, methods=['post'], url_path='upload-slot')
+    def upload_slot(self, request):
+        """
+        Presigned slot for uploading a file straight to storage, to be finished with `confirm-upload`.
+        """
+        serializer = sz.ResourceUploadSlotSerializer(data=request.data, context={"request": request})
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        slot = create_upload_slot(
+            request, Resource._meta.get_field('resource'), data['filename'], data['content_type'],
+            listing=data['listing'].id, type=data['type'],
+        )
+        return Response(slot, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['post'], url_path='confirm-upload')
+    def confirm_upload(self, request):
+        """
+        Record a finished direct upload; image post-processing is queued by the Resource receivers.
+        """
+        serializer = sz.ResourceUploadConfirmSerializer(data=request.data, context={"request": request})
+        serializer.is_valid(raise_exception=True)
+        resource = serializer.save()
+        return Response(sz.ResourceSerializer(resource, context={"request": request}).data, status=status.HTTP_201_CREATED)
+    
     
 class FavoriteViewset(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
@@ -265,66 +270,48 @@ class FavoriteViewset(viewsets.ModelViewSet):
 
 
 class GetFavoritedListings(viewsets.ReadOnlyModelViewSet):
+    authentication_classes = [RoleClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated]
     serializer_class = sz.ListingSerializer
     
     def get_queryset(self):
-        return Listing.objects.filter(
-            id__in=Favorite.objects.filter(user=self.request.user).values_list('listing_id', flat=True)
+        return Listing.objects.with_related().filter(
+            id__in=Favorite.objects.filter(user_id=self.request.user.id).values_list('listing_id', flat=True)
         )
 
 
 class Summary(APIView):
-    
+    authentication_classes = [RoleClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        queryset = Listing.objects.all() if request.user.is_admin else Listing.objects.filter(created_by=request.user)
-        
-        active_ads = Ad.objects.filter(
-            listing=OuterRef('pk'),
-            start_date__lte=now(),
-            end_date__gte=now(),
-            status='active',
-        )
-        
-        covers_all = CoversAllSubscription.objects.filter(
-            user=OuterRef('created_by'),
-            start_date__lte=now(),
-            end_date__gte=now(),
-        )
+        if request.user.is_admin:
+            # The other per-status totals come from the counter cache; the time-dependent
+            # approved/expired split is counted live, both halves in the same query
+            status_counts = ListingStatusCount.totals()
+            approved = Listing.objects.filter(status='approved').aggregate(
+                approved=Count('id', filter=visible_listings_filter()),
+                # Expired = approved AND NO active ad AND NO covers all
+                expired=Count('id', filter=~visible_listings_filter()),
+            )
+            
+            data = {
+                "total": sum(count for status, count in status_counts.items() if status != 'approved') + sum(approved.values()),
+                "approved": approved['approved'],
+                "pending": status_counts['pending'],
+                "rejected": status_counts['rejected'],
+                "expired": approved['expired'],
+            }
+            return Response(data, status=status.HTTP_200_OK)
         
-        queryset = queryset.annotate(
-            has_active_ad=Exists(active_ads),
-            has_covers_all=Exists(covers_all)
+        data = Listing.objects.filter(created_by_id=request.user.id).aggregate(
+            total=Count('id'),
+            approved=Count('id', filter=Q(status='approved') & visible_listings_filter()),
+            pending=Count('id', filter=Q(status='pending')),
+            rejected=Count('id', filter=Q(status='rejected')),
+            # Expired = approved AND NO active ad AND NO covers all
+            expired=Count('id', filter=Q(status='approved') & ~visible_listings_filter()),
         )
-        
-        total_count = queryset.count()
-        pending_count = queryset.filter(status='pending').count()
-        rejected_count = queryset.filter(status='rejected').count()
-        
-        approved_count = queryset.filter(
-            status='approved'
-        ).filter(
-            Q(has_active_ad=True) | Q(has_covers_all=True)
-        ).count()
-
-        # Expired = approved AND NO active ad AND NO covers all
-        expired_count = queryset.filter(
-            status='approved',
-            has_active_ad=False,
-            has_covers_all=False
-        ).count()
-        
-        
-        data = {
-            "total": total_count,
-            "approved": approved_count,
-            "pending": pending_count,
-            "rejected": rejected_count,
-            "expired": expired_count,
-            # "free_listings": free_listings
-        }
        
         return Response(data, status=status.HTTP_200_OK)
     
@@ -382,10 +369,22 @@ class GetSuperAdLocationListings(viewsets.ViewSet):
                 listing__status = 'approved',
                 **({"listing__location__country": country} if country else {})
             )
-            .select_related('listing', 'super_ads_category')
-            .prefetch_related('super_ads_category__locations__app_location')
+            .select_related('super_ads_category')
+            .prefetch_related(
+                Prefetch('listing', queryset=Listing.objects.with_related()),
+                'super_ads_category__locations__app_location'
+            )
         )
         
+        ads = list(ads)
+        
+        # Serialize every distinct listing once, so favorites are resolved in a single query
+        listings = list({ad.listing.id: ad.listing for ad in ads}.values())
+        serialized_listings = {
+            listing['id']: listing
+            for listing in sz.ListingSerializer(listings, many=True, context={'request': request}).data
+        }
+        
         location_map = {}
 
         for ad in ads:
@@ -399,12 +398,11 @@ class GetSuperAdLocationListings(viewsets.ViewSet):
                 if location_filter and loc_id not in location_filter:
                     continue
                 
-                serialized = sz.ListingSerializer(listing, context={'request': request}).data
-                location_map.setdefault(loc_id, []).append(serialized.update({
-                    "superAd": {
-                        "id": ad.id
-                    }
-                }) or serialized)
+                serialized = dict(serialized_listings[listing.id])
+                serialized["superAd"] = {
+                    "id": ad.id
+                }
+                location_map.setdefault(loc_id, []).append(serialized)
                 
         return Response(location_map, status=status.HTTP_200_OK)
     
@@ -416,6 +414,7 @@ class SuperadListings(viewsets.ReadOnlyModelViewSet):
     serializer_class = sz.ListingSerializer
     permission_classes = [IsAdminUser]
     pagination_class = CustomOffsetPagination
+    cursor_ordering = ('-created_at', '-id')
     
     def get_queryset(self):
         """
@@ -428,18 +427,13 @@ class SuperadListings(viewsets.ReadOnlyModelViewSet):
         provider_id = params.get('provider')
         
         # Initialize queryset
-        queryset = Listing.objects.filter(ads__type = 'super_ads').prefetch_related(
+        queryset = Listing.objects.with_related().filter(ads__type = 'super_ads').prefetch_related(
             Prefetch('ads', queryset=Ad.objects.filter(type='super_ads').prefetch_related('impressions')),
             'payments'
         ).order_by('-created_at', '-updated_at')
         
         # Initialize filters with an empty Q object
         filters = Q()
-        if search:
-            filters &= Q(category__name__icontains=search) | \
-                    Q(service__description_en__icontains=search) | \
-                    Q(service__description_hr__icontains=search) | \
-                    Q(service__header__icontains=search)
         if payment_status:
             filters &= Q(payments__status__in=payment_status.split(","))
         if ad_type:
@@ -448,16 +442,22 @@ class SuperadListings(viewsets.ReadOnlyModelViewSet):
             filters &= Q(created_by__id=provider_id)
             
         # Apply the accumulated filters in one go
-        return queryset.filter(filters).distinct()
+        queryset = queryset.filter(filters)
+        
+        if search:
+            queryset = search_listings(queryset, search).order_by('-search_rank', '-created_at', '-updated_at')
+            
+        return queryset.distinct()
 
 
 class AvailableListingsViewSet(viewsets.ReadOnlyModelViewSet):
     """
-    Returns available and approved listings in random order.
+    Returns available and approved listings in a seeded random order.
+    Follow `next` (it carries the seed) to keep the following pages consistent.
     """
     serializer_class = sz.ListingSerializer
     permission_classes = [AllowAny]
-    pagination_class = CustomOffsetPagination
+    pagination_class = SeededShufflePagination
 
     def get_queryset(self):
-        return Listing.objects.filter(status='approved', available=True).order_by('?')
+        return Listing.objects.with_related().filter(status='approved', available=True)
@@ -0,0 +1,45 @@
+from django.db.models import Q, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils.timezone import now
+
+
+def visible_listings_filter(prefix=''):
+    """
+    Q object matching listings currently paid for (an active ad or the owner's covers-all subscription).
+    """
+    return Q(**{f'{prefix}visible_until__gte': now()})
+
+
+def refresh_listing_visibility(listing_ids=None, user_ids=None):
+    """
+    Recompute `Listing.visible_until` for the given listings and for every listing of the given users.
+
+    `visible_until` is the later of the listing's latest active ad end date and its owner's
+    latest covers-all subscription end date, so visibility checks become a plain indexed filter.
+    """
+    from adsApp.models import Ad
+    from paymentApp.models import CoversAllSubscription
+    from .models import Listing
+
+    filters = Q()
+    if listing_ids:
+        filters |= Q(id__in=listing_ids)
+    if user_ids:
+        filters |= Q(created_by__in=user_ids)
+    if not filters:
+        return
+
+    latest_ad_end = Subquery(
+        Ad.objects.filter(listing=OuterRef('pk'), status='active').order_by('-end_date').values('end_date')[:1]
+    )
+    latest_covers_all_end = Subquery(
+        CoversAllSubscription.objects.filter(user=OuterRef('created_by')).order_by('-end_date').values('end_date')[:1]
+    )
+
+    # GREATEST() is NULL as soon as one side is NULL, so let each side fall back to the other
+    Listing.objects.filter(filters).update(
+        visible_until=Greatest(
+            Coalesce(latest_ad_end, latest_covers_all_end),
+            Coalesce(latest_covers_all_end, latest_ad_end),
+        )
+    )
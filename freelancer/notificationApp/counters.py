@@ -0,0 +1,91 @@
+"""
+Per-user unread counters for in-app notifications.
+
+The count polled by clients (unread `in_app` rows, as listed by NotificationViewSet)
+lives in the cache and is rebuilt with one COUNT on a miss. New rows increment it
+once their transaction commits, reading one decrements it and marking all read
+resets it. Counters that are not cached are left alone: the next poll rebuilds them.
+
+A process-local cache (CACHE_IS_SHARED off) would let each process drift on its own,
+so then every poll counts in the database instead.
+"""
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+UNREAD_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def unread_cache_key(user_id):
+    return f"notifications:unread:{user_id}"
+
+
+def unread_queryset(user_id):
+    from .models import Notification, NotificationTemplate
+    return Notification.objects.filter(recipient_user_id=user_id, channel=NotificationTemplate.Type.IN_APP, read=False)
+
+
+def get_unread_count(user_id):
+    if not settings.CACHE_IS_SHARED:
+        return unread_queryset(user_id).count()
+
+    key = unread_cache_key(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = unread_queryset(user_id).count()
+        cache.set(key, count, UNREAD_CACHE_TIMEOUT)
+    return count
+
+
+def add_unread(user_ids):
+    """
+    Count one new unread notification per entry of `user_ids` once the current transaction commits.
+    """
+    counts = Counter(user_ids)
+    if not counts or not settings.CACHE_IS_SHARED:
+        return
+
+    def increment():
+        keys = {unread_cache_key(user_id): count for user_id, count in counts.items()}
+        for key in cache.get_many(list(keys)):
+            try:
+                cache.incr(key, keys[key])
+            except ValueError:
+                # Expired since get_many
+                pass
+
+    transaction.on_commit(increment)
+
+
+def remove_unread(user_id, count=1):
+    if not settings.CACHE_IS_SHARED:
+        return
+
+    def decrement():
+        key = unread_cache_key(user_id)
+        try:
+            if cache.decr(key, count) < 0:
+                # Drifted (e.g. rebuilt while a new row was committing): rebuild on the next poll
+                cache.delete(key)
+        except ValueError:
+            pass
+
+    transaction.on_commit(decrement)
+
+
+def reset_unread(user_id):
+    if not settings.CACHE_IS_SHARED:
+        return
+    transaction.on_commit(lambda: cache.set(unread_cache_key(user_id), 0, UNREAD_CACHE_TIMEOUT))
+
+
+def invalidate_unread(*user_ids):
+    """
+    Drop the counters of the given users (e.g. after unread rows were archived) once the
+    current transaction commits; the next poll rebuilds them.
+    """
+    keys = [unread_cache_key(user_id) for user_id in user_ids]
+    if keys and settings.CACHE_IS_SHARED:
+        transaction.on_commit(lambda: cache.delete_many(keys))
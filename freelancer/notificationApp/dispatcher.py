@@ -1,87 +1,132 @@
-from accounts.models import User
-from .models import NotificationTemplate, Notification
+from .models import NotificationTemplate, Notification, NotificationCampaignRun
 from django.utils import timezone
+from django.db import transaction
+from django.db.models import Q
+from datetime import timedelta
+from uuid import uuid4
 from .services import SENDER_REGISTRY
 from .scheduler import should_send_template
-
-
-
-def _resolve_recipients(recipient_list):
-    """Return queryset of users based on the recipients field."""
-
-    qs = User.objects.filter(is_active=True)
-
-    selected_roles = []
-
-    if "user" in recipient_list:
-        selected_roles.append("CUSTOMER")
-
-    if "service_provider" in recipient_list:
-        selected_roles.append("SERVICE_PROVIDER")
-
-    # If both roles were selected → return all users that match ANY of them
-    if len(selected_roles) == 2:
-        return qs.filter(user_roles__role__id__in=selected_roles).distinct()
-
-    # If only "user"
-    if selected_roles == ["CUSTOMER"]:
-        return qs.filter(
-            user_roles__role__id="CUSTOMER"
-        ).exclude(
-            user_roles__role__id="SERVICE_PROVIDER"
-        ).distinct()
-
-    # If only "service_provider"
-    if selected_roles == ["SERVICE_PROVIDER"]:
-        return qs.filter(
-            user_roles__role__id="SERVICE_PROVIDER"
-        ).distinct()
-
-    # Default fallback: no recipients
-    return User.objects.none()
-
+from .audiences import audience_ids, audience_size, template_audience
+from .counters import add_unread
+
+
+FANOUT_CHUNK_SIZE = 500
+# Longer than queueing one chunk takes; overlapping dispatcher beats (every minute) skip leased runs
+RUN_LEASE = timedelta(minutes=15)
+
+
+def _queue_chunk(run, channels, user_ids):
+    """Create the pending log rows of one chunk and queue one send subtask per channel."""
+    from .tasks import send_notification_chunk
+
+    counted = set()
+    if NotificationTemplate.Type.IN_APP in channels:
+        # In-app rows left by an interrupted attempt at this chunk are already in the unread counters
+        counted = set(
+            Notification.objects.filter(
+                run=run, channel=NotificationTemplate.Type.IN_APP, recipient_user_id__in=user_ids
+            ).values_list('recipient_user_id', flat=True)
+        )
+
+    # Rows left by an interrupted attempt at this chunk are kept as they are
+    Notification.objects.bulk_create(
+        [
+            Notification(
+                template_id=run.template_id,
+                run=run,
+                recipient_user_id=user_id,
+                channel=channel,
+                status=Notification.Status.PENDING,
+            )
+            for channel in channels
+            for user_id in user_ids
+        ],
+        batch_size=FANOUT_CHUNK_SIZE,
+        ignore_conflicts=True,
+    )
+    if NotificationTemplate.Type.IN_APP in channels:
+        add_unread([user_id for user_id in user_ids if user_id not in counted])
+
+    for channel in channels:
+        send_notification_chunk.delay(run.id, channel, user_ids)
+
+
+def _start_or_resume_run(template, audiences=None):
+    """
+    The template's unfinished run, or a new one when the template is due. The template
+    row lock keeps overlapping dispatcher runs from starting the same occurrence twice.
+    """
+    with transaction.atomic():
+        template = NotificationTemplate.objects.select_for_update().get(id=template.id)
+
+        run = template.runs.filter(status=NotificationCampaignRun.Status.RUNNING).first()
+        if run or not should_send_template(template):
+            return run
+
+        channels = [channel for channel in template.types if channel in SENDER_REGISTRY]
+        now = timezone.now()
+        # Taken now rather than when the fan-out ends: from here on the run record tracks completion
+        template.last_sent_at = now
+        template.dispatch_started_at = now
+        template.dispatch_total = audience_size(template_audience(template), audiences) * len(channels)
+        template.dispatch_sent = template.dispatch_failed = 0
+        template.save(update_fields=[
+            'last_sent_at', 'next_run_at', 'dispatch_started_at', 'dispatch_total', 'dispatch_sent', 'dispatch_failed',
+        ])
+        return NotificationCampaignRun.objects.create(template=template)
+
+
+def _take_lease(run, owner):
+    """Claim (or extend) the run's lease; False when another worker holds a live one."""
+    now = timezone.now()
+    return NotificationCampaignRun.objects.filter(
+        Q(lease_owner=owner) | Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now),
+        id=run.id,
+        status=NotificationCampaignRun.Status.RUNNING,
+    ).update(lease_owner=owner, lease_expires_at=now + RUN_LEASE) == 1
+
+
+def fan_out_template(template, audiences=None):
+    """
+    Queue the template's recipients in id order, in chunks, from the run's checkpoint on.
+    The checkpoint and the lease advance after every queued chunk; the subtasks record
+    their progress on the template. `audiences` memoizes audience sizes across templates.
+    """
+    run = _start_or_resume_run(template, audiences)
+    owner = uuid4().hex
+    if not run or not _take_lease(run, owner):
+        return
+
+    channels = [channel for channel in run.template.types if channel in SENDER_REGISTRY]
+
+    def checkpoint(chunk):
+        _queue_chunk(run, channels, chunk)
+        run.last_user_id = chunk[-1]
+        NotificationCampaignRun.objects.filter(id=run.id).update(last_user_id=run.last_user_id)
+        return _take_lease(run, owner)
+
+    if channels:
+        for chunk in audience_ids(template_audience(run.template), run.last_user_id, FANOUT_CHUNK_SIZE):
+            if not checkpoint(chunk):
+                # Lease lost (we stalled past it): the new holder carries on from the checkpoint
+                return
+
+    NotificationCampaignRun.objects.filter(id=run.id, lease_owner=owner).update(
+        status=NotificationCampaignRun.Status.COMPLETED,
+        finished_at=timezone.now(),
+        lease_owner=None,
+        lease_expires_at=None,
+    )
 
 
 def dispatch_notifications():
-    """Loops through all notification templates and sends notifications."""
+    """Loops through all notification templates and fans out the due ones, resuming unfinished runs."""
 
-    templates = NotificationTemplate.objects.all()
+    # Only due templates (through the next_run_at index) and those with an unfinished run
+    running = NotificationCampaignRun.objects.filter(status=NotificationCampaignRun.Status.RUNNING).values('template_id')
+    templates = NotificationTemplate.objects.filter(Q(next_run_at__lte=timezone.now()) | Q(id__in=running))
 
+    # Templates targeting the same audience in this pass count it once
+    audiences = {}
     for template in templates:
-        
-        if not should_send_template(template):
-            continue
-        
-        recipients = _resolve_recipients(template.recipients)
-
-        for user in recipients:
-            for notif_type in template.types:
-
-                sender_class = SENDER_REGISTRY.get(notif_type)
-                if not sender_class:
-                    continue
-
-                # Create the Notification log row (pending status)
-                notification_log = Notification.objects.create(
-                    template=template,
-                    recipient_user=user,
-                    channel=notif_type,
-                    status=Notification.Status.PENDING,
-                )
-
-                try:
-                    # Initialize and send via the appropriate sender class
-                    sender = sender_class(notification_log)
-                    sender.send()
-
-                    notification_log.status = Notification.Status.SENT
-                    notification_log.sent_at = timezone.now()
-
-                except Exception as e:
-                    notification_log.status = Notification.Status.FAILED
-                    notification_log.error_message = str(e)
-
-                notification_log.save()
-                
-        template.last_sent_at = timezone.now()
-        template.save()
\ No newline at end of file
+        fan_out_template(template, audiences)
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificationApp', '0005_notification_channel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationtemplate',
+            name='dispatch_failed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='notificationtemplate',
+            name='dispatch_sent',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='notificationtemplate',
+            name='dispatch_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='notificationtemplate',
+            name='dispatch_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
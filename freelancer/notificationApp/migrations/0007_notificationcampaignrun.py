@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificationApp', '0006_notificationtemplate_dispatch_progress'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='status',
+            field=models.CharField(choices=[('sent', 'Sent'), ('failed', 'Failed'), ('pending', 'Pending'), ('processing', 'Processing')], max_length=50),
+        ),
+        migrations.CreateModel(
+            name='NotificationCampaignRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed')], default='running', max_length=20)),
+                ('last_user_id', models.PositiveBigIntegerField(default=0)),
+                ('lease_owner', models.CharField(blank=True, max_length=32, null=True)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='notificationApp.notificationtemplate')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='run',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='notificationApp.notificationcampaignrun'),
+        ),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(fields=('template', 'run', 'recipient_user', 'channel'), name='unique_campaign_notification'),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:54
+
+from datetime import datetime, timedelta
+from django.db import migrations, models
+from django.utils import timezone
+
+
+# Frozen copy of notificationApp.scheduler.compute_next_run_at as of this migration,
+# so later changes to the scheduler do not change what the backfill computes
+def _recurring_interval(template):
+    freq = template.recurring_frequency
+    if freq == 'daily':
+        return timedelta(days=1)
+    if freq == 'weekly':
+        return timedelta(weeks=1)
+    if freq == 'hourly':
+        return timedelta(hours=1)
+    if freq == 'interval_days' and template.recurring_interval:
+        return timedelta(days=template.recurring_interval)
+    if freq == 'interval_hours' and template.recurring_interval:
+        return timedelta(hours=template.recurring_interval)
+    return None
+
+
+def compute_next_run_at(template):
+    if template.trigger_type == 'immediately':
+        return None if template.last_sent_at else (template.created_at or timezone.now())
+
+    if template.trigger_type == 'custom':
+        if template.last_sent_at or not (template.date and template.time):
+            return None
+        return timezone.make_aware(datetime.combine(template.date, template.time))
+
+    if template.trigger_type == 'recurring':
+        last = template.last_sent_at or template.recurring_start or template.created_at or timezone.now()
+
+        if template.recurring_frequency == 'monthly':
+            local = timezone.localtime(last)
+            year, month = (local.year + 1, 1) if local.month == 12 else (local.year, local.month + 1)
+            next_run = timezone.make_aware(datetime(year, month, 1))
+        else:
+            interval = _recurring_interval(template)
+            if interval is None:
+                return None
+            next_run = last + interval
+
+        if template.recurring_start and next_run < template.recurring_start:
+            next_run = template.recurring_start
+        if template.recurring_end and next_run > template.recurring_end:
+            return None
+        return next_run
+
+    return None
+
+
+def backfill_next_run_at(apps, schema_editor):
+    NotificationTemplate = apps.get_model('notificationApp', 'NotificationTemplate')
+    for template in NotificationTemplate.objects.all():
+        template.next_run_at = compute_next_run_at(template)
+        template.save(update_fields=['next_run_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificationApp', '0007_notificationcampaignrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationtemplate',
+            name='next_run_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='notificationtemplate',
+            index=models.Index(fields=['next_run_at'], name='notification_next_run_idx'),
+        ),
+        migrations.RunPython(backfill_next_run_at, migrations.RunPython.noop),
+    ]
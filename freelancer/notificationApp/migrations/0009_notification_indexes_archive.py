@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-18 13:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificationApp', '0008_notificationtemplate_next_run_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('template_id', models.BigIntegerField(blank=True, null=True)),
+                ('recipient_user_id', models.BigIntegerField(db_index=True)),
+                ('channel', models.CharField(max_length=20)),
+                ('status', models.CharField(choices=[('sent', 'Sent'), ('failed', 'Failed'), ('pending', 'Pending'), ('processing', 'Processing')], max_length=50)),
+                ('read', models.BooleanField(default=False)),
+                ('title', models.CharField(blank=True, max_length=255, null=True)),
+                ('message', models.TextField(blank=True, null=True)),
+                ('data', models.JSONField(blank=True, null=True)),
+                ('sent_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient_user', 'channel', '-sent_at'], name='notification_user_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient_user', 'channel', 'read'], name='notification_user_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['sent_at'], name='notification_sent_at_idx'),
+        ),
+    ]
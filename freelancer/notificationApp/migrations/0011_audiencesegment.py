@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-18 13:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificationApp', '0010_devicetoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AudienceSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('roles', models.JSONField(blank=True, default=list)),
+                ('excluded_roles', models.JSONField(blank=True, default=list)),
+                ('countries', models.JSONField(blank=True, default=list)),
+                ('is_verified', models.BooleanField(blank=True, null=True)),
+                ('has_covers_all', models.BooleanField(blank=True, null=True)),
+                ('has_active_listing', models.BooleanField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='notificationtemplate',
+            name='segment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='templates', to='notificationApp.audiencesegment'),
+        ),
+    ]
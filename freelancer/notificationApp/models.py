@@ -1,7 +1,33 @@
 from django.db import models
+from django.db.models.signals import pre_save, post_save
+from django.dispatch import receiver
 
 # Create your models here.
 
+class AudienceSegment(models.Model):
+    """
+    A saved recipient audience (see notificationApp.audiences). Empty lists and null
+    flags do not filter; users must match every criterion that is set.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    roles = models.JSONField(default=list, blank=True)  # any of these role ids
+    excluded_roles = models.JSONField(default=list, blank=True)  # none of these role ids
+    countries = models.JSONField(default=list, blank=True)  # address country codes
+    is_verified = models.BooleanField(null=True, blank=True)
+    has_covers_all = models.BooleanField(null=True, blank=True)
+    has_active_listing = models.BooleanField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def spec(self):
+        from .audiences import SPEC_FIELDS
+        return {field: getattr(self, field) for field in SPEC_FIELDS}
+
+
 class NotificationTemplate(models.Model):
     class TriggerType(models.TextChoices):
         IMMEDIATELY = "immediately", "Immediately"
@@ -28,6 +54,8 @@ class NotificationTemplate(models.Model):
 
     types = models.JSONField()  # list: ["email", "push"]
     recipients = models.JSONField()  # list: ["user", "service_provider"]
+    # Overrides `recipients` when set
+    segment = models.ForeignKey(AudienceSegment, on_delete=models.PROTECT, null=True, blank=True, related_name="templates")
 
     category = models.CharField(max_length=100)
     header = models.CharField(max_length=255)
@@ -43,18 +71,68 @@ class NotificationTemplate(models.Model):
     recurring_end = models.DateTimeField(null=True, blank=True)
 
     last_sent_at = models.DateTimeField(null=True, blank=True)
+    # When the template is next due (notificationApp.scheduler); null once it is exhausted
+    next_run_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # Progress of the latest fan-out (notificationApp.dispatcher), one unit per recipient per channel
+    dispatch_started_at = models.DateTimeField(null=True, blank=True)
+    dispatch_total = models.PositiveIntegerField(default=0)
+    dispatch_sent = models.PositiveIntegerField(default=0)
+    dispatch_failed = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_run_at'], name='notification_next_run_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.category} - {self.header}"
     
+    @property
+    def dispatch_progress(self):
+        if not self.dispatch_total:
+            return None
+        return round((self.dispatch_sent + self.dispatch_failed) * 100 / self.dispatch_total, 1)
+
+
+@receiver(pre_save, sender=NotificationTemplate)
+def schedule_notification_template(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Recomputed on every edit and after every send (which saves last_sent_at)
+    if raw or (update_fields is not None and 'next_run_at' not in update_fields):
+        return
+    from .scheduler import compute_next_run_at
+    instance.next_run_at = compute_next_run_at(instance)
     
+    
+
+class NotificationCampaignRun(models.Model):
+    """
+    One fan-out of a template. The worker holding the lease queues the recipients in id
+    order and checkpoints the last queued id, so a run cut short resumes where it stopped.
+    """
+    class Status(models.TextChoices):
+        RUNNING = "running", "Running"
+        COMPLETED = "completed", "Completed"
+
+    template = models.ForeignKey(NotificationTemplate, on_delete=models.CASCADE, related_name="runs")
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.RUNNING)
+    last_user_id = models.PositiveBigIntegerField(default=0)
+    lease_owner = models.CharField(max_length=32, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Run {self.id} of {self.template} - {self.status}"
+
 
 class Notification(models.Model):
     class Status(models.TextChoices):
         SENT = "sent", "Sent"
         FAILED = "failed", "Failed"
         PENDING = "pending", "Pending"  
+        PROCESSING = "processing", "Processing"
     
     
     # TEMPLATE NOTIFICATION (optional)
@@ -65,6 +143,7 @@ class Notification(models.Model):
         null=True, 
         blank=True
     )
+    run = models.ForeignKey(NotificationCampaignRun, on_delete=models.CASCADE, related_name="notifications", null=True, blank=True)
 
     # EVENT-BASED NOTIFICATION (optional)
     title = models.CharField(max_length=255, null=True, blank=True)
@@ -77,7 +156,87 @@ class Notification(models.Model):
     read = models.BooleanField(default=False)
     error_message = models.TextField(null=True, blank=True)
     channel = models.CharField(max_length=20, default="in_app")  # e.g., "email", "push", "in_app"
+    # When a chunk subtask moved the row to processing (see notificationApp.tasks)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # A campaign run notifies each user once per channel, however often its chunks are retried
+            models.UniqueConstraint(fields=['template', 'run', 'recipient_user', 'channel'], name='unique_campaign_notification'),
+        ]
+        indexes = [
+            # NotificationViewSet: a user's notifications on one channel, newest first
+            models.Index(fields=['recipient_user', 'channel', '-sent_at'], name='notification_user_feed_idx'),
+            # Rebuilding the unread counters (notificationApp.counters)
+            models.Index(fields=['recipient_user', 'channel', 'read'], name='notification_user_unread_idx'),
+            # The archival task's age cutoff
+            models.Index(fields=['sent_at'], name='notification_sent_at_idx'),
+            # The sweep for rows whose chunk subtask died mid-send
+            models.Index(fields=['status', 'claimed_at'], name='notification_claimed_idx'),
+        ]
 
     def __str__(self):
         return f"Notification to {self.recipient_user.email} at {self.sent_at} - {self.status}"
-    
+
+
+class NotificationArchive(models.Model):
+    """
+    Finished notifications moved out of Notification by the retention task
+    (notificationApp.tasks.archive_old_notifications). Keeps the original id and
+    what a notification said, without foreign keys, so deleting a user or a
+    template leaves the archive alone.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    template_id = models.BigIntegerField(null=True, blank=True)
+    recipient_user_id = models.BigIntegerField(db_index=True)
+    channel = models.CharField(max_length=20)
+    status = models.CharField(max_length=50, choices=Notification.Status.choices)
+    read = models.BooleanField(default=False)
+    title = models.CharField(max_length=255, null=True, blank=True)
+    message = models.TextField(null=True, blank=True)
+    data = models.JSONField(null=True, blank=True)
+    sent_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived notification {self.id} to user {self.recipient_user_id} at {self.sent_at}"
+
+
+class DeviceToken(models.Model):
+    """
+    A push token registered by one of the user's app installs. A token belongs to one
+    install, so registering it again (e.g. after a re-login) moves it to the new user.
+    Tokens the provider reports as no longer registered are deleted by PushNotificationSender.
+    """
+    class Platform(models.TextChoices):
+        ANDROID = "android", "Android"
+        IOS = "ios", "iOS"
+        WEB = "web", "Web"
+
+    user = models.ForeignKey('accounts.User', on_delete=models.CASCADE, related_name="device_tokens")
+    token = models.CharField(max_length=255, unique=True)
+    platform = models.CharField(max_length=20, choices=Platform.choices)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_seen_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.platform} device of {self.user_id}"
+
+
+@receiver(post_save, sender=Notification)
+def push_event_notification(sender, instance, created, raw=False, **kwargs):
+    # Event notifications (bookings, OTP, document reviews) are created already sent.
+    # Campaign rows are bulk-created and pushed by their channel's sender instead.
+    if raw or not created or instance.status != Notification.Status.SENT:
+        return
+    if instance.channel in (NotificationTemplate.Type.IN_APP, NotificationTemplate.Type.IN_APP_BANNER):
+        from .realtime import publish_notification
+        publish_notification(instance)
+
+
+@receiver(post_save, sender=Notification)
+def count_unread_notification(sender, instance, created, raw=False, **kwargs):
+    # Bulk-created campaign rows are counted by the dispatcher
+    if not raw and created and instance.channel == NotificationTemplate.Type.IN_APP and not instance.read:
+        from .counters import add_unread
+        add_unread([instance.recipient_user_id])
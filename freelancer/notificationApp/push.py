@@ -0,0 +1,81 @@
+"""
+Push notification providers.
+
+A provider delivers one message to many device tokens per call (`send_multicast`)
+and reports, per token, what failed. PushNotificationSender groups a chunk of
+notifications by message, splits each group's tokens into batches of
+`max_tokens` and prunes the tokens reported as INVALID_TOKEN.
+
+ExpoPushProvider speaks the Expo push API over HTTP. LocalPushProvider speaks the
+same protocol to notificationApp.views.LocalPushView, an in-process stand-in
+that records what it receives in `outbox` (tests, local development).
+"""
+import requests
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Error reported for tokens the provider no longer accepts: uninstalled apps, revoked permissions
+INVALID_TOKEN = 'invalid_token'
+
+
+class PushError(Exception):
+    pass
+
+
+# Messages received by LocalPushView, like django.core.mail.outbox
+outbox = []
+
+
+class BasePushProvider:
+    # Most tokens one call may address
+    max_tokens = 100
+
+    def send_multicast(self, tokens, title, body, data=None):
+        """
+        Send one message to every token in `tokens` (at most `max_tokens`).
+        Returns {token: error} for the tokens it could not be delivered to.
+        """
+        raise NotImplementedError("Subclasses must implement send_multicast()")
+
+
+class ExpoPushProvider(BasePushProvider):
+    # Expo ignores unknown error codes; these are the ones that mean the token is gone for good
+    invalid_token_errors = {'DeviceNotRegistered'}
+
+    def __init__(self):
+        self.url = settings.PUSH_PROVIDER_URL
+        self.access_token = settings.PUSH_PROVIDER_ACCESS_TOKEN
+        self.session = requests.Session()
+
+    def send_multicast(self, tokens, title, body, data=None):
+        headers = {'Accept': 'application/json'}
+        if self.access_token:
+            headers['Authorization'] = f"Bearer {self.access_token}"
+
+        response = self.session.post(
+            self.url,
+            json={'to': list(tokens), 'title': title, 'body': body, 'data': data or {}},
+            headers=headers,
+            timeout=10,
+        )
+        response.raise_for_status()
+
+        # One ticket per token, in order
+        failures = {}
+        for token, ticket in zip(tokens, response.json()['data']):
+            if ticket.get('status') == 'ok':
+                continue
+            error = ticket.get('details', {}).get('error')
+            failures[token] = INVALID_TOKEN if error in self.invalid_token_errors else (ticket.get('message') or error or 'unknown error')
+        return failures
+
+
+class LocalPushProvider(ExpoPushProvider):
+    """
+    Posts to LocalPushView (set PUSH_PROVIDER_URL to its address), which accepts every
+    token except those starting with "invalid".
+    """
+
+
+def get_push_provider():
+    return import_string(settings.PUSH_PROVIDER)()
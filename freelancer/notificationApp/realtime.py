@@ -0,0 +1,158 @@
+"""
+Real-time delivery of in-app notifications.
+
+Every in-app notification is published, once its transaction commits, on its
+recipient's channel of the configured NOTIFICATION_BROKER. The stream view
+(notificationApp.views.notification_stream) subscribes a connected client to its
+own channel and forwards each message as a server-sent event.
+
+RedisBroker fans messages out through Redis pub/sub, so a notification created by
+any web or Celery process reaches the ASGI worker holding the client's
+connection. LocalBroker only reaches subscribers in the same process; it is the
+stand-in for tests and single-process development.
+
+EventSource cannot send headers, so browsers open the stream with a
+StreamToken in the query string: it only authenticates the stream and expires
+within a minute, so the copies that end up in access logs are worthless.
+"""
+import asyncio
+import json
+import logging
+import threading
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+from rest_framework_simplejwt.tokens import Token
+
+logger = logging.getLogger(__name__)
+
+# Seconds between keep-alive messages, below the usual 60s proxy read timeout
+HEARTBEAT_INTERVAL = 25
+
+
+class StreamToken(Token):
+    """
+    Opens one notification stream; it is not accepted anywhere else. Clients fetch a
+    new one before each (re)connect.
+    """
+    token_type = 'notification_stream'
+    lifetime = timedelta(minutes=1)
+
+
+def user_channel(user_id):
+    return f"notifications:user:{user_id}"
+
+
+class BaseBroker:
+    def publish(self, user_id, message):
+        raise NotImplementedError("Subclasses must implement publish()")
+
+    def subscribe(self, user_id, timeout=HEARTBEAT_INTERVAL):
+        """
+        Async context manager subscribed to `user_id` on entry. It gives an async iterator
+        over the published messages that yields None when nothing arrived within
+        `timeout` seconds, so the caller can send a keep-alive.
+        """
+        raise NotImplementedError("Subclasses must implement subscribe()")
+
+
+class RedisBroker(BaseBroker):
+    def __init__(self):
+        self.url = settings.NOTIFICATION_PUBSUB_URL
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def publish(self, user_id, message):
+        self.client.publish(user_channel(user_id), json.dumps(message, cls=DjangoJSONEncoder))
+
+    @asynccontextmanager
+    async def subscribe(self, user_id, timeout=HEARTBEAT_INTERVAL):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        try:
+            await pubsub.subscribe(user_channel(user_id))
+            yield self._messages(pubsub, timeout)
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+    async def _messages(self, pubsub, timeout):
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+            yield json.loads(message['data']) if message else None
+
+
+class LocalBroker(BaseBroker):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # user_id -> {(event loop, queue)}
+
+    def publish(self, user_id, message):
+        # Publishers run in other threads (sync views, workers) than the subscribers' event loops
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+
+    @asynccontextmanager
+    async def subscribe(self, user_id, timeout=HEARTBEAT_INTERVAL):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+        try:
+            yield self._messages(subscriber[1], timeout)
+        finally:
+            with self._lock:
+                self._subscribers[user_id].discard(subscriber)
+                if not self._subscribers[user_id]:
+                    del self._subscribers[user_id]
+
+    async def _messages(self, queue, timeout):
+        while True:
+            try:
+                yield await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield None
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(settings.NOTIFICATION_BROKER)()
+    return _broker
+
+
+def notification_message(notification):
+    from .serializers import NotificationSerializer
+    return {'channel': notification.channel, 'notification': NotificationSerializer(notification).data}
+
+
+def publish_notification(notification):
+    """
+    Push `notification` to its recipient's open streams once the current transaction commits.
+    """
+    message = notification_message(notification)
+    user_id = notification.recipient_user_id
+
+    def publish():
+        try:
+            get_broker().publish(user_id, message)
+        except Exception as e:
+            # Clients still see it in the list endpoint; a failed push must not fail the request
+            logger.exception(f"Could not publish notification {message['notification']['id']}: {e}")
+
+    transaction.on_commit(publish)
@@ -3,63 +3,74 @@ from datetime import timedelta
 from .models import NotificationTemplate
 import datetime
 
-def should_send_template(template: NotificationTemplate) -> bool:
-    now = timezone.now()
 
+def _recurring_interval(template):
+    freq = template.recurring_frequency
+
+    if freq == NotificationTemplate.RecurringFrequency.DAILY:
+        return timedelta(days=1)
+
+    if freq == NotificationTemplate.RecurringFrequency.WEEKLY:
+        return timedelta(weeks=1)
+
+    if freq == NotificationTemplate.RecurringFrequency.HOURLY:
+        return timedelta(hours=1)
+
+    if freq == NotificationTemplate.RecurringFrequency.INTERVAL_DAYS and template.recurring_interval:
+        return timedelta(days=template.recurring_interval)
+
+    if freq == NotificationTemplate.RecurringFrequency.INTERVAL_HOURS and template.recurring_interval:
+        return timedelta(hours=template.recurring_interval)
+
+    return None
+
+
+def compute_next_run_at(template: NotificationTemplate):
+    """
+    When the template is next due, or None once it will never be sent again.
+    Stored as `next_run_at` so the dispatcher only has to query due templates.
+    """
     # -------------------------
     # 1. IMMEDIATELY (send once)
     # -------------------------
     if template.trigger_type == NotificationTemplate.TriggerType.IMMEDIATELY:
-        return template.last_sent_at is None
+        return None if template.last_sent_at else (template.created_at or timezone.now())
 
     # -------------------------
     # 2. CUSTOM (send once on date + time)
     # -------------------------
     if template.trigger_type == NotificationTemplate.TriggerType.CUSTOM:
-        if template.last_sent_at:
-            return False
-
-        if template.date and template.time:
-            scheduled_dt = timezone.make_aware(
-                datetime.datetime.combine(template.date, template.time)
-            )
-            return now >= scheduled_dt
-
-        return False
+        if template.last_sent_at or not (template.date and template.time):
+            return None
+        return timezone.make_aware(datetime.datetime.combine(template.date, template.time))
 
     # -------------------------
     # 3. RECURRING (send based on frequency)
     # -------------------------
     if template.trigger_type == NotificationTemplate.TriggerType.RECURRING:
+        last = template.last_sent_at or template.recurring_start or template.created_at or timezone.now()
 
-        # If not started yet
-        if template.recurring_start and now < template.recurring_start:
-            return False
-
-        # If ended
-        if template.recurring_end and now > template.recurring_end:
-            return False
-        
-        last = template.last_sent_at or template.recurring_start or now
+        if template.recurring_frequency == NotificationTemplate.RecurringFrequency.MONTHLY:
+            # First moment of the month after the last send
+            local = timezone.localtime(last)
+            year, month = (local.year + 1, 1) if local.month == 12 else (local.year, local.month + 1)
+            next_run = timezone.make_aware(datetime.datetime(year, month, 1))
+        else:
+            interval = _recurring_interval(template)
+            if interval is None:
+                return None
+            next_run = last + interval
 
-        freq = template.recurring_frequency
+        if template.recurring_start and next_run < template.recurring_start:
+            next_run = template.recurring_start
 
-        if freq == NotificationTemplate.RecurringFrequency.DAILY:
-            return now - last >= timedelta(days=1)
+        # Ended
+        if template.recurring_end and next_run > template.recurring_end:
+            return None
+        return next_run
 
-        if freq == NotificationTemplate.RecurringFrequency.WEEKLY:
-            return now - last >= timedelta(weeks=1)
+    return None
 
-        if freq == NotificationTemplate.RecurringFrequency.MONTHLY:
-            return now.month != last.month or now.year != last.year
-        
-        if freq == NotificationTemplate.RecurringFrequency.HOURLY:
-            return now - last >= timedelta(hours=1)
 
-        if freq == NotificationTemplate.RecurringFrequency.INTERVAL_DAYS:
-            return now - last >= timedelta(days=template.recurring_interval)
-
-        if freq == NotificationTemplate.RecurringFrequency.INTERVAL_HOURS:
-            return now - last >= timedelta(hours=template.recurring_interval)
-
-    return False
+def should_send_template(template: NotificationTemplate) -> bool:
+    return template.next_run_at is not None and template.next_run_at <= timezone.now()
@@ -1,11 +1,16 @@
 from rest_framework import serializers
-from .models import NotificationTemplate, Notification
+from django_countries import countries
+from accounts.models import Role
+from .models import NotificationTemplate, Notification, DeviceToken, AudienceSegment
 
 
 class NotificationTemplateSerializer(serializers.ModelSerializer):
+    dispatch_progress = serializers.FloatField(read_only=True)
+    
     class Meta:
         model = NotificationTemplate
         fields = "__all__"
+        read_only_fields = ['next_run_at', 'dispatch_started_at', 'dispatch_total', 'dispatch_sent', 'dispatch_failed']
         
     def validate_types(self, value):
         valid_types = {choice[0] for choice in NotificationTemplate.Type.choices}
@@ -70,4 +75,46 @@ class NotificationSerializer(serializers.ModelSerializer):
     def get_message(self, obj):
         if obj.template:
             return obj.template.body
-        return obj.message
\ No newline at end of file
+        return obj.message
+
+
+class DeviceTokenSerializer(serializers.ModelSerializer):
+    # Registering a token again is an update, so skip the model's unique check
+    token = serializers.CharField(max_length=255)
+
+    class Meta:
+        model = DeviceToken
+        fields = ["token", "platform", "created_at", "last_seen_at"]
+        read_only_fields = ["created_at", "last_seen_at"]
+
+    def create(self, validated_data):
+        device, _ = DeviceToken.objects.update_or_create(
+            token=validated_data["token"],
+            defaults={"user": self.context["request"].user, "platform": validated_data["platform"]},
+        )
+        return device
+
+
+class AudienceSegmentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AudienceSegment
+        fields = "__all__"
+
+    def _validate_role_list(self, value):
+        if not isinstance(value, list):
+            raise serializers.ValidationError("Expected a list of role ids.")
+        unknown = set(value) - set(Role.objects.filter(id__in=value).values_list('id', flat=True))
+        if unknown:
+            raise serializers.ValidationError(f"Unknown roles: {', '.join(sorted(map(str, unknown)))}.")
+        return value
+
+    def validate_roles(self, value):
+        return self._validate_role_list(value)
+
+    def validate_excluded_roles(self, value):
+        return self._validate_role_list(value)
+
+    def validate_countries(self, value):
+        if not isinstance(value, list) or not all(code in countries for code in value):
+            raise serializers.ValidationError("Expected a list of ISO country codes.")
+        return value
@@ -1,4 +1,8 @@
-from accounts.tasks import send_email
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from accounts.tasks import send_email, deliver_campaign_emails
+from .push import INVALID_TOKEN, PushError, get_push_provider
+from .realtime import publish_notification
 
 class BaseNotificationSender:
     def __init__(self, notification_obj):
@@ -7,7 +11,24 @@ class BaseNotificationSender:
     def send(self):
         raise NotImplementedError("Subclasses must implement send()")
 
+    @classmethod
+    def send_batch(cls, notifications):
+        """
+        Send a chunk of notifications of one template and channel.
+        Returns {notification_id: error message} for the ones that failed.
+        """
+        failures = {}
+        for notification in notifications:
+            try:
+                cls(notification).send()
+            except Exception as e:
+                failures[notification.id] = str(e)
+        return failures
+
 class EmailNotificationSender(BaseNotificationSender):
+    # Per-recipient fields of notification.html, with the template's fallback
+    recipient_fields = {'first_name': 'tamo'}
+
     def send(self):
         # TODO: Implement actual email sending logic
         context = {
@@ -17,17 +38,89 @@ class EmailNotificationSender(BaseNotificationSender):
         }
         send_email.delay(context, file='notification.html')
 
+    @classmethod
+    def send_batch(cls, notifications):
+        if not notifications:
+            return {}
+        # One rendered body and one SMTP session for the whole chunk
+        template = notifications[0].template
+        context = {'subject': template.header, 'body': template.body}
+        by_user = {notification.recipient_user_id: notification.id for notification in notifications}
+        report = deliver_campaign_emails(context, 'notification.html', list(by_user), cls.recipient_fields)
+        return {by_user[failure['user']]: failure['error'] for failure in report['failed']}
+
 class PushNotificationSender(BaseNotificationSender):
     def send(self):
-        pass
+        error = self.send_batch([self.notification]).get(self.notification.id)
+        if error:
+            raise PushError(error)
+
+    @staticmethod
+    def message(notification):
+        if notification.template:
+            return notification.template.header, notification.template.body, {}
+        return notification.title, notification.message, notification.data or {}
+
+    @classmethod
+    def send_batch(cls, notifications):
+        """
+        One multicast call per message and batch of device tokens. A notification counts as
+        sent when it reached at least one of the user's devices.
+        """
+        from .models import DeviceToken
+
+        tokens_by_user = {}
+        for user_id, token in DeviceToken.objects.filter(
+            user_id__in={notification.recipient_user_id for notification in notifications}
+        ).values_list('user_id', 'token'):
+            tokens_by_user.setdefault(user_id, []).append(token)
+
+        failures = {}
+        groups = {}
+        for notification in notifications:
+            if notification.recipient_user_id not in tokens_by_user:
+                failures[notification.id] = "No registered devices."
+                continue
+            title, body, data = cls.message(notification)
+            key = (title, body, json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder))
+            groups.setdefault(key, (data, []))[1].append(notification)
+
+        provider = get_push_provider()
+        token_errors = {}
+        sent_any = False
+        for (title, body, _), (data, group) in groups.items():
+            tokens = [token for notification in group for token in tokens_by_user[notification.recipient_user_id]]
+            for start in range(0, len(tokens), provider.max_tokens):
+                batch = tokens[start:start + provider.max_tokens]
+                try:
+                    token_errors.update(provider.send_multicast(batch, title, body, data))
+                except OSError as e:
+                    # Nothing delivered yet: let the chunk task retry the whole chunk
+                    if not sent_any:
+                        raise
+                    token_errors.update(dict.fromkeys(batch, str(e)))
+                else:
+                    sent_any = True
+
+        invalid = [token for token, error in token_errors.items() if error == INVALID_TOKEN]
+        if invalid:
+            DeviceToken.objects.filter(token__in=invalid).delete()
+
+        for _, group in groups.values():
+            for notification in group:
+                errors = [token_errors.get(token) for token in tokens_by_user[notification.recipient_user_id]]
+                if all(errors):
+                    failures[notification.id] = errors[0]
+        return failures
 
 class InAppNotificationSender(BaseNotificationSender):
     def send(self):
-        pass
+        # The row itself is the in-app notification; this pushes it to the user's open streams
+        publish_notification(self.notification)
 
 class InAppBannerSender(BaseNotificationSender):
     def send(self):
-        pass
+        publish_notification(self.notification)
 
 
 
@@ -37,4 +130,3 @@ SENDER_REGISTRY = {
     "in_app": InAppNotificationSender,
     "in_app_banner": InAppBannerSender,
 }
-
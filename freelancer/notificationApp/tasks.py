@@ -1,5 +1,17 @@
 from celery import shared_task
-from .dispatcher import dispatch_notifications  
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from smtplib import SMTPException
+import logging
+from .dispatcher import dispatch_notifications, FANOUT_CHUNK_SIZE
+from django.conf import settings
+from datetime import timedelta
+from .counters import invalidate_unread
+from .models import Notification, NotificationTemplate, NotificationArchive
+from .services import SENDER_REGISTRY
+
+logger = logging.getLogger(__name__)
 
 
 @shared_task
@@ -9,3 +21,124 @@ def run_notification_dispatcher():
     This is what Celery Beat will schedule.
     """
     dispatch_notifications()
+
+
+def _claim_pending(run_id, channel, user_ids):
+    """
+    Move the chunk's pending rows to processing and return them. Rows are locked while
+    claimed, so a duplicate or retried subtask for the same chunk finds nothing left to send.
+    """
+    with transaction.atomic():
+        notifications = list(
+            Notification.objects.select_for_update(skip_locked=True).filter(
+                run_id=run_id,
+                channel=channel,
+                recipient_user_id__in=user_ids,
+                status=Notification.Status.PENDING,
+            ).select_related('template')
+        )
+        Notification.objects.filter(id__in=[notification.id for notification in notifications]).update(
+            status=Notification.Status.PROCESSING, claimed_at=timezone.now()
+        )
+    return notifications
+
+
+@shared_task(bind=True, max_retries=3)
+def send_notification_chunk(self, run_id, channel, user_ids):
+    """
+    Send the pending notifications of one fan-out chunk on one channel, then record
+    the outcome on the log rows and the template's progress counters.
+    """
+    notifications = _claim_pending(run_id, channel, user_ids)
+    if not notifications:
+        return
+
+    try:
+        failures = SENDER_REGISTRY[channel].send_batch(notifications)
+    except (SMTPException, OSError) as e:
+        # Raised before anything was sent (e.g. the mail server is unreachable): hand the rows back
+        if self.request.retries < self.max_retries:
+            Notification.objects.filter(id__in=[notification.id for notification in notifications]).update(
+                status=Notification.Status.PENDING
+            )
+            raise self.retry(exc=e, countdown=60 * 2 ** self.request.retries)
+        logger.error(f"Notification chunk of run {run_id} on {channel} failed: {e}")
+        failures = {notification.id: str(e) for notification in notifications}
+
+    sent_ids = [notification.id for notification in notifications if notification.id not in failures]
+    Notification.objects.filter(id__in=sent_ids).update(status=Notification.Status.SENT, sent_at=timezone.now())
+
+    by_error = {}
+    for notification_id, error in failures.items():
+        by_error.setdefault(error, []).append(notification_id)
+    for error, notification_ids in by_error.items():
+        Notification.objects.filter(id__in=notification_ids).update(status=Notification.Status.FAILED, error_message=error)
+
+    NotificationTemplate.objects.filter(id=notifications[0].template_id).update(
+        dispatch_sent=F('dispatch_sent') + len(sent_ids),
+        dispatch_failed=F('dispatch_failed') + len(failures),
+    )
+
+
+# Far longer than sending one chunk takes: rows still processing after this lost their worker
+PROCESSING_TIMEOUT = timedelta(minutes=30)
+
+
+@shared_task
+def requeue_stuck_notifications():
+    """
+    Hand rows left in processing by a chunk subtask that died mid-send (worker killed,
+    deploy) back to pending and queue their chunks again. Their recipients may get a
+    duplicate of what was sent before the crash; without this they would get nothing.
+    """
+    stuck = Notification.objects.filter(
+        status=Notification.Status.PROCESSING,
+        claimed_at__lt=timezone.now() - PROCESSING_TIMEOUT,
+    )
+    with transaction.atomic():
+        rows = list(stuck.select_for_update(skip_locked=True).values_list('id', 'run_id', 'channel', 'recipient_user_id'))
+        Notification.objects.filter(id__in=[row[0] for row in rows]).update(status=Notification.Status.PENDING, claimed_at=None)
+
+    chunks = {}
+    for _, run_id, channel, user_id in rows:
+        chunks.setdefault((run_id, channel), []).append(user_id)
+
+    for (run_id, channel), user_ids in chunks.items():
+        for start in range(0, len(user_ids), FANOUT_CHUNK_SIZE):
+            send_notification_chunk.delay(run_id, channel, user_ids[start:start + FANOUT_CHUNK_SIZE])
+    return len(rows)
+
+
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVE_FIELDS = ('id', 'template_id', 'recipient_user_id', 'channel', 'status', 'read', 'title', 'message', 'data', 'sent_at')
+
+
+@shared_task
+def archive_old_notifications():
+    """
+    Move finished notifications older than NOTIFICATION_RETENTION_DAYS into NotificationArchive,
+    one batch (copy, then delete) per transaction so locks and undo logs stay small.
+    """
+    cutoff = timezone.now() - timedelta(days=settings.NOTIFICATION_RETENTION_DAYS)
+    old = Notification.objects.filter(
+        sent_at__lt=cutoff,
+        status__in=[Notification.Status.SENT, Notification.Status.FAILED],
+    )
+    archived = 0
+
+    while True:
+        with transaction.atomic():
+            batch = list(old.select_for_update(skip_locked=True).order_by('id').values(*ARCHIVE_FIELDS)[:ARCHIVE_BATCH_SIZE])
+            if not batch:
+                break
+            # ignore_conflicts: a batch archived by a run that died before deleting is copied again harmlessly
+            NotificationArchive.objects.bulk_create([NotificationArchive(**row) for row in batch], ignore_conflicts=True)
+            Notification.objects.filter(id__in=[row['id'] for row in batch]).delete()
+            invalidate_unread(*{
+                row['recipient_user_id'] for row in batch
+                if row['channel'] == NotificationTemplate.Type.IN_APP and not row['read']
+            })
+        archived += len(batch)
+
+    logger.info(f"Archived {archived} notifications sent before {cutoff:%Y-%m-%d}")
+    return archived
@@ -1,3 +1,406 @@
-from django.test import TestCase
+import asyncio
+import json
+from unittest.mock import patch
+from asgiref.sync import sync_to_async
+from django.core import mail
+from django.core.cache import cache
+from django.test import TestCase, LiveServerTestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from accounts.serializers import get_tokens_for_user
+from accounts.models import User, Role, UserRole, Address
+from adminHandlers.models import ServiceCategory
+from listing.models import Listing, Location, Contact, Service
+from paymentApp.models import Payment, CoversAllSubscription
+from datetime import timedelta
+from django.utils import timezone
+from . import audiences, dispatcher, push, tasks
+from .counters import unread_cache_key
+from .dispatcher import dispatch_notifications
+from .models import NotificationTemplate, Notification, NotificationCampaignRun, NotificationArchive, DeviceToken, AudienceSegment
+from .tasks import send_notification_chunk, archive_old_notifications, requeue_stuck_notifications
 
-# Create your tests here.
+
+# Chunk subtasks run inline, so the tests see what they sent
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class NotificationFanOutTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Role.objects.create(id='CUSTOMER', label='Customer', description='Customer')
+        Role.objects.create(id='SERVICE_PROVIDER', label='Service Provider', description='Provider')
+        for index in range(5):
+            user = User.objects.create_user(
+                email=f'user{index}@example.com', first_name=f'Name{index}', last_name='User', phone=f'091111111{index}', password='password123',
+            )
+            UserRole.objects.create(user=user, role_id='CUSTOMER')
+        provider = User.objects.create_user(
+            email='provider@example.com', first_name='Provider', last_name='User', phone='0922222222', password='password123',
+        )
+        UserRole.objects.create(user=provider, role_id='SERVICE_PROVIDER')
+
+        self.template = NotificationTemplate.objects.create(
+            types=['email', 'in_app'], recipients=['user'], category='promo', header='Nova ponuda', body='Popust',
+            trigger_type=NotificationTemplate.TriggerType.IMMEDIATELY,
+        )
+
+    @patch('notificationApp.dispatcher.FANOUT_CHUNK_SIZE', 2)
+    def test_fan_out_in_chunks_records_logs_and_progress(self):
+        with patch.object(send_notification_chunk, 'delay', wraps=send_notification_chunk.delay) as delay:
+            dispatch_notifications()
+
+        # 5 customers in chunks of 2, one subtask per chunk per channel
+        self.assertEqual(delay.call_count, 6)
+        self.assertEqual(Notification.objects.filter(template=self.template, status=Notification.Status.SENT).count(), 10)
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), [f'user{index}@example.com' for index in range(5)])
+
+        self.template.refresh_from_db()
+        self.assertEqual((self.template.dispatch_total, self.template.dispatch_sent, self.template.dispatch_failed), (10, 10, 0))
+        self.assertEqual(self.template.dispatch_progress, 100)
+        self.assertIsNotNone(self.template.last_sent_at)
+
+        # Sent once: the next dispatcher run does not fan out again
+        dispatch_notifications()
+        self.assertEqual(Notification.objects.filter(template=self.template).count(), 10)
+
+    @patch('notificationApp.dispatcher.FANOUT_CHUNK_SIZE', 2)
+    def test_interrupted_run_resumes_from_checkpoint_without_duplicates(self):
+        queue_chunk = dispatcher._queue_chunk
+        calls = []
+
+        def crash_on_second_chunk(run, channels, user_ids):
+            calls.append(user_ids)
+            queue_chunk(run, channels, user_ids)
+            if len(calls) == 2:
+                raise RuntimeError("worker died")
+
+        with patch('notificationApp.dispatcher._queue_chunk', crash_on_second_chunk):
+            with self.assertRaises(RuntimeError):
+                dispatch_notifications()
+
+        run = NotificationCampaignRun.objects.get(template=self.template)
+        self.assertEqual(run.status, NotificationCampaignRun.Status.RUNNING)
+        self.assertEqual(run.last_user_id, calls[0][-1])
+
+        # An overlapping dispatcher run leaves the leased run alone and starts no new one
+        dispatch_notifications()
+        self.assertEqual(NotificationCampaignRun.objects.count(), 1)
+        self.assertEqual(len(mail.outbox), 4)
+
+        # Once the lease expires the run resumes after the checkpoint; the second chunk is not sent again
+        NotificationCampaignRun.objects.filter(id=run.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        dispatch_notifications()
+
+        run.refresh_from_db()
+        self.assertEqual(run.status, NotificationCampaignRun.Status.COMPLETED)
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), [f'user{index}@example.com' for index in range(5)])
+        self.assertEqual(Notification.objects.filter(run=run, status=Notification.Status.SENT).count(), 10)
+
+    def test_rows_stuck_in_processing_are_sent_again(self):
+        with patch.object(send_notification_chunk, 'delay'):
+            dispatch_notifications()
+        run = NotificationCampaignRun.objects.get(template=self.template)
+        # The email subtask claimed its rows and its worker died
+        user_ids = list(Notification.objects.filter(run=run, channel='email').values_list('recipient_user_id', flat=True))
+        tasks._claim_pending(run.id, 'email', user_ids)
+
+        self.assertEqual(requeue_stuck_notifications(), 0)
+        Notification.objects.filter(status=Notification.Status.PROCESSING).update(
+            claimed_at=timezone.now() - tasks.PROCESSING_TIMEOUT - timedelta(minutes=1)
+        )
+        self.assertEqual(requeue_stuck_notifications(), 5)
+        self.assertEqual(Notification.objects.filter(run=run, channel='email', status=Notification.Status.SENT).count(), 5)
+        self.assertEqual(len(mail.outbox), 5)
+
+
+class NotificationScheduleTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def create_template(self, **fields):
+        return NotificationTemplate.objects.create(
+            types=['in_app'], recipients=['user'], category='promo', header='Nova ponuda', body='Popust', **fields
+        )
+
+    def test_next_run_at_follows_sends_and_edits(self):
+        template = self.create_template(
+            trigger_type=NotificationTemplate.TriggerType.RECURRING,
+            recurring_frequency=NotificationTemplate.RecurringFrequency.INTERVAL_HOURS,
+            recurring_interval=2,
+            recurring_start=timezone.now() - timedelta(hours=3),
+        )
+        self.assertEqual(template.next_run_at, template.recurring_start + timedelta(hours=2))
+
+        dispatch_notifications()
+        template.refresh_from_db()
+        self.assertAlmostEqual(template.next_run_at, template.last_sent_at + timedelta(hours=2), delta=timedelta(seconds=1))
+
+        template.recurring_end = timezone.now() + timedelta(hours=1)
+        template.save()
+        self.assertIsNone(template.next_run_at)
+
+    def test_only_due_templates_are_read(self):
+        self.create_template(trigger_type=NotificationTemplate.TriggerType.IMMEDIATELY, last_sent_at=timezone.now())
+        self.create_template(
+            trigger_type=NotificationTemplate.TriggerType.CUSTOM,
+            date=(timezone.now() + timedelta(days=1)).date(), time=timezone.now().time(),
+        )
+        self.assertFalse(NotificationTemplate.objects.filter(next_run_at__isnull=False, next_run_at__lte=timezone.now()).exists())
+
+        # One query for due templates, with the unfinished runs as a subquery
+        with self.assertNumQueries(1):
+            dispatch_notifications()
+
+
+class NotificationStreamTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='stream@example.com', first_name='Stream', last_name='User', phone='0933333333', password='password123',
+        )
+        self.token = str(AccessToken.for_user(self.user))
+
+    def create_notification(self, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notification.objects.create(recipient_user=self.user, status=Notification.Status.SENT, **fields)
+
+    async def test_new_notifications_reach_open_streams(self):
+        response = await self.async_client.get('/api/v1/notify/stream/', headers={'authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        self.assertEqual(await anext(events), b'retry: 5000\n\n')
+
+        # e.g. what VerifyOtp creates; emails are not pushed
+        await sync_to_async(self.create_notification)(channel='email', title='Email only')
+        notification = await sync_to_async(self.create_notification)(title='Welcome to Freelancer', message='Start exploring')
+
+        event = (await asyncio.wait_for(anext(events), 5)).decode()
+        self.assertTrue(event.startswith(f'id: {notification.id}\nevent: in_app\ndata: '))
+        data = json.loads(event.split('data: ', 1)[1])
+        self.assertEqual((data['id'], data['title'], data['message']), (notification.id, 'Welcome to Freelancer', 'Start exploring'))
+
+        # Nothing else was pushed; the timeout cancels the stream like a client disconnect
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(anext(events), 0.1)
+
+    async def test_stream_needs_a_valid_token(self):
+        response = await self.async_client.get('/api/v1/notify/stream/')
+        self.assertEqual(response.status_code, 401)
+
+        response = await self.async_client.get('/api/v1/notify/stream/', {'token': self.token + 'x'})
+        self.assertEqual(response.status_code, 401)
+
+        # Access tokens are never taken from the query string, where they would end up in logs
+        response = await self.async_client.get('/api/v1/notify/stream/', {'token': self.token})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_stream_token_opens_the_stream_only(self):
+        response = await self.async_client.post('/api/v1/notify/stream/token/', headers={'authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.status_code, 200)
+        stream_token = response.json()['token']
+
+        response = await self.async_client.get('/api/v1/notify/stream/', {'token': stream_token})
+        self.assertEqual(response.status_code, 200)
+        events = aiter(response.streaming_content)
+        self.assertEqual(await anext(events), b'retry: 5000\n\n')
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(anext(events), 0.1)
+
+        response = await self.async_client.get('/api/v1/notify/notifications/', headers={'authorization': f'Bearer {stream_token}'})
+        self.assertEqual(response.status_code, 401)
+
+
+# The test process is the only one using its memory cache
+@override_settings(CACHE_IS_SHARED=True)
+class UnreadCounterTest(TestCase):
+    def setUp(self):
+        Role.objects.create(id='CUSTOMER', label='Customer', description='Customer')
+        self.user = User.objects.create_user(
+            email='unread@example.com', first_name='Unread', last_name='User', phone='0944444444', password='password123',
+        )
+        UserRole.objects.create(user=self.user, role_id='CUSTOMER')
+        self.user.refresh_from_db()
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(self.user)['access']}")
+
+    def unread_count(self):
+        return self.client.get('/api/v1/notify/notifications/unread_count/').json()['unread_count']
+
+    def test_counter_follows_new_and_read_notifications(self):
+        self.assertEqual(self.unread_count(), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Notification.objects.create(recipient_user=self.user, title='Booking', status=Notification.Status.SENT)
+            Notification.objects.create(recipient_user=self.user, title='Booking', status=Notification.Status.SENT)
+            Notification.objects.create(recipient_user=self.user, channel='email', status=Notification.Status.SENT)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.unread_count(), 2)
+
+        # Bulk-created campaign rows count once, even when their chunk is queued again
+        NotificationTemplate.objects.create(
+            types=['in_app', 'email'], recipients=['user'], category='promo', header='Nova ponuda', body='Popust',
+            trigger_type=NotificationTemplate.TriggerType.IMMEDIATELY,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch_notifications()
+            dispatcher._queue_chunk(NotificationCampaignRun.objects.get(), ['in_app', 'email'], [self.user.id])
+        self.assertEqual(self.unread_count(), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/v1/notify/notifications/{first.id}/read/')
+            response = self.client.post(f'/api/v1/notify/notifications/{first.id}/read/')
+        self.assertEqual(response.json()['detail'], 'Already marked as read.')
+        self.assertEqual(self.unread_count(), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/notify/notifications/read_all/')
+        self.assertEqual(self.unread_count(), 0)
+        self.assertFalse(Notification.objects.filter(recipient_user=self.user, channel='in_app', read=False).exists())
+
+    @override_settings(CACHE_IS_SHARED=False)
+    def test_process_local_cache_is_not_used(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(recipient_user=self.user, title='Booking', status=Notification.Status.SENT)
+        self.assertEqual(self.unread_count(), 1)
+        # Counted again on every poll
+        with self.assertNumQueries(1):
+            self.assertEqual(self.unread_count(), 1)
+        self.assertIsNone(cache.get(unread_cache_key(self.user.id)))
+
+
+class NotificationArchiveTest(TestCase):
+    @patch('notificationApp.tasks.ARCHIVE_BATCH_SIZE', 2)
+    def test_old_finished_notifications_move_to_the_archive_in_batches(self):
+        user = User.objects.create_user(
+            email='archive@example.com', first_name='Archive', last_name='User', phone='0955555555', password='password123',
+        )
+        for index in range(5):
+            Notification.objects.create(recipient_user=user, title=f'Old {index}', status=Notification.Status.SENT)
+        Notification.objects.create(recipient_user=user, title='Stuck', status=Notification.Status.PENDING)
+        Notification.objects.update(sent_at=timezone.now() - timedelta(days=200))
+        recent = Notification.objects.create(recipient_user=user, title='Recent', status=Notification.Status.SENT)
+
+        with self.settings(NOTIFICATION_RETENTION_DAYS=90):
+            self.assertEqual(archive_old_notifications(), 5)
+
+        self.assertQuerySetEqual(Notification.objects.order_by('id').values_list('title', flat=True), ['Stuck', 'Recent'])
+        archived = NotificationArchive.objects.order_by('id')
+        self.assertEqual([row.title for row in archived], [f'Old {index}' for index in range(5)])
+        self.assertEqual(archived[0].recipient_user_id, user.id)
+        self.assertLess(archived.last().id, recent.id)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class PushNotificationTest(LiveServerTestCase):
+    def setUp(self):
+        cache.clear()
+        Role.objects.create(id='CUSTOMER', label='Customer', description='Customer')
+        self.users = []
+        for index in range(4):
+            user = User.objects.create_user(
+                email=f'push{index}@example.com', first_name='Push', last_name='User', phone=f'096666666{index}', password='password123',
+            )
+            UserRole.objects.create(user=user, role_id='CUSTOMER')
+            self.users.append(user)
+        push.outbox.clear()
+
+    @patch.object(push.LocalPushProvider, 'max_tokens', 2)
+    def test_campaign_push_is_multicast_and_prunes_invalid_tokens(self):
+        for user, token in [(0, 'device-a'), (0, 'invalid-a'), (1, 'device-b'), (2, 'invalid-c')]:
+            DeviceToken.objects.create(user=self.users[user], token=token, platform=DeviceToken.Platform.ANDROID)
+        NotificationTemplate.objects.create(
+            types=['push'], recipients=['user'], category='promo', header='Nova ponuda', body='Popust',
+            trigger_type=NotificationTemplate.TriggerType.IMMEDIATELY,
+        )
+
+        with self.settings(PUSH_PROVIDER='notificationApp.push.LocalPushProvider', PUSH_PROVIDER_URL=f'{self.live_server_url}/api/v1/notify/push/local/'):
+            dispatch_notifications()
+
+        # Four tokens, two per call, one message
+        self.assertEqual([message['to'] for message in push.outbox], [['device-a', 'invalid-a'], ['device-b', 'invalid-c']])
+        self.assertEqual(push.outbox[0]['title'], 'Nova ponuda')
+
+        results = {n.recipient_user_id: (n.status, n.error_message) for n in Notification.objects.filter(channel='push')}
+        self.assertEqual(results, {
+            self.users[0].id: (Notification.Status.SENT, None),
+            self.users[1].id: (Notification.Status.SENT, None),
+            self.users[2].id: (Notification.Status.FAILED, push.INVALID_TOKEN),
+            self.users[3].id: (Notification.Status.FAILED, 'No registered devices.'),
+        })
+        self.assertEqual(set(DeviceToken.objects.values_list('token', flat=True)), {'device-a', 'device-b'})
+
+    def test_registering_a_known_token_moves_it_to_the_new_user(self):
+        for user in self.users[:2]:
+            client = APIClient()
+            client.force_authenticate(user)
+            response = client.post('/api/v1/notify/devices/', {'token': 'ExponentPushToken[abc]', 'platform': 'ios'}, format='json')
+            self.assertEqual(response.status_code, 201)
+
+        self.assertEqual(DeviceToken.objects.get().user, self.users[1])
+        response = client.delete('/api/v1/notify/devices/ExponentPushToken[abc]/')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(DeviceToken.objects.exists())
+
+
+class AudienceSegmentTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Role.objects.create(id='CUSTOMER', label='Customer', description='Customer')
+        Role.objects.create(id='SERVICE_PROVIDER', label='Service Provider', description='Provider')
+        self.customer_hr = self.create_user('hr@example.com', 'HR', ['CUSTOMER'], is_verified=True)
+        self.customer_de = self.create_user('de@example.com', 'DE', ['CUSTOMER'])
+        self.provider = self.create_user('provider@example.com', 'HR', ['SERVICE_PROVIDER'], is_verified=True)
+        self.hybrid = self.create_user('hybrid@example.com', 'HR', ['CUSTOMER', 'SERVICE_PROVIDER'])
+
+        Listing.objects.create(
+            category=ServiceCategory.objects.create(name_en='Home', name_hr='Dom'),
+            location=Location.objects.create(country='HR', county='Grad Zagreb', city='Zagreb', street_name='Ilica'),
+            contact=Contact.objects.create(fullname='Test Contact'),
+            service=Service.objects.create(header='Plumbing', description_en='Fixing pipes', description_hr='Popravak cijevi'),
+            price=50, status='approved', created_by=self.provider,
+        )
+        # Makes the provider's listing visible too
+        CoversAllSubscription.objects.create(
+            user=self.provider, payment=Payment.objects.create(user=self.provider, transaction_id='pi_test', covers_all=True, covers_all_month=1),
+            start_date=timezone.now(), end_date=timezone.now() + timedelta(days=30),
+        )
+
+    def create_user(self, email, country, roles, **fields):
+        user = User.objects.create_user(
+            email=email, first_name='Segment', last_name='User', phone=email, password='password123',
+            address=Address.objects.create(country=country, city='City'), **fields,
+        )
+        for role_id in roles:
+            UserRole.objects.create(user=user, role_id=role_id)
+        return user
+
+    def test_specs_compile_to_matching_users(self):
+        cases = [
+            ({'roles': ['CUSTOMER'], 'countries': ['HR'], 'is_verified': True}, [self.customer_hr]),
+            ({'roles': ['SERVICE_PROVIDER'], 'has_active_listing': True}, [self.provider]),
+            ({'roles': ['SERVICE_PROVIDER'], 'has_covers_all': False}, [self.hybrid]),
+            (audiences.recipients_spec(['user']), [self.customer_hr, self.customer_de]),
+            (audiences.recipients_spec([]), []),
+        ]
+        for spec, users in cases:
+            with self.subTest(spec=spec):
+                self.assertEqual([user_id for page in audiences.audience_ids(spec, page_size=1) for user_id in page], [user.id for user in users])
+                self.assertEqual(audiences.audience_size(spec), len(users))
+
+    def test_templates_of_one_audience_share_its_size(self):
+        segment = AudienceSegment.objects.create(name='Croatian customers', roles=['CUSTOMER'], countries=['HR'])
+        for header in ('First', 'Second'):
+            NotificationTemplate.objects.create(
+                types=['in_app'], recipients=[], segment=segment, category='promo', header=header, body='Popust',
+                trigger_type=NotificationTemplate.TriggerType.IMMEDIATELY,
+            )
+
+        with patch('notificationApp.audiences.audience_queryset', wraps=audiences.audience_queryset) as compile_audience:
+            dispatch_notifications()
+        # One count for both templates, then each pages through the ids
+        self.assertEqual(compile_audience.call_count, 3)
+
+        expected = {self.customer_hr.id, self.hybrid.id}
+        for template in NotificationTemplate.objects.all():
+            self.assertEqual(template.dispatch_total, 2)
+            self.assertEqual(set(template.logs.values_list('recipient_user_id', flat=True)), expected)
@@ -1,11 +1,16 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import NotificationTemplateViewSet, NotificationViewSet
+from .views import NotificationTemplateViewSet, AudienceSegmentViewSet, NotificationViewSet, DeviceTokenViewSet, LocalPushView, NotificationStreamTokenView, notification_stream
 
 router = DefaultRouter()
 router.register(r'templates', NotificationTemplateViewSet, basename='templates')
+router.register(r'segments', AudienceSegmentViewSet, basename='segments')
 router.register("notifications", NotificationViewSet, basename="notifications")
+router.register("devices", DeviceTokenViewSet, basename="devices")
 
 urlpatterns = [
+    path('stream/', notification_stream, name='notification-stream'),
+    path('stream/token/', NotificationStreamTokenView.as_view(), name='notification-stream-token'),
+    path('push/local/', LocalPushView.as_view(), name='local-push'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -1,11 +1,27 @@
+import json
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.views.decorators.http import require_GET
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from accounts.roles import get_role_version
+from accounts.tokens import RoleClaimsJWTAuthentication
+from .counters import get_unread_count, remove_unread, reset_unread
+from .realtime import StreamToken, get_broker
 from .models import NotificationTemplate
-from .serializers import NotificationTemplateSerializer, NotificationSerializer
-from rest_framework import viewsets, filters
+from django.db.models import ProtectedError
+from .serializers import NotificationTemplateSerializer, NotificationSerializer, DeviceTokenSerializer, AudienceSegmentSerializer
+from rest_framework import viewsets, filters, status, mixins
+from rest_framework.views import APIView
 from accounts.permissions import IsAdminUser
 from accounts.pagination import CustomOffsetPagination
-from rest_framework.permissions import IsAuthenticated
-from .models import Notification
+from rest_framework.permissions import IsAuthenticated, AllowAny
+from .models import Notification, DeviceToken, AudienceSegment
+from .audiences import audience_size
+from . import push
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
@@ -21,6 +37,23 @@ class NotificationTemplateViewSet(viewsets.ModelViewSet):
     search_fields = ['category', 'header', 'body']
     ordering_fields = ['created_at', 'category']
     ordering = ['-created_at']
+
+
+class AudienceSegmentViewSet(viewsets.ModelViewSet):
+    queryset = AudienceSegment.objects.all().order_by('name')
+    serializer_class = AudienceSegmentSerializer
+    permission_classes = [IsAdminUser]
+    pagination_class = CustomOffsetPagination
+
+    def destroy(self, request, *args, **kwargs):
+        try:
+            return super().destroy(request, *args, **kwargs)
+        except ProtectedError:
+            return Response({"error": "The segment is used by notification templates."}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=True, methods=["GET"])
+    def size(self, request, pk=None):
+        return Response({"size": audience_size(self.get_object().spec)})
     
     
 class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
@@ -28,6 +61,7 @@ class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]  
     pagination_class = CustomOffsetPagination
+    cursor_ordering = ('-sent_at', '-id')
     filter_backends = [filters.OrderingFilter]
     ordering_fields = ['sent_at', 'status']
     ordering = ['-sent_at']
@@ -41,22 +75,117 @@ class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
     def read(self, request, pk=None):
         notification = self.get_object()
 
-        if notification.read:
+        # Conditional, so concurrent reads of one notification decrement the counter once
+        if not Notification.objects.filter(id=notification.id, read=False).update(read=True):
             return Response({"detail": "Already marked as read."})
-
-        notification.read = True
-        notification.save()
+        remove_unread(request.user.id)
 
         return Response(
             {"detail": "Notification marked as read."},
             status=status.HTTP_200_OK
         )
 
-    
-    @action(detail=False, methods=["GET"])
+    @action(detail=False, methods=["POST"])
+    def read_all(self, request):
+        updated = self.get_queryset().filter(read=False).update(read=True)
+        reset_unread(request.user.id)
+
+        return Response({"detail": f"{updated} notifications marked as read."}, status=status.HTTP_200_OK)
+
+    # Polled constantly: served from the token claims and the cached counter, without queries
+    @action(detail=False, methods=["GET"], authentication_classes=[RoleClaimsJWTAuthentication])
     def unread_count(self, request):
-        count = Notification.objects.filter(
-            recipient_user=request.user, read=False
-        ).count()
+        return Response({"unread_count": get_unread_count(request.user.id)})
+
+
+
+class DeviceTokenViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """Push tokens of the authenticated user's devices: register on login, delete on logout."""
+    serializer_class = DeviceTokenSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'token'
+    # Tokens may contain brackets and colons (e.g. "ExponentPushToken[...]")
+    lookup_value_regex = '[^/]+'
+
+    def get_queryset(self):
+        return DeviceToken.objects.filter(user=self.request.user).order_by('-last_seen_at')
+
+
+class LocalPushView(APIView):
+    """
+    Stand-in for the Expo push API when PUSH_PROVIDER is LocalPushProvider (tests, local development).
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        if not isinstance(push.get_push_provider(), push.LocalPushProvider):
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        push.outbox.append(request.data)
+        tickets = [
+            {"status": "error", "message": f"{token} is not a registered push token", "details": {"error": "DeviceNotRegistered"}}
+            if token.startswith("invalid") else {"status": "ok", "id": f"local-{token}"}
+            for token in request.data.get("to", [])
+        ]
+        return Response({"data": tickets})
+
+def _stream_user_id(request):
+    """
+    Id of the user whose access token (header) or stream token (`?token=`) came with
+    the request, else None.
+    """
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    try:
+        if header:
+            raw_token = authentication.get_raw_token(header)
+            token = authentication.get_validated_token(raw_token) if raw_token else None
+        else:
+            raw_token = request.GET.get('token')
+            token = StreamToken(raw_token) if raw_token else None
+        return int(token[api_settings.USER_ID_CLAIM]) if token else None
+    except (InvalidToken, TokenError, KeyError, ValueError):
+        return None
+
+
+async def _notification_events(user_id):
+    async with get_broker().subscribe(user_id) as messages:
+        # Sent once subscribed, so nothing published after the client sees it is missed.
+        # EventSource reconnects after 5s; clients refetch the list endpoint on reconnect.
+        yield "retry: 5000\n\n"
+        async for message in messages:
+            if message is None:
+                yield ": keep-alive\n\n"
+                continue
+            data = json.dumps(message['notification'], cls=DjangoJSONEncoder)
+            yield f"id: {message['notification']['id']}\nevent: {message['channel']}\ndata: {data}\n\n"
+
+
+class NotificationStreamTokenView(APIView):
+    """
+    Short-lived token for opening the notification stream from a browser (`?token=`).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        token = StreamToken.for_user(request.user)
+        return Response({"token": str(token), "expires_in": int(StreamToken.lifetime.total_seconds())})
+
+
+@require_GET
+async def notification_stream(request):
+    """
+    Server-sent events carrying the user's new in-app notifications (`in_app` and
+    `in_app_banner` events, serialized like the list endpoint). Needs the ASGI server.
+    """
+    user_id = _stream_user_id(request)
+    # get_role_version is None for inactive and deleted users
+    if user_id is None or await sync_to_async(get_role_version)(user_id) is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided or are invalid."}, status=401)
 
-        return Response({"unread_count": count})
\ No newline at end of file
+    response = StreamingHttpResponse(_notification_events(user_id), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stop nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminHandlers', '0006_charges_base_amount'),
+        ('adsApp', '0001_initial'),
+        ('listing', '0006_listing_listing_created_idx'),
+        ('paymentApp', '0004_coversallsubscription'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['created_at', 'id'], name='payment_created_idx'),
+        ),
+    ]
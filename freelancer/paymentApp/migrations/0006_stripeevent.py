@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paymentApp', '0005_payment_payment_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('type', models.CharField(max_length=100)),
+                ('payment_intent', models.CharField(blank=True, max_length=255, null=True)),
+                ('payload', models.JSONField()),
+                ('created', models.DateTimeField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processed', 'Processed'), ('ignored', 'Ignored')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['payment_intent', 'status', 'created'], name='stripe_event_intent_idx'), models.Index(fields=['status', 'received_at'], name='stripe_event_pending_idx')],
+            },
+        ),
+    ]
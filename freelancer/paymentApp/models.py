@@ -2,6 +2,9 @@ from django.db import models
 from listing.models import Listing
 from adminHandlers.models import CategoryPricing
 from adsApp.models import SuperAdsCategory
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from listing.visibility import refresh_listing_visibility
 
 # Create your models here.
 
@@ -32,10 +35,49 @@ class Payment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='payment_created_idx'),
+        ]
+    
     def __str__(self):
         return f"Payment {self.id} - {self.status}"
     
     
+class StripeEvent(models.Model):
+    """
+    A verified Stripe webhook event, stored as received and keyed by its event id so
+    redeliveries are recognised. paymentApp.tasks.process_stripe_events applies the
+    events of one PaymentIntent in the order Stripe created them, each exactly once.
+    """
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        PROCESSED = "processed", "Processed"
+        IGNORED = "ignored", "Ignored"
+
+    id = models.CharField(max_length=255, primary_key=True)
+    type = models.CharField(max_length=100)
+    payment_intent = models.CharField(max_length=255, null=True, blank=True)
+    payload = models.JSONField()
+    created = models.DateTimeField()  # when Stripe created the event
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # A PaymentIntent's pending events, oldest first
+            models.Index(fields=['payment_intent', 'status', 'created'], name='stripe_event_intent_idx'),
+            # The sweep for events whose consumer never ran
+            models.Index(fields=['status', 'received_at'], name='stripe_event_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"Stripe event {self.id} ({self.type}) - {self.status}"
+
+
 class CoversAllSubscription(models.Model):
     user = models.ForeignKey('accounts.User', on_delete=models.CASCADE, related_name='covers_all_subscriptions')
     payment = models.OneToOneField(Payment, on_delete=models.CASCADE, related_name='covers_all_subscription')
@@ -48,4 +90,11 @@ class CoversAllSubscription(models.Model):
     def is_active(self):
         from django.utils import timezone
         now = timezone.now()
-        return self.start_date <= now <= self.end_date
\ No newline at end of file
+        return self.start_date <= now <= self.end_date
+
+
+@receiver(post_save, sender=CoversAllSubscription)
+@receiver(post_delete, sender=CoversAllSubscription)
+def update_covers_all_listing_visibility(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_listing_visibility(user_ids=[instance.user_id])
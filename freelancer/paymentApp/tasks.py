@@ -0,0 +1,96 @@
+from celery import shared_task
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+import logging
+from .models import Payment, StripeEvent
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_INTENT_EVENTS = ('payment_intent.succeeded', 'payment_intent.payment_failed', 'payment_intent.canceled')
+
+# Pending events older than this whose consumer never ran (or gave up) are queued again by the sweep
+STALE_EVENT_AGE = timedelta(minutes=5)
+# After this many failed attempts an event waits for someone to look at its last_error
+MAX_EVENT_ATTEMPTS = 10
+
+
+def apply_stripe_event(event):
+    from .views import successful_payment
+
+    if event.type == 'payment_intent.succeeded':
+        successful_payment(event.payment_intent)
+    elif event.type == 'payment_intent.payment_failed':
+        Payment.objects.filter(transaction_id=event.payment_intent).update(status="failed")
+    elif event.type == 'payment_intent.canceled':
+        Payment.objects.filter(transaction_id=event.payment_intent).update(status="canceled")
+
+
+def process_next_stripe_event(payment_intent):
+    """
+    Apply the oldest pending event of the PaymentIntent and mark it processed in the same
+    transaction. The event row stays locked meanwhile, so a concurrent consumer for the same
+    PaymentIntent waits for it and then moves on to the next event.
+    Returns the event, or None when nothing is pending.
+    """
+    error = None
+    with transaction.atomic():
+        event = (
+            StripeEvent.objects.select_for_update()
+            .filter(payment_intent=payment_intent, status=StripeEvent.Status.PENDING)
+            .order_by('created', 'received_at', 'id')
+            .first()
+        )
+        if event is None:
+            return None
+
+        event.attempts += 1
+        try:
+            with transaction.atomic():
+                apply_stripe_event(event)
+        except Exception as e:
+            # Keep the attempt on record; the event stays pending and holds back the later ones
+            error = e
+            event.last_error = str(e)
+            event.save(update_fields=['attempts', 'last_error'])
+        else:
+            event.status = StripeEvent.Status.PROCESSED
+            event.processed_at = timezone.now()
+            event.last_error = None
+            event.save(update_fields=['attempts', 'status', 'processed_at', 'last_error'])
+
+    if error:
+        raise error
+    return event
+
+
+@shared_task(bind=True, max_retries=5)
+def process_stripe_events(self, payment_intent):
+    """
+    Apply the pending webhook events of one PaymentIntent, in the order Stripe created them.
+    """
+    try:
+        while process_next_stripe_event(payment_intent):
+            pass
+    except Exception as e:
+        logger.exception(f"Stripe events of {payment_intent} failed: {e}")
+        raise self.retry(exc=e, countdown=60 * 2 ** self.request.retries)
+
+
+@shared_task
+def requeue_stale_stripe_events():
+    """
+    Queue again the PaymentIntents whose events are still pending well after they arrived,
+    e.g. because the broker was down when the webhook tried to queue them.
+    """
+    payment_intents = (
+        StripeEvent.objects.filter(
+            status=StripeEvent.Status.PENDING,
+            received_at__lt=timezone.now() - STALE_EVENT_AGE,
+            attempts__lt=MAX_EVENT_ATTEMPTS,
+        )
+        .values_list('payment_intent', flat=True)
+        .distinct()
+    )
+    for payment_intent in payment_intents:
+        process_stripe_events.delay(payment_intent)
@@ -1,3 +1,72 @@
+import hashlib
+import hmac
+import json
+import time
+from unittest.mock import patch
+from django.conf import settings
 from django.test import TestCase
+from accounts.models import User
+from .models import Payment, CoversAllSubscription, StripeEvent
+from .tasks import process_stripe_events
 
-# Create your tests here.
+
+class StripeWebhookTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='payer@example.com', first_name='Payer', last_name='User', phone='0977777777', password='password123',
+        )
+        self.payment = Payment.objects.create(
+            user=self.user, transaction_id='pi_test', covers_all=True, covers_all_month=1, status='pending',
+        )
+
+    def deliver(self, event_id, event_type, created, secret=None):
+        payload = json.dumps({
+            'id': event_id, 'object': 'event', 'type': event_type, 'created': created,
+            'data': {'object': {'id': 'pi_test', 'object': 'payment_intent'}},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(
+            (secret or settings.STRIPE_WEBHOOK_SECRET).encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256
+        ).hexdigest()
+        return self.client.post(
+            '/api/v1/pay/webhook/stripe/', payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}',
+        )
+
+    def test_events_are_stored_then_applied_once_in_order(self):
+        # Delivered out of order: the retry succeeded after the first attempt failed
+        self.assertEqual(self.deliver('evt_succeeded', 'payment_intent.succeeded', 200).status_code, 200)
+        self.assertEqual(self.deliver('evt_failed', 'payment_intent.payment_failed', 100).status_code, 200)
+        self.assertEqual(self.deliver('evt_other', 'customer.created', 150).status_code, 200)
+
+        # Nothing is applied inside the request
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'pending')
+        self.assertEqual(StripeEvent.objects.filter(status=StripeEvent.Status.PENDING).count(), 2)
+        self.assertEqual(StripeEvent.objects.get(id='evt_other').status, StripeEvent.Status.IGNORED)
+
+        process_stripe_events('pi_test')
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+        self.assertEqual(CoversAllSubscription.objects.filter(user=self.user).count(), 1)
+
+        # A redelivery is acknowledged without being applied again
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.assertEqual(self.deliver('evt_succeeded', 'payment_intent.succeeded', 200).status_code, 200)
+        self.assertEqual(callbacks, [])
+        process_stripe_events('pi_test')
+        self.assertEqual(StripeEvent.objects.count(), 3)
+        self.assertEqual(CoversAllSubscription.objects.filter(user=self.user).count(), 1)
+
+    def test_unsigned_events_are_rejected(self):
+        self.assertEqual(self.deliver('evt_forged', 'payment_intent.succeeded', 100, secret='wrong').status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_event_is_acknowledged_when_it_cannot_be_queued(self):
+        with patch.object(process_stripe_events, 'delay', side_effect=OSError("broker unavailable")) as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.deliver('evt_succeeded', 'payment_intent.succeeded', 200)
+        self.assertEqual(response.status_code, 200)
+        delay.assert_called_once_with('pi_test')
+        # Left for requeue_stale_stripe_events
+        self.assertEqual(StripeEvent.objects.get(id='evt_succeeded').status, StripeEvent.Status.PENDING)
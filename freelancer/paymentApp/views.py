@@ -2,7 +2,7 @@ from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse, HttpResponse
 from listing.models import Listing
-from paymentApp.models import Payment, CoversAllSubscription
+from paymentApp.models import Payment, CoversAllSubscription, StripeEvent
 import json, stripe, logging
 from adminHandlers.models import CategoryPricing, Charges
 from django.conf import settings
@@ -17,7 +17,7 @@ from rest_framework import generics
 from accounts.permissions import IsAdminUser
 from accounts.pagination import CustomOffsetPagination
 from django.db.models import Prefetch, Q, OuterRef, Subquery 
-from datetime import datetime
+from datetime import datetime, timezone as dt_timezone
 from django.utils.timezone import make_aware, get_current_timezone
 from .serializers import PaymentSerializer, PaymentSerializerForSuperAd, CoversAllSubscriptionSerializer
 from rest_framework.permissions import IsAuthenticated
@@ -25,6 +25,7 @@ from rest_framework.decorators import permission_classes, api_view
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.exceptions import NotFound
+from .tasks import PAYMENT_INTENT_EVENTS, process_stripe_events
 
 
 
@@ -34,12 +35,12 @@ stripe.api_key = settings.STRIPE_SECRET_KEY
 
 
 def successful_payment(transaction_id=None):
-    payment = Payment.objects.filter(transaction_id=transaction_id).first()
-    if not payment or payment.status == "completed":
-        return   
-        
     try:
         with transaction.atomic():
+            # Locked, so the webhook consumer and a requery cannot both apply the same payment
+            payment = Payment.objects.select_for_update().filter(transaction_id=transaction_id).first()
+            if not payment or payment.status == "completed":
+                return
             
             ad = None
             if payment.super_ad:
@@ -168,6 +169,7 @@ def successful_payment(transaction_id=None):
             
     except Exception as e:
         logger.exception(f"Payment processing failed for transaction {transaction_id}: {e}") 
+        raise
 
 # Create your views here.
 
@@ -296,6 +298,14 @@ def create_payment_intent(request):
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def queue_stripe_events(payment_intent):
+    try:
+        process_stripe_events.delay(payment_intent)
+    except Exception as e:
+        # The event is stored and still pending: requeue_stale_stripe_events queues it later
+        logger.exception(f"Could not queue Stripe events of {payment_intent}: {e}")
+
+
 @csrf_exempt
 def stripe_webhook(request):
     payload = request.body
@@ -306,37 +316,25 @@ def stripe_webhook(request):
         event = stripe.Webhook.construct_event(
             payload, sig_header, webhook_secret
         )
-    except (ValueError, stripe.error.SignatureVerificationError):
+    except (ValueError, stripe.SignatureVerificationError):
         return HttpResponse(status=400)
 
-    # Step 1: Successful payment
-    if event["type"] == "payment_intent.succeeded":
-        intent = event["data"]["object"]
-        transaction_id = intent["id"]
-        
-        try:
-            successful_payment(transaction_id)
-        except Exception as e:
-            logger.exception(f"Error processing successful payment for transaction {transaction_id}: {e}")
-            # send mail to admin
-            
-            return HttpResponse(status=500)
-        
-    
-    # Step 2: Failed payment
-    elif event["type"] == "payment_intent.payment_failed":
-        intent = event["data"]["object"]
-        transaction_id = intent["id"]
-        print('Failed payment: ', intent)
-
-        Payment.objects.filter(transaction_id=transaction_id).update(status="failed")
-    
-    elif event['type'] == "payment_intent.canceled":
-        intent = event["data"]["object"]
-        transaction_id = intent["id"]
-        print('Canceled payment: ', intent)
-        
-        Payment.objects.filter(transaction_id=transaction_id).update(status="canceled")
+    # Only store the event here; process_stripe_events applies it (see paymentApp.tasks)
+    payment_intent = event["data"]["object"]["id"] if event["type"] in PAYMENT_INTENT_EVENTS else None
+    stripe_event, _ = StripeEvent.objects.get_or_create(
+        id=event["id"],
+        defaults={
+            "type": event["type"],
+            "payment_intent": payment_intent,
+            "payload": json.loads(payload),
+            "created": datetime.fromtimestamp(event["created"], tz=dt_timezone.utc),
+            "status": StripeEvent.Status.PENDING if payment_intent else StripeEvent.Status.IGNORED,
+        },
+    )
+
+    # A redelivered event that is still pending is queued again, in case its first consumer was lost
+    if stripe_event.status == StripeEvent.Status.PENDING:
+        transaction.on_commit(lambda: queue_stripe_events(stripe_event.payment_intent))
         
     return HttpResponse(status=200)
 
@@ -381,6 +379,7 @@ def requery_payment_intent(request):
 class PaymentListView(generics.ListAPIView):
     permission_classes = [IsAdminUser]
     pagination_class = CustomOffsetPagination
+    cursor_ordering = ('-created_at', '-id')
     
     def get_serializer_class(self):
         ad_type = self.request.query_params.get('ad_type', 'regular_ads')
@@ -454,6 +453,7 @@ class PaymentListView(generics.ListAPIView):
 class UserPaymentListView(generics.ListAPIView):
     pagination_class = CustomOffsetPagination
     permission_classes = [IsAuthenticated]
+    cursor_ordering = ('-created_at', '-id')
     
     def get_serializer_class(self):
         ad_type = self.request.query_params.get('ad_type', 'regular_ads')
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0006_listing_listing_created_idx'),
+        ('supportApp', '0002_remove_supporttype_description_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['conversation', 'created_at', 'id'], name='chat_conversation_created_idx'),
+        ),
+    ]
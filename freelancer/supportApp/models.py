@@ -31,6 +31,11 @@ class Chat(models.Model):
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='chats', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True) 
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'created_at', 'id'], name='chat_conversation_created_idx'),
+        ]
 
 
 class SupportType(models.Model):
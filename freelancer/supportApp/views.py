@@ -32,6 +32,10 @@ class ChatViewSet(viewsets.ModelViewSet):
     queryset = Chat.objects.all()
     serializer_class = ChatSerializer
     permission_classes = [IsAuthenticated]
+    # Unpaginated as before, unless the client asks for a cursor page
+    pagination_class = CustomOffsetPagination
+    cursor_ordering = ('-created_at', '-id')
+    cursor_pagination_only = True
     
     # get the serializer class based on user role and conversation type
     def get_serializer_class(self):